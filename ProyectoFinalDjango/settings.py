@@ -20,11 +20,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'juego.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'juego.middleware.ShardMiddleware',
+    'juego.middleware.PerfiladoMiddleware',
+    'juego.middleware.RolesMiddleware',
+    'juego.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'juego.middleware.LogAccesosPersonajesMiddleware',
@@ -66,6 +71,72 @@ DATABASES = {
     }
 }
 
+# Replica de solo lectura opcional para las vistas marcadas con ``solo_lectura``
+if os.getenv('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('POSTGRES_REPLICA_HOST'),
+        'PORT': os.getenv('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Shards para Personaje, Inventario y Combate, repartidos por usuario_id.
+# Cada alias extra se configura con <ALIAS>_DB / <ALIAS>_HOST / <ALIAS>_PORT.
+SHARDS = [alias.strip() for alias in os.getenv('SHARDS', 'default').split(',') if alias.strip()]
+
+for _alias in SHARDS:
+    if _alias not in DATABASES:
+        _prefijo = _alias.upper()
+        DATABASES[_alias] = {
+            **DATABASES['default'],
+            'NAME': os.getenv(f'{_prefijo}_DB', _alias),
+            'HOST': os.getenv(f'{_prefijo}_HOST', DATABASES['default']['HOST']),
+            'PORT': os.getenv(f'{_prefijo}_PORT', DATABASES['default']['PORT']),
+        }
+
+DATABASE_ROUTERS = ['juego.routers.ShardRouter', 'juego.routers.ReplicaRouter']
+
+# Segundos que una sesion lee del primario despues de escribir
+REPLICA_PEGADO_SEGUNDOS = int(os.getenv('REPLICA_PEGADO_SEGUNDOS', '5'))
+
+# Las sesiones usan su propia cache; con varios workers debe ser compartida (REDIS_URL)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sesiones': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sesiones',
+    },
+    # Roles de cada usuario; sin Redis cada worker tiene la suya y caduca en segundos
+    'roles': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'KEY_PREFIX': 'roles',
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'roles',
+    },
+    # Version del catalogo que rotan las señales; sin Redis caduca en segundos
+    'catalogo': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'KEY_PREFIX': 'catalogo',
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogo',
+    },
+}
+
+SESSION_ENGINE = 'juego.sesiones'
+SESSION_CACHE_ALIAS = 'sesiones'
+# Las claves volatiles de la sesion (ultimo personaje, turnos de combate...)
+# se escriben en BD como mucho una vez por este intervalo
+SESSION_INTERVALO_ESCRITURA_BD = int(os.getenv('SESSION_INTERVALO_ESCRITURA_BD', '60'))
+
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -102,6 +173,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = 'juego:inicio-sesion'
 
+# Token opcional para que Prometheus lea /metricas/prometheus/ sin sesion de staff
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN')
+
+# Perfiles bajo demanda (X-Perfilar / ?_perfilar=1): directorio y cuantos se conservan
+PERFILES_DIRECTORIO = Path(os.getenv('PERFILES_DIRECTORIO', BASE_DIR / 'perfiles'))
+PERFILES_MAXIMO = int(os.getenv('PERFILES_MAXIMO', '50'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -116,10 +194,14 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        # Escritura en segundo plano: JSON por lineas, por lotes y con rotacion por tamaño
         'file': {
-            'class': 'logging.FileHandler',
+            'class': 'juego.log_handlers.ColaArchivoJsonHandler',
             'filename': BASE_DIR / 'accesos_personajes.log',
-            'formatter': 'verbose',
+            'max_bytes': 10 * 1024 * 1024,
+            'backup_count': 5,
+            'capacidad': 200,
+            'intervalo': 1.0,
         },
     },
     'loggers': {
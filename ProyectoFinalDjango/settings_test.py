@@ -0,0 +1,38 @@
+"""Configuracion de pruebas con SQLite: primario, replica y un segundo shard.
+
+La replica solo existe si se define ``SQLITE_REPLICA``; para simular retraso
+de replicacion basta apuntarla a una copia del fichero del primario. En los
+tests Django la trata como espejo de ``default`` pero con otra conexion, que
+no ve los datos de la transaccion de cada ``TestCase``: para ``manage.py
+test`` se deja sin definir.
+
+Los usuarios se reparten entre ``default`` y ``shard1``. Cada shard se migra
+con ``migrate --database=<alias>`` y se llena con ``sincronizar_shards``.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, LOGGING
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_PRIMARIO', BASE_DIR / 'db_primario.sqlite3'),
+    },
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_SHARD1', BASE_DIR / 'db_shard1.sqlite3'),
+    },
+}
+
+if os.getenv('SQLITE_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_REPLICA'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+SHARDS = ['default', 'shard1']
+
+# Los tests no deben dejar el log de accesos en el repositorio
+LOGGING['handlers']['file'] = {'class': 'logging.NullHandler'}
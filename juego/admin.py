@@ -1,29 +1,158 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
 from .forms import EnemigoForm, ZonaForm
-from .models import Enemigo, Inventario, Objeto, Personaje, Zona
+from .mantenimiento import desactivar_enemigos, dias_inactividad, retirar_personajes_inactivos, revivir_personajes
+from .models import AuditEvent, Combate, EntradaBotin, Enemigo, Inventario, Objeto, Personaje, Zona
+from .routers import alias_shards
+
+# Por debajo de estas filas un COUNT(*) exacto es barato
+UMBRAL_CONTEO_ESTIMADO = 100_000
+
+
+class PaginadorConteoEstimado(Paginator):
+    """Paginador que, sin filtros ni busqueda, usa la estimacion de filas de PostgreSQL.
+
+    ``pg_class.reltuples`` se actualiza con ANALYZE/autovacuum, asi que el
+    numero de paginas es aproximado en tablas enormes. Con filtros, en
+    otras bases de datos o en tablas pequeñas cuenta de verdad.
+    """
+
+    @cached_property
+    def count(self):
+        consulta = self.object_list
+        conexion = connections[consulta.db]
+        if conexion.vendor == 'postgresql' and not consulta.query.where:
+            with conexion.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [consulta.model._meta.db_table])
+                fila = cursor.fetchone()
+            if fila and fila[0] >= UMBRAL_CONTEO_ESTIMADO:
+                return int(fila[0])
+        return super().count
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Elige el shard que se lista; sin elegir, el de la cuenta de staff (ver ``ShardRouter``)."""
+
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in alias_shards()]
+
+    def queryset(self, request, queryset):
+        # AdminTablaGrande.get_queryset ya lo ha aplicado
+        return queryset
+
+
+class AdminTablaGrande(admin.ModelAdmin):
+    """Base para tablas repartidas por shard que crecen sin limite.
+
+    Sin conteos completos ni ``<select>`` con todas las filas; el shard se
+    elige con ``ShardFilter``.
+    """
+
+    paginator = PaginadorConteoEstimado
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_queryset(self, request):
+        # El formulario de edicion tambien usa __str__, que lee las FK
+        queryset = super().get_queryset(request).select_related(*self.list_select_related)
+        # Los ids se repiten entre shards: el shard elegido en el listado viaja
+        # a editar/borrar/historial en ``_changelist_filters``
+        filtros = QueryDict(request.GET.get('_changelist_filters', ''))
+        alias = request.GET.get(ShardFilter.parameter_name) or filtros.get(ShardFilter.parameter_name)
+        if alias in alias_shards():
+            queryset = queryset.using(alias)
+        return queryset
 
 
 @admin.register(Personaje)
-class PersonajeAdmin(admin.ModelAdmin):
-    pass
+class PersonajeAdmin(AdminTablaGrande):
+    list_display = ('nombre', 'usuario', 'nivel', 'estado', 'vida_actual', 'salud_maxima', 'fecha_creacion')
+    list_select_related = ('usuario',)
+    list_filter = (ShardFilter, 'estado')
+    search_fields = ('^nombre', '=usuario__username')
+    autocomplete_fields = ('usuario',)
+    readonly_fields = ('nivel', 'fecha_creacion', 'fecha_actualizacion')
+    actions = ('revivir', 'retirar_inactivos')
+
+    @admin.action(description='Revivir (vida al máximo)', permissions=['change'])
+    def revivir(self, request, queryset):
+        filas = revivir_personajes(queryset)
+        self.message_user(request, f"{filas} personajes revividos.", messages.SUCCESS)
+
+    @admin.action(description='Retirar los inactivos', permissions=['change'])
+    def retirar_inactivos(self, request, queryset):
+        filas = retirar_personajes_inactivos(queryset)
+        self.message_user(
+            request, f"{filas} personajes retirados (sin combates en {dias_inactividad()} días).", messages.SUCCESS
+        )
 
 
 @admin.register(Objeto)
 class ObjetoAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('nombre', 'tipo', 'rareza', 'slot', 'valor_venta')
+    list_filter = ('tipo', 'rareza')
+    search_fields = ('nombre',)
+    show_full_result_count = False
 
 
 @admin.register(Inventario)
-class InventarioAdmin(admin.ModelAdmin):
-    pass
+class InventarioAdmin(AdminTablaGrande):
+    list_display = ('personaje', 'objeto', 'cantidad', 'equipado', 'posicion_slot', 'fecha_adquisicion')
+    list_select_related = ('personaje', 'objeto')
+    list_filter = (ShardFilter, 'equipado')
+    autocomplete_fields = ('personaje', 'objeto')
+
+
+@admin.register(Combate)
+class CombateAdmin(AdminTablaGrande):
+    list_display = ('personaje', 'enemigo', 'zona', 'resultado', 'exp_ganada', 'botin', 'fecha_hora')
+    list_select_related = ('personaje', 'enemigo__zona', 'zona', 'botin')
+    list_filter = (ShardFilter, 'resultado')
+    raw_id_fields = ('personaje', 'enemigo', 'zona', 'botin')
+
+    def has_add_permission(self, request):
+        # Los combates solo los crea el juego
+        return False
+
+
+class EntradaBotinInline(admin.TabularInline):
+    model = EntradaBotin
+    fields = ('objeto', 'peso')
+    raw_id_fields = ('objeto',)
+    extra = 0
+
+
+class EntradaBotinZonaInline(EntradaBotinInline):
+    fk_name = 'zona'
+    verbose_name_plural = 'Botin de la zona (si el enemigo no tiene uno propio)'
+
+
+class EntradaBotinEnemigoInline(EntradaBotinInline):
+    fk_name = 'enemigo'
+    verbose_name_plural = 'Botin propio del enemigo'
 
 
 @admin.register(Zona)
 class ZonaAdmin(admin.ModelAdmin):
     form = ZonaForm
-    list_display = ('nombre', 'nivel', 'dificultad', 'activa')
+    inlines = [EntradaBotinZonaInline]
+    list_display = ('nombre', 'nivel', 'dificultad', 'activa', 'num_enemigos', 'num_jefes')
     list_filter = ('dificultad', 'activa')
     search_fields = ('nombre', 'descripcion')
+    actions = ('desactivar_sus_enemigos',)
+
+    @admin.action(description='Desactivar todos sus enemigos', permissions=['change'])
+    def desactivar_sus_enemigos(self, request, queryset):
+        zona_ids = list(queryset.values_list('pk', flat=True))
+        filas = desactivar_enemigos(Enemigo.objects.filter(zona_id__in=zona_ids))
+        self.message_user(request, f"{filas} enemigos desactivados.", messages.SUCCESS)
 
     def save_model(self, request, obj, form, change):
         if not change:
@@ -35,11 +164,33 @@ class ZonaAdmin(admin.ModelAdmin):
 @admin.register(Enemigo)
 class EnemigoAdmin(admin.ModelAdmin):
     form = EnemigoForm
+    inlines = [EntradaBotinEnemigoInline]
     list_display = ('nombre', 'tipo', 'rareza', 'zona', 'vida_maxima', 'activo')
     list_filter = ('tipo', 'rareza', 'zona', 'activo')
     search_fields = ('nombre', 'descripcion', 'zona__nombre')
+    actions = ('desactivar',)
+
+    @admin.action(description='Desactivar', permissions=['change'])
+    def desactivar(self, request, queryset):
+        filas = desactivar_enemigos(queryset)
+        self.message_user(request, f"{filas} enemigos desactivados.", messages.SUCCESS)
 
     def save_model(self, request, obj, form, change):
         if not change:
             obj.creada_por = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(AuditEvent)
+class AuditEventAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'tipo', 'usuario', 'ruta', 'metodo', 'accion', 'objeto_id', 'status_code')
+    list_filter = ('tipo', 'metodo', 'ruta')
+    search_fields = ('usuario__username', 'path')
+    list_select_related = ('usuario',)
+    date_hierarchy = 'fecha'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,95 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.core.signals import request_finished
+from django.db import DatabaseError
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 50
+INTERVALO_FLUSH = 5.0
+
+
+class BufferAuditoria:
+    """Acumula eventos de auditoria en memoria y los guarda con ``bulk_create``.
+
+    Registrar un evento es O(1); la escritura se hace por lotes cuando hay
+    ``tamano_lote`` eventos pendientes o han pasado ``intervalo`` segundos,
+    comprobado al registrar y al terminar cada peticion.
+    """
+
+    def __init__(self, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO_FLUSH):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._pendientes = []
+        self._lock = threading.Lock()
+        self._ultimo_flush = time.monotonic()
+
+    def _encolar(self, datos):
+        from .models import AuditEvent
+
+        with self._lock:
+            self._pendientes.append(AuditEvent(**datos))
+            lleno = len(self._pendientes) >= self.tamano_lote
+            vencido = time.monotonic() - self._ultimo_flush >= self.intervalo
+        return lleno or vencido
+
+    def _extraer_lote(self):
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+            self._ultimo_flush = time.monotonic()
+        return lote
+
+    def vencido(self):
+        with self._lock:
+            return bool(self._pendientes) and time.monotonic() - self._ultimo_flush >= self.intervalo
+
+    def flush_si_vencido(self):
+        return self.flush() if self.vencido() else 0
+
+    def registrar(self, **datos):
+        if self._encolar(datos):
+            self.flush()
+
+    async def aregistrar(self, **datos):
+        if self._encolar(datos):
+            await self.aflush()
+
+    def flush(self):
+        from .models import AuditEvent
+
+        lote = self._extraer_lote()
+        if not lote:
+            return 0
+        try:
+            AuditEvent.objects.bulk_create(lote, batch_size=self.tamano_lote)
+        except DatabaseError:
+            logger.exception("No se pudieron guardar %s eventos de auditoria", len(lote))
+            return 0
+        return len(lote)
+
+    async def aflush(self):
+        from .models import AuditEvent
+
+        lote = self._extraer_lote()
+        if not lote:
+            return 0
+        try:
+            await AuditEvent.objects.abulk_create(lote, batch_size=self.tamano_lote)
+        except DatabaseError:
+            logger.exception("No se pudieron guardar %s eventos de auditoria", len(lote))
+            return 0
+        return len(lote)
+
+
+buffer_auditoria = BufferAuditoria()
+atexit.register(buffer_auditoria.flush)
+
+
+@receiver(request_finished)
+def guardar_auditoria_vencida(sender, **kwargs):
+    # Sin esto los ultimos eventos esperarian al siguiente registrar(), quiza durante horas
+    buffer_auditoria.flush_si_vencido()
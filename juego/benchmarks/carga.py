@@ -0,0 +1,227 @@
+"""Jugadores simulados para ``manage.py simular_carga``.
+
+Cada jugador se registra, inicia sesion, crea un personaje y luego repite
+acciones elegidas al azar segun unos pesos. Puede hablar con la app WSGI en
+el mismo proceso (``django.test.Client``) o con un servidor real por HTTP.
+"""
+import http.cookiejar
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from django.conf import settings
+from django.core.signals import got_request_exception
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.urls import reverse
+
+from juego.auditoria import buffer_auditoria
+from juego.models import Inventario, Personaje
+
+PESOS_POR_DEFECTO = {'combate': 2, 'atacar': 6, 'curar': 1, 'equipar': 1}
+CLAVE_BLOQUEO_SQLITE = 'OperationalError: database is locked'
+
+_hilo = threading.local()
+
+
+def _anotar_excepcion(sender, request=None, **kwargs):
+    """Cuenta las excepciones de las vistas; solo se ven con la app en proceso."""
+    excepciones = getattr(_hilo, 'excepciones', None)
+    if excepciones is None:
+        return
+    exc = sys.exc_info()[1]
+    if exc is None:
+        return
+    clave = type(exc).__name__
+    if 'database is locked' in str(exc):
+        clave = CLAVE_BLOQUEO_SQLITE
+    excepciones[clave] = excepciones.get(clave, 0) + 1
+
+
+class TransporteWSGI:
+    """Peticiones contra la app en el propio proceso, sin red."""
+
+    def __init__(self, base_url=None):
+        # 'testserver' solo esta permitido bajo setup_test_environment
+        hosts = [h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*']
+        self.cliente = Client(raise_request_exception=False, HTTP_HOST=hosts[0] if hosts else 'localhost')
+
+    def peticion(self, metodo, ruta, datos=None):
+        response = self.cliente.post(ruta, datos or {}) if metodo == 'POST' else self.cliente.get(ruta)
+        return response.status_code, response.get('Location', '')
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class TransporteHTTP:
+    """Peticiones reales contra un servidor, con cookies y token CSRF."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _SinRedirecciones(),
+        )
+
+    def _csrf(self):
+        return next((c.value for c in self.cookies if c.name == 'csrftoken'), '')
+
+    def peticion(self, metodo, ruta, datos=None):
+        cuerpo = None
+        cabeceras = {}
+        if metodo == 'POST':
+            if not self._csrf():
+                self.peticion('GET', reverse('juego:inicio-sesion'))
+            cuerpo = urllib.parse.urlencode(datos or {}).encode()
+            cabeceras = {'X-CSRFToken': self._csrf(), 'Content-Type': 'application/x-www-form-urlencoded'}
+        solicitud = urllib.request.Request(self.base_url + ruta, data=cuerpo, headers=cabeceras, method=metodo)
+        try:
+            with self.opener.open(solicitud, timeout=30) as response:
+                response.read()
+                return response.status, response.headers.get('Location', '')
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code, error.headers.get('Location', '')
+        except OSError:
+            return 0, ''
+
+
+class JugadorSimulado:
+
+    def __init__(self, nombre, transporte, objetivos, pesos, semilla):
+        self.nombre = nombre
+        self.transporte = transporte
+        self.objetivos = objetivos
+        self.rnd = random.Random(semilla)
+        self.acciones = [accion for accion, peso in pesos.items() if peso > 0]
+        self.pesos = [pesos[accion] for accion in self.acciones]
+        self.registros = []
+        self.personaje_id = None
+        self.consumible_id = None
+        self.equipable_id = None
+        self.equipado = False
+        self.en_combate = False
+        self.usos_consumible = 0
+
+    def _pedir(self, accion, metodo, ruta, datos=None):
+        inicio = time.perf_counter()
+        status, location = self.transporte.peticion(metodo, ruta, datos)
+        self.registros.append((accion, (time.perf_counter() - inicio) * 1000, status))
+        return status, location
+
+    def preparar(self):
+        password = 'carga-123'
+        self._pedir('registro', 'POST', reverse('juego:registro'), {
+            'username': self.nombre, 'password': password, 'password_confirm': password,
+        })
+        self._pedir('logout', 'GET', reverse('juego:cerrar-sesion'))
+        self._pedir('login', 'POST', reverse('juego:inicio-sesion'), {'username': self.nombre, 'password': password})
+        self._pedir('crear_personaje', 'POST', reverse('juego:personaje-crear'), {'nombre': self.nombre[-20:]})
+
+        personaje = Personaje.objects.filter(usuario__username=self.nombre).values('id', 'usuario_id').first()
+        if personaje is None:
+            return False
+        self.personaje_id = personaje['id']
+        self.usuario_id = personaje['usuario_id']
+
+        for objeto_id in (self.objetivos['consumible'], self.objetivos['equipable']):
+            if objeto_id:
+                self._agregar(objeto_id)
+        items = dict(
+            Inventario.objects.del_usuario(self.usuario_id)
+            .filter(personaje_id=self.personaje_id)
+            .values_list('objeto_id', 'id')
+        )
+        self.consumible_id = items.get(self.objetivos['consumible'])
+        self.equipable_id = items.get(self.objetivos['equipable'])
+        return True
+
+    def _agregar(self, objeto_id, cantidad=50):
+        self._pedir('agregar_objeto', 'POST', reverse('juego:inventario-agregar', args=[self.personaje_id]), {
+            'objeto': objeto_id, 'cantidad': cantidad,
+        })
+
+    def _arena(self):
+        return reverse('juego:combate-arena', args=[self.personaje_id])
+
+    def combate(self):
+        if self.en_combate:
+            return self.atacar()
+        zona_id, enemigo_id = self.rnd.choice(self.objetivos['enemigos'])
+        status, location = self._pedir('iniciar_combate', 'POST', reverse('juego:combate-create', args=[self.personaje_id]), {
+            'zona': zona_id, 'enemigo': enemigo_id,
+        })
+        if status == 302 and location.rstrip('/').endswith('arena'):
+            self.en_combate = True
+            self._pedir('turno_enemigo', 'GET', self._arena())
+
+    def _turno(self, accion, datos):
+        status, location = self._pedir(accion, 'POST', self._arena(), datos)
+        if status == 302 and location.rstrip('/').endswith('arena'):
+            self._pedir('turno_enemigo', 'GET', self._arena())
+        else:
+            # Victoria (200) o combate terminado por el enemigo (redirige a crear)
+            self.en_combate = False
+
+    def atacar(self):
+        if not self.en_combate:
+            return self.combate()
+        self._turno('atacar', {'accion': 'atacar'})
+
+    def curar(self):
+        if not self.consumible_id:
+            return
+        if self.usos_consumible >= 45:
+            self._agregar(self.objetivos['consumible'])
+            self.usos_consumible = 0
+        self.usos_consumible += 1
+        if self.en_combate:
+            self._turno('curar', {'accion': 'usar_consumible', 'inventario_item_id': self.consumible_id})
+        else:
+            self._pedir('curar', 'POST', reverse('juego:inventario-usar', args=[self.personaje_id]), {
+                'inventario_item_id': self.consumible_id,
+            })
+
+    def equipar(self):
+        if not self.equipable_id:
+            return
+        self.equipado = not self.equipado
+        self._pedir('equipar', 'POST', reverse('juego:inventario-equipamiento', args=[self.personaje_id]), {
+            'inventario_item_id': self.equipable_id, 'accion': 'equipar' if self.equipado else 'desequipar',
+        })
+
+    def jugar(self, hasta=None, acciones=None):
+        hechas = 0
+        while (hasta is None or time.monotonic() < hasta) and (acciones is None or hechas < acciones):
+            getattr(self, self.rnd.choices(self.acciones, self.pesos)[0])()
+            hechas += 1
+
+
+def simular_jugador(config):
+    """Punto de entrada de cada hilo o proceso.
+
+    Devuelve ``{'registros': [(accion, ms, status), ...], 'excepciones': {...}}``.
+    """
+    close_old_connections()
+    got_request_exception.connect(_anotar_excepcion, dispatch_uid='juego.benchmarks.carga')
+    _hilo.excepciones = {}
+    try:
+        time.sleep(config['retraso'])
+        transporte = TransporteHTTP(config['url']) if config['url'] else TransporteWSGI()
+        jugador = JugadorSimulado(config['nombre'], transporte, config['objetivos'], config['pesos'], config['semilla'])
+        if jugador.preparar():
+            hasta = time.monotonic() + config['duracion'] if config['duracion'] else None
+            jugador.jugar(hasta=hasta, acciones=config['acciones'])
+        return {'registros': jugador.registros, 'excepciones': _hilo.excepciones}
+    finally:
+        _hilo.excepciones = None
+        if not config['url']:
+            buffer_auditoria.flush()
+        connections.close_all()
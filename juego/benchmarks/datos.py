@@ -0,0 +1,118 @@
+import random
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+
+from juego.models import Combate, Enemigo, Inventario, Objeto, Personaje, Zona
+from juego.routers import shard_para_usuario
+from juego.shards import replicar_referencia
+
+Usuario = get_user_model()
+
+TAMANO_LOTE = 500
+
+
+def _guardar_por_shard(modelo, objetos, usuario_id_de):
+    grupos = defaultdict(list)
+    for obj in objetos:
+        grupos[shard_para_usuario(usuario_id_de(obj))].append(obj)
+    for alias, lote in grupos.items():
+        modelo.objects.db_manager(alias).bulk_create(lote, batch_size=TAMANO_LOTE)
+
+
+def sembrar_datos(semilla=42, jugadores=20, zonas=5, enemigos_por_zona=20, objetos=30, combates_por_personaje=50):
+    """Crea un juego de datos reproducible y devuelve lo que usan los escenarios.
+
+    El jugador principal tiene un personaje casi inmortal, un consumible con
+    miles de unidades, un arma equipable y un enemigo de entrenamiento, para
+    que los escenarios se puedan repetir sin agotar nada.
+    """
+    rnd = random.Random(semilla)
+
+    admin = Usuario.objects.create_superuser('bench_admin', 'admin@bench.local', 'bench')
+    jugador = Usuario.objects.create_user('bench_jugador', password='bench')
+    otros = Usuario.objects.bulk_create([
+        Usuario(username=f'bench_{i:04d}', password='!') for i in range(jugadores - 1)
+    ])
+
+    lista_zonas = Zona.objects.bulk_create([
+        Zona(nombre=f'Zona {i}', nivel=i + 1, dificultad=rnd.choice(['normal', 'avanzado', 'dificil', 'pro']), creada_por=admin)
+        for i in range(zonas)
+    ])
+    enemigos = Enemigo.objects.bulk_create([
+        Enemigo(
+            nombre=f'Enemigo {zona.nivel}-{j}',
+            tipo='jefe' if j == 0 else 'normal',
+            zona=zona,
+            rareza=rnd.choice(['comun', 'raro', 'epico', 'legendario']),
+            creada_por=admin,
+            vida_maxima=rnd.randint(10, 200),
+            ataque=rnd.randint(1, 30),
+            defensa=rnd.randint(0, 15),
+            velocidad=rnd.randint(1, 20),
+            exp_otorgada=rnd.randint(5, 100),
+        )
+        for zona in lista_zonas for j in range(enemigos_por_zona)
+    ])
+    slots = ['arma', 'armadura', 'accesorio']
+    lista_objetos = Objeto.objects.bulk_create([
+        Objeto(
+            nombre=f'Objeto {i}', tipo='equipable', rareza=rnd.choice(['comun', 'raro', 'epico']),
+            efecto='Bonus', slot=slots[i % 3], bonus_ataque=rnd.randint(0, 10), bonus_defensa=rnd.randint(0, 10),
+        ) if i % 2 else Objeto(
+            nombre=f'Objeto {i}', tipo='consumible', rareza='comun', efecto='Cura', curacion_vida=rnd.randint(5, 50),
+        )
+        for i in range(objetos)
+    ])
+    # bulk_create no dispara las señales que copian la referencia a los shards
+    for modelo, filas in ((Usuario, otros), (Zona, lista_zonas), (Objeto, lista_objetos), (Enemigo, enemigos)):
+        replicar_referencia(modelo, [obj.pk for obj in filas])
+    # create() si replica al momento, asi que va despues: su zona ya debe estar en cada shard
+    entrenamiento = Enemigo.objects.create(
+        nombre='Muñeco de entrenamiento', tipo='normal', zona=lista_zonas[0], rareza='comun',
+        creada_por=admin, vida_maxima=1_000_000, ataque=1, defensa=0, velocidad=1, exp_otorgada=0,
+    )
+
+    consumible = next(o for o in lista_objetos if o.tipo == 'consumible')
+    arma = next(o for o in lista_objetos if o.slot == 'arma')
+
+    personajes = []
+    for usuario in [jugador, *otros]:
+        exp = rnd.randint(0, 9999)
+        personajes.append(Personaje(
+            usuario=usuario, nombre=usuario.username[:20], exp_actual=exp, nivel=Personaje.calcular_nivel_desde_exp(exp),
+            salud_maxima=50, vida_actual=rnd.randint(1, 50),
+        ))
+    heroe = personajes[0]
+    heroe.ataque, heroe.defensa, heroe.velocidad = 20, 100, 50
+    heroe.salud_maxima = heroe.vida_actual = 100_000
+    _guardar_por_shard(Personaje, personajes, lambda p: p.usuario_id)
+
+    inventario = [
+        Inventario(personaje=heroe, objeto=consumible, cantidad=1_000_000),
+        Inventario(personaje=heroe, objeto=arma, cantidad=1),
+    ]
+    for personaje in personajes[1:]:
+        for objeto in rnd.sample(lista_objetos, 3):
+            inventario.append(Inventario(personaje=personaje, objeto=objeto, cantidad=rnd.randint(1, 5)))
+    _guardar_por_shard(Inventario, inventario, lambda i: i.personaje.usuario_id)
+
+    combates = []
+    for personaje in personajes:
+        for _ in range(combates_por_personaje):
+            enemigo = rnd.choice(enemigos)
+            combates.append(Combate(
+                personaje=personaje, enemigo=enemigo, zona_id=enemigo.zona_id, tipo=enemigo.tipo,
+                resultado=rnd.choice(['victoria', 'derrota', 'huida']), exp_ganada=rnd.randint(0, 100),
+            ))
+    _guardar_por_shard(Combate, combates, lambda c: c.personaje.usuario_id)
+
+    return {
+        'admin': admin,
+        'jugador': jugador,
+        'personaje': heroe,
+        'zona': lista_zonas[0],
+        'enemigo_entrenamiento': entrenamiento,
+        'consumible': Inventario.objects.del_usuario(jugador).get(objeto=consumible),
+        'equipable': Inventario.objects.del_usuario(jugador).get(objeto=arma),
+    }
@@ -0,0 +1,121 @@
+import gc
+import math
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+# Diferencias de tiempo por debajo de esto se consideran ruido
+MARGEN_MINIMO_MS = 1.0
+
+
+def percentil(valores, cuantil):
+    """Percentil por rango mas cercano sobre una lista ya ordenada."""
+    if not valores:
+        return 0.0
+    indice = max(0, math.ceil(cuantil * len(valores)) - 1)
+    return valores[indice]
+
+
+def _contar_consultas(funcion):
+    with ExitStack() as pila:
+        capturas = [pila.enter_context(CaptureQueriesContext(conexion)) for conexion in connections.all()]
+        funcion()
+    return sum(len(captura) for captura in capturas)
+
+
+def medir_escenario(funcion, preparar, ctx, iteraciones=30, calentamiento=3, muestras=5):
+    """Tiempos, consultas y pico de memoria de un escenario.
+
+    Cada magnitud se mide en su propia pasada: capturar SQL o activar
+    ``tracemalloc`` falsearia los tiempos.
+    """
+    def ejecutar():
+        if preparar:
+            preparar(ctx)
+        funcion(ctx)
+
+    for _ in range(calentamiento):
+        ejecutar()
+
+    tiempos = []
+    for _ in range(iteraciones):
+        if preparar:
+            preparar(ctx)
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion(ctx)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+    consultas = []
+    for _ in range(muestras):
+        if preparar:
+            preparar(ctx)
+        consultas.append(_contar_consultas(lambda: funcion(ctx)))
+
+    picos = []
+    tracemalloc.start()
+    try:
+        for _ in range(muestras):
+            if preparar:
+                preparar(ctx)
+            gc.collect()
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            funcion(ctx)
+            _, pico = tracemalloc.get_traced_memory()
+            picos.append((pico - base) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    tiempos.sort()
+    picos.sort()
+    return {
+        'iteraciones': iteraciones,
+        'p50_ms': round(percentil(tiempos, 0.5), 3),
+        'p95_ms': round(percentil(tiempos, 0.95), 3),
+        'media_ms': round(sum(tiempos) / len(tiempos), 3),
+        # Mediana: una cache que caduca a mitad de las muestras no cuenta
+        'consultas': sorted(consultas)[len(consultas) // 2],
+        'asignaciones_kb': round(percentil(picos, 0.5), 1),
+    }
+
+
+def comparar(resultados, baseline):
+    """Lista de regresiones (texto) de ``resultados`` frente a ``baseline``.
+
+    Solo se comparan las consultas, que son deterministas; los tiempos y la
+    memoria varian entre ejecuciones y van en ``diferencias_rendimiento``.
+    """
+    regresiones = []
+    anteriores = baseline.get('escenarios', {})
+    for nombre, actual in resultados['escenarios'].items():
+        previo = anteriores.get(nombre)
+        if previo is not None and actual['consultas'] > previo['consultas']:
+            regresiones.append(f"{nombre}: consultas {previo['consultas']} -> {actual['consultas']}")
+    return regresiones
+
+
+def diferencias_rendimiento(resultados, baseline, umbral):
+    """Empeoramientos de tiempo y memoria por encima de ``umbral`` (0.3 = 30 %).
+
+    Los tiempos admiten ademas un margen absoluto minimo. Son orientativos:
+    el comando los muestra como aviso pero no falla por ellos.
+    """
+    diferencias = []
+    anteriores = baseline.get('escenarios', {})
+    for nombre, actual in resultados['escenarios'].items():
+        previo = anteriores.get(nombre)
+        if previo is None:
+            continue
+        for clave in ('p50_ms', 'p95_ms'):
+            limite = max(previo[clave] * (1 + umbral), previo[clave] + MARGEN_MINIMO_MS)
+            if actual[clave] > limite:
+                diferencias.append(f"{nombre}: {clave} {previo[clave]:.2f} -> {actual[clave]:.2f}")
+        if actual['asignaciones_kb'] > previo['asignaciones_kb'] * (1 + umbral):
+            diferencias.append(
+                f"{nombre}: asignaciones {previo['asignaciones_kb']:.0f} KB -> {actual['asignaciones_kb']:.0f} KB"
+            )
+    return diferencias
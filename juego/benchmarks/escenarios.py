@@ -0,0 +1,83 @@
+"""Escenarios medidos por ``manage.py benchmark``.
+
+Cada escenario recibe el contexto con los clientes y los datos sembrados y
+hace una o varias peticiones. ``preparar`` se ejecuta antes de cada
+iteracion y no cuenta en la medicion.
+"""
+from django.urls import reverse
+
+from juego.views import _combate_state_key
+
+ESCENARIOS = {}
+
+
+def escenario(nombre, preparar=None):
+    def registrar(funcion):
+        ESCENARIOS[nombre] = (funcion, preparar)
+        return funcion
+    return registrar
+
+
+def _comprobar(response, *esperados):
+    if response.status_code not in esperados:
+        raise AssertionError(f"{response.request['PATH_INFO']} devolvio {response.status_code}")
+    return response
+
+
+def _arena(ctx):
+    return reverse('juego:combate-arena', args=[ctx['personaje'].id])
+
+
+def _preparar_combate(ctx):
+    """Deja un combate abierto contra el muñeco con el turno del personaje."""
+    cliente = ctx['cliente']
+    estado = cliente.session.get(_combate_state_key(ctx['personaje'].id))
+    if estado and estado['turno'] == 'personaje':
+        return
+    if not estado:
+        _comprobar(cliente.post(
+            reverse('juego:combate-create', args=[ctx['personaje'].id]),
+            {'zona': ctx['zona'].id, 'enemigo': ctx['enemigo_entrenamiento'].id},
+        ), 302)
+    _comprobar(cliente.get(_arena(ctx)), 200)
+
+
+@escenario('combate_turno', preparar=_preparar_combate)
+def combate_turno(ctx):
+    # Turno del personaje (POST) y turno del enemigo (GET de la arena)
+    _comprobar(ctx['cliente'].post(_arena(ctx), {'accion': 'atacar'}), 302)
+    _comprobar(ctx['cliente'].get(_arena(ctx)), 200)
+
+
+@escenario('usar_consumible')
+def usar_consumible(ctx):
+    _comprobar(ctx['cliente'].post(
+        reverse('juego:inventario-usar', args=[ctx['personaje'].id]),
+        {'inventario_item_id': ctx['consumible'].id},
+    ), 302)
+
+
+@escenario('equipamiento')
+def equipamiento(ctx):
+    ctx['equipado'] = not ctx.get('equipado', False)
+    _comprobar(ctx['cliente'].post(
+        reverse('juego:inventario-equipamiento', args=[ctx['personaje'].id]),
+        {'inventario_item_id': ctx['equipable'].id, 'accion': 'equipar' if ctx['equipado'] else 'desequipar'},
+    ), 302)
+
+
+def _get(nombre_url, cliente='cliente', con_personaje=False, kwarg='pk'):
+    def medir(ctx):
+        kwargs = {kwarg: ctx['personaje'].id} if con_personaje else {}
+        _comprobar(ctx[cliente].get(reverse(nombre_url, kwargs=kwargs)), 200)
+    return medir
+
+
+escenario('detalle_personaje')(_get('juego:personaje-detalle', con_personaje=True))
+escenario('inventario')(_get('juego:inventario-ver', con_personaje=True, kwarg='personaje_id'))
+escenario('estadisticas')(_get('juego:estadisticas'))
+escenario('estadisticas_admin')(_get('juego:estadisticas', cliente='cliente_admin'))
+escenario('lista_personajes')(_get('juego:personaje-lista'))
+escenario('lista_zonas')(_get('juego:zona-list'))
+escenario('lista_enemigos')(_get('juego:enemigo-list'))
+escenario('lista_combates')(_get('juego:combate-list', con_personaje=True, kwarg='personaje_id'))
@@ -0,0 +1,250 @@
+"""Generador de datos sinteticos a gran escala para ``manage.py generar_datos``.
+
+Se salta ``save()`` (y con el ``full_clean()`` por fila de ``Objeto`` e
+``Inventario``): las filas se construyen ya validas respecto a las
+restricciones del modelo y se escriben con ``bulk_create`` por lotes o, en
+PostgreSQL, con ``COPY`` desde un buffer en memoria.
+"""
+import csv
+import io
+import random
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+from juego.catalogo import actualizar_resumen_zonas
+from juego.models import Combate, Enemigo, Inventario, Objeto, Personaje, Zona
+from juego.routers import shard_para_usuario
+from juego.shards import replicar_referencia
+
+Usuario = get_user_model()
+
+RAREZAS = ['comun', 'raro', 'epico', 'legendario']
+PESOS_RAREZA = [60, 25, 10, 5]
+SLOTS = [slot for slot, _ in Objeto.SLOTS_CHOICES]
+DIFICULTADES = [dificultad for dificultad, _ in Zona.DIFICULTAD_CHOICES]
+
+
+@contextmanager
+def _sin_auto_now(*modelos):
+    """Respeta las fechas generadas: ``bulk_create`` aplicaria ``auto_now``."""
+    campos = [
+        campo for modelo in modelos for campo in modelo._meta.concrete_fields
+        if isinstance(campo, models.DateField) and (campo.auto_now or campo.auto_now_add)
+    ]
+    originales = [(campo, campo.auto_now, campo.auto_now_add) for campo in campos]
+    for campo in campos:
+        campo.auto_now = campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, auto_now, auto_now_add in originales:
+            campo.auto_now, campo.auto_now_add = auto_now, auto_now_add
+
+
+def _copy(alias, modelo, filas):
+    """``COPY ... FROM STDIN`` de instancias sin pk; la BD asigna los ids."""
+    if not filas:
+        return
+    conexion = connections[alias]
+    campos = [campo for campo in modelo._meta.concrete_fields if not campo.primary_key]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for obj in filas:
+        escritor.writerow([
+            '' if valor is None else valor
+            for valor in (campo.get_db_prep_save(getattr(obj, campo.attname), conexion) for campo in campos)
+        ])
+    buffer.seek(0)
+    sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        conexion.ops.quote_name(modelo._meta.db_table),
+        ', '.join(conexion.ops.quote_name(campo.column) for campo in campos),
+    )
+    with conexion.cursor() as cursor:
+        crudo = cursor.cursor
+        if hasattr(crudo, 'copy_expert'):
+            crudo.copy_expert(sql, buffer)
+        else:
+            with crudo.copy(sql) as copia:
+                copia.write(buffer.getvalue())
+
+
+class GeneradorDatos:
+    """Genera usuarios, catalogo, personajes, inventario y combates.
+
+    Todo sale de ``random.Random(semilla)``: con la misma semilla y los
+    mismos parametros se obtienen las mismas filas (las fechas son relativas
+    al momento de la ejecucion). Los usuarios se procesan
+    en tandas de ``lote`` para no tener millones de objetos en memoria.
+    """
+
+    def __init__(self, semilla=42, prefijo='gen', lote=5000, usar_copy=False, password='generado', dias=180):
+        self.rnd = random.Random(semilla)
+        self.prefijo = prefijo
+        self.lote = lote
+        self.usar_copy = usar_copy
+        self.hash_password = make_password(password)
+        self.ahora = timezone.now()
+        self.dias = dias
+        self.totales = defaultdict(int)
+
+    def _fecha(self, desde=None):
+        inicio = desde or self.ahora - timedelta(days=self.dias)
+        return inicio + (self.ahora - inicio) * self.rnd.random()
+
+    def _escribir(self, modelo, filas_por_alias, copy=False):
+        for alias, filas in filas_por_alias.items():
+            if copy:
+                for inicio in range(0, len(filas), self.lote):
+                    _copy(alias, modelo, filas[inicio:inicio + self.lote])
+            else:
+                modelo.objects.db_manager(alias).bulk_create(filas, batch_size=self.lote)
+            self.totales[modelo._meta.label] += len(filas)
+
+    def catalogo(self, creador, zonas, enemigos_por_zona, objetos):
+        niveles = sorted(self.rnd.sample(range(1, 101), min(zonas, 100)) + [self.rnd.randint(1, 100) for _ in range(zonas - 100)])
+        lista_zonas = [
+            Zona(
+                nombre=f'{self.prefijo} zona {i}', nivel=nivel, descripcion=f'Zona generada de nivel {nivel}',
+                dificultad=DIFICULTADES[min(3, (nivel - 1) // 25)], creada_por=creador,
+                fecha_creacion=self._fecha(), fecha_actualizacion=self.ahora,
+            )
+            for i, nivel in enumerate(niveles)
+        ]
+        self._escribir(Zona, {'default': lista_zonas})
+
+        lista_enemigos = []
+        for zona in lista_zonas:
+            for j in range(enemigos_por_zona):
+                jefe = j == 0
+                escala = zona.nivel * (3 if jefe else 1)
+                lista_enemigos.append(Enemigo(
+                    nombre=f'{self.prefijo} enemigo {zona.nivel}-{j}', tipo='jefe' if jefe else 'normal', zona=zona,
+                    rareza=self.rnd.choices(RAREZAS, PESOS_RAREZA)[0], creada_por=creador,
+                    vida_maxima=10 + escala * self.rnd.randint(5, 12), ataque=2 + escala * self.rnd.randint(1, 3),
+                    defensa=escala * self.rnd.randint(0, 2), velocidad=self.rnd.randint(1, 20 + zona.nivel // 5),
+                    exp_otorgada=5 + escala * self.rnd.randint(2, 6), oro_otorgado=escala * self.rnd.randint(0, 4),
+                    fecha_creacion=self._fecha(), fecha_actualizacion=self.ahora,
+                ))
+        self._escribir(Enemigo, {'default': lista_enemigos})
+        if self.usar_copy:
+            # COPY se salta el queryset que mantiene los contadores de la zona
+            actualizar_resumen_zonas([zona.pk for zona in lista_zonas])
+
+        lista_objetos = []
+        for i in range(objetos):
+            rareza = self.rnd.choices(RAREZAS, PESOS_RAREZA)[0]
+            potencia = RAREZAS.index(rareza) + 1
+            # Solo los equipables llevan slot y solo los consumibles curan
+            if i % 3 == 0:
+                objeto = Objeto(
+                    nombre=f'{self.prefijo} pocion {i}', tipo='consumible', rareza=rareza, efecto='Restaura vida',
+                    curacion_vida=10 * potencia + self.rnd.randint(0, 20), valor_venta=5 * potencia,
+                )
+            else:
+                objeto = Objeto(
+                    nombre=f'{self.prefijo} equipo {i}', tipo='equipable', rareza=rareza, efecto='Mejora atributos',
+                    slot=SLOTS[i % len(SLOTS)], valor_venta=20 * potencia,
+                    bonus_ataque=self.rnd.randint(0, 4 * potencia), bonus_defensa=self.rnd.randint(0, 4 * potencia),
+                    bonus_salud=self.rnd.randint(0, 10 * potencia), bonus_velocidad=self.rnd.randint(0, potencia),
+                )
+            objeto.fecha_creacion = self._fecha()
+            lista_objetos.append(objeto)
+        self._escribir(Objeto, {'default': lista_objetos})
+
+        # bulk_create no dispara las señales que copian la referencia a los shards
+        for modelo, filas in ((Zona, lista_zonas), (Objeto, lista_objetos), (Enemigo, lista_enemigos)):
+            replicar_referencia(modelo, [obj.pk for obj in filas])
+        return lista_enemigos, lista_objetos
+
+    def _personaje(self, usuario, nombre, estado):
+        exp = min(9999, int(self.rnd.expovariate(1 / 1500)))
+        nivel = Personaje.calcular_nivel_desde_exp(exp)
+        # Mismos atributos que tendria tras subir de nivel jugando
+        salud_maxima = 50 + nivel - 1
+        creado = self._fecha()
+        return Personaje(
+            usuario=usuario, nombre=nombre, exp_actual=exp, nivel=nivel,
+            ataque=10 + nivel - 1, defensa=10 + nivel - 1, velocidad=10 + nivel - 1,
+            salud_maxima=salud_maxima, vida_actual=self.rnd.randint(0, salud_maxima),
+            estado=estado, fecha_creacion=creado, fecha_actualizacion=self._fecha(creado),
+        )
+
+    def _inventario(self, personaje, objetos, cantidad_media):
+        filas = []
+        ocupados = set()
+        for objeto in self.rnd.sample(objetos, min(len(objetos), self.rnd.randint(0, 2 * cantidad_media))):
+            # Como mucho un objeto equipado por slot
+            equipar = objeto.tipo == 'equipable' and objeto.slot not in ocupados and self.rnd.random() < 0.5
+            if equipar:
+                ocupados.add(objeto.slot)
+            filas.append(Inventario(
+                personaje_id=personaje.pk, objeto_id=objeto.pk,
+                cantidad=self.rnd.randint(1, 20) if objeto.tipo == 'consumible' else 1,
+                equipado=equipar, posicion_slot=objeto.slot if equipar else None,
+                fecha_adquisicion=self._fecha(personaje.fecha_creacion),
+            ))
+        return filas
+
+    def _combates(self, personaje, enemigos, objetos, cantidad_media):
+        filas = []
+        for _ in range(self.rnd.randint(0, 2 * cantidad_media)):
+            enemigo = self.rnd.choice(enemigos)
+            resultado = self.rnd.choices(['victoria', 'derrota', 'huida'], [60, 30, 10])[0]
+            victoria = resultado == 'victoria'
+            filas.append(Combate(
+                personaje_id=personaje.pk, enemigo_id=enemigo.pk, zona_id=enemigo.zona_id, tipo=enemigo.tipo,
+                resultado=resultado, exp_ganada=enemigo.exp_otorgada if victoria else 0,
+                botin_id=self.rnd.choice(objetos).pk if victoria and objetos and self.rnd.random() < 0.1 else None,
+                fecha_hora=self._fecha(personaje.fecha_creacion),
+            ))
+        return filas
+
+    def jugadores(self, usuarios, personajes_por_usuario, inventario_medio, combates_medio, enemigos, objetos):
+        for inicio in range(0, usuarios, self.lote):
+            fin = min(usuarios, inicio + self.lote)
+            lista_usuarios = [
+                Usuario(
+                    username=f'{self.prefijo}_{i:07d}', password=self.hash_password,
+                    email=f'{self.prefijo}_{i:07d}@generado.local', date_joined=self._fecha(),
+                )
+                for i in range(inicio, fin)
+            ]
+            self._escribir(Usuario, {'default': lista_usuarios})
+            replicar_referencia(Usuario, [u.pk for u in lista_usuarios])
+
+            personajes = defaultdict(list)
+            for usuario in lista_usuarios:
+                for n in range(personajes_por_usuario):
+                    # Un unico personaje activo por usuario
+                    personajes[shard_para_usuario(usuario.pk)].append(
+                        self._personaje(usuario, f'{usuario.username[-12:]}-{n}', 'activo' if n == 0 else 'retirado')
+                    )
+            with ExitStack() as pila:
+                for alias in personajes:
+                    pila.enter_context(transaction.atomic(using=alias))
+                self._escribir(Personaje, personajes)
+                self._escribir(Inventario, {
+                    alias: [fila for p in lista for fila in self._inventario(p, objetos, inventario_medio)]
+                    for alias, lista in personajes.items()
+                }, copy=self.usar_copy)
+                self._escribir(Combate, {
+                    alias: [fila for p in lista for fila in self._combates(p, enemigos, objetos, combates_medio)]
+                    for alias, lista in personajes.items()
+                }, copy=self.usar_copy)
+            yield fin
+
+    def generar(self, creador, usuarios, zonas=20, enemigos_por_zona=25, objetos=200,
+                personajes_por_usuario=1, inventario_medio=8, combates_medio=20):
+        """Genera todo; es un iterador que devuelve los usuarios ya procesados."""
+        with _sin_auto_now(Usuario, Zona, Enemigo, Objeto, Personaje, Inventario, Combate):
+            enemigos, objetos_generados = self.catalogo(creador, zonas, enemigos_por_zona, objetos)
+            yield 0
+            yield from self.jugadores(
+                usuarios, personajes_por_usuario, inventario_medio, combates_medio, enemigos, objetos_generados,
+            )
@@ -0,0 +1,137 @@
+"""Tablas de botin y entrega de objetos al inventario.
+
+Cada enemigo usa sus ``EntradaBotin`` propias, o las de su zona si no tiene;
+sin ninguna de las dos se sortea entre todos los objetos segun su rareza.
+Las tablas son arrays de pesos acumulados que se construyen una vez por
+version del catalogo, asi que tirar el botin es una busqueda binaria.
+"""
+import bisect
+import itertools
+import random
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import F
+from django.utils import timezone
+
+from .catalogo import TablasPorVersion
+from .encuentros import pesos_rareza
+from .models import EntradaBotin, Inventario, Objeto
+
+# Probabilidad de que un enemigo suelte algo al ser derrotado; los jefes siempre sueltan
+PROBABILIDAD_BOTIN = {
+    'comun': 0.2,
+    'raro': 0.35,
+    'epico': 0.5,
+    'legendario': 0.75,
+}
+
+
+class TablaBotin:
+    """Sorteo ponderado con pesos acumulados y ``bisect``: O(log n) por tirada."""
+
+    __slots__ = ('objetos', 'acumulados')
+
+    def __init__(self, objetos, pesos):
+        if not objetos or len(objetos) != len(pesos) or min(pesos) <= 0:
+            raise ValueError("Hacen falta tantos pesos positivos como objetos, y al menos uno.")
+        self.objetos = list(objetos)
+        self.acumulados = list(itertools.accumulate(pesos))
+
+    def __len__(self):
+        return len(self.objetos)
+
+    def elegir(self, rng=random):
+        return self.objetos[bisect.bisect_right(self.acumulados, rng.random() * self.acumulados[-1])]
+
+
+def _construir_tablas():
+    por_enemigo = defaultdict(lambda: ([], []))
+    por_zona = defaultdict(lambda: ([], []))
+    entradas = EntradaBotin.objects.order_by('id').values_list('enemigo_id', 'zona_id', 'objeto_id', 'peso')
+    for enemigo_id, zona_id, objeto_id, peso in entradas:
+        objetos, pesos = por_enemigo[enemigo_id] if enemigo_id is not None else por_zona[zona_id]
+        objetos.append(objeto_id)
+        pesos.append(peso)
+
+    general = None
+    pesos_por_rareza = pesos_rareza()
+    objetos = [
+        (objeto_id, pesos_por_rareza.get(rareza, 0))
+        for objeto_id, rareza in Objeto.objects.order_by('id').values_list('id', 'rareza')
+    ]
+    objetos = [(objeto_id, peso) for objeto_id, peso in objetos if peso > 0]
+    if objetos:
+        general = TablaBotin(*zip(*objetos))
+
+    return {
+        'enemigos': {clave: TablaBotin(*valores) for clave, valores in por_enemigo.items()},
+        'zonas': {clave: TablaBotin(*valores) for clave, valores in por_zona.items()},
+        'general': general,
+    }
+
+
+tablas_botin = TablasPorVersion(_construir_tablas)
+
+
+def tabla_para(enemigo):
+    tablas = tablas_botin.obtener()
+    return tablas['enemigos'].get(enemigo.id) or tablas['zonas'].get(enemigo.zona_id) or tablas['general']
+
+
+def tirar_botin(enemigo, rng=random):
+    """Id del objeto que suelta ``enemigo`` al ser derrotado, o None."""
+    if enemigo.tipo != 'jefe' and rng.random() >= PROBABILIDAD_BOTIN.get(enemigo.rareza, 0):
+        return None
+    tabla = tabla_para(enemigo)
+    if tabla is None:
+        return None
+    return tabla.elegir(rng)
+
+
+def conceder_botin(personaje, cantidades):
+    """Suma ``cantidades`` ({objeto_id: n}) al inventario del personaje.
+
+    En PostgreSQL y SQLite es un unico ``INSERT ... ON CONFLICT DO UPDATE``
+    para todos los objetos. Debe llamarse dentro de la transaccion que
+    guarda el resultado del combate.
+    """
+    cantidades = {objeto_id: cantidad for objeto_id, cantidad in cantidades.items() if cantidad > 0}
+    if not cantidades:
+        return
+    alias = personaje._state.db or router.db_for_write(Inventario, instance=personaje)
+    connection = connections[alias]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        _conceder_botin_generico(personaje, cantidades, alias)
+        return
+
+    opciones = Inventario._meta
+    tabla = connection.ops.quote_name(opciones.db_table)
+    columnas = [
+        connection.ops.quote_name(opciones.get_field(nombre).column)
+        for nombre in ('personaje', 'objeto', 'cantidad', 'equipado', 'fecha_adquisicion')
+    ]
+    cantidad = columnas[2]
+    ahora = opciones.get_field('fecha_adquisicion').get_db_prep_value(timezone.now(), connection)
+    parametros = []
+    for objeto_id, total in sorted(cantidades.items()):
+        parametros.extend([personaje.pk, objeto_id, total, False, ahora])
+    filas = ', '.join(['(%s, %s, %s, %s, %s)'] * len(cantidades))
+    sql = (
+        f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES {filas} "
+        f"ON CONFLICT ({columnas[0]}, {columnas[1]}) "
+        f"DO UPDATE SET {cantidad} = {tabla}.{cantidad} + EXCLUDED.{cantidad}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+
+
+def _conceder_botin_generico(personaje, cantidades, alias):
+    for objeto_id, total in cantidades.items():
+        _, creado = Inventario.objects.using(alias).get_or_create(
+            personaje=personaje, objeto_id=objeto_id, defaults={'cantidad': total},
+        )
+        if not creado:
+            Inventario.objects.using(alias).filter(personaje=personaje, objeto_id=objeto_id).update(
+                cantidad=F('cantidad') + total
+            )
@@ -0,0 +1,7 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def es_compartida(cache):
+    """True si todos los workers ven los mismos datos en ``cache`` (Redis, Memcached, BD...)."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -0,0 +1,156 @@
+import hashlib
+import threading
+import uuid
+
+from django.core.cache import cache, caches
+from django.db.models import Count, Max
+
+from .caches import es_compartida
+from .models import Enemigo, Zona
+from .shards import replicar_referencia
+
+CACHE_TIMEOUT_CATALOGO = 60 * 60
+
+CACHE_CATALOGO = 'catalogo'
+CLAVE_VERSION_CATALOGO = 'catalogo:version'
+# Con una cache por proceso ``invalidar_catalogo`` solo avisa al worker que
+# hace el cambio; los demas reconstruyen sus tablas al caducar la version
+CACHE_TIMEOUT_VERSION_LOCAL = 5
+
+
+def firma_catalogo():
+    """Devuelve (ultima_modificacion, firma) del catalogo de zonas y enemigos.
+
+    Son dos agregados baratos (COUNT + MAX) que cambian al crear, editar o
+    borrar cualquier zona o enemigo.
+    """
+    zonas = Zona.objects.aggregate(total=Count('id'), ultima=Max('fecha_actualizacion'))
+    enemigos = Enemigo.objects.aggregate(total=Count('id'), ultima=Max('fecha_actualizacion'))
+
+    ultima = max(
+        (fecha for fecha in (zonas['ultima'], enemigos['ultima']) if fecha),
+        default=None,
+    )
+    firma = f"{zonas['total']}:{zonas['ultima']}:{enemigos['total']}:{enemigos['ultima']}"
+    return ultima, firma
+
+
+async def afirma_catalogo():
+    """Version async de ``firma_catalogo``."""
+    zonas = await Zona.objects.aaggregate(total=Count('id'), ultima=Max('fecha_actualizacion'))
+    enemigos = await Enemigo.objects.aaggregate(total=Count('id'), ultima=Max('fecha_actualizacion'))
+
+    ultima = max(
+        (fecha for fecha in (zonas['ultima'], enemigos['ultima']) if fecha),
+        default=None,
+    )
+    firma = f"{zonas['total']}:{zonas['ultima']}:{enemigos['total']}:{enemigos['ultima']}"
+    return ultima, firma
+
+
+def clave_cache_catalogo(prefijo, firma):
+    return f"{prefijo}:{hashlib.md5(firma.encode()).hexdigest()}"
+
+
+def _cache_version():
+    return caches[CACHE_CATALOGO]
+
+
+def timeout_version_catalogo():
+    return None if es_compartida(_cache_version()) else CACHE_TIMEOUT_VERSION_LOCAL
+
+
+def version_catalogo():
+    """Token que cambia con cualquier alta, edicion o baja de zonas, enemigos, objetos o botin.
+
+    Vive en la cache ``catalogo`` y lo rotan las señales de ``juego.signals``;
+    leerlo no toca la BD. Si una cache compartida lo pierde se reconstruye con
+    la firma. Con una cache por proceso se genera uno nuevo al caducar, porque
+    la firma no ve las ediciones de objetos y botin hechas en otro worker.
+    """
+    cache_version = _cache_version()
+    version = cache_version.get(CLAVE_VERSION_CATALOGO)
+    if version is None:
+        if es_compartida(cache_version):
+            version = clave_cache_catalogo('firma', firma_catalogo()[1])
+        else:
+            version = uuid.uuid4().hex
+        cache_version.add(CLAVE_VERSION_CATALOGO, version, timeout_version_catalogo())
+        version = cache_version.get(CLAVE_VERSION_CATALOGO, version)
+    return version
+
+
+def invalidar_catalogo():
+    _cache_version().set(CLAVE_VERSION_CATALOGO, uuid.uuid4().hex, timeout_version_catalogo())
+
+
+class TablasPorVersion:
+    """Estructuras derivadas del catalogo, en memoria del proceso.
+
+    ``construir`` se llama la primera vez y cada vez que cambia
+    ``version_catalogo``; entre medias ``obtener`` solo lee la version.
+    """
+
+    def __init__(self, construir):
+        self._construir = construir
+        self._lock = threading.Lock()
+        self._version = None
+        self._tablas = None
+
+    def obtener(self):
+        version = version_catalogo()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._tablas = self._construir()
+                    self._version = version
+        return self._tablas
+
+    def limpiar(self):
+        with self._lock:
+            self._version = None
+            self._tablas = None
+
+
+def actualizar_resumen_zonas(zona_ids=None, using='default'):
+    """Recalcula los contadores de enemigos de ``zona_ids`` (todas si None) y los copia a los shards.
+
+    Devuelve cuantas zonas se han actualizado.
+    """
+    zonas = Zona.objects.using(using)
+    if zona_ids is not None:
+        zona_ids = [pk for pk in set(zona_ids) if pk is not None]
+        if not zona_ids:
+            return 0
+        zonas = zonas.filter(pk__in=zona_ids)
+    actualizadas = zonas.recalcular_resumen()
+    replicar_referencia(Zona, zona_ids if zona_ids is not None else list(zonas.values_list('pk', flat=True)), origen=using)
+    return actualizadas
+
+
+def firma_enemigos_zona(zona_id):
+    """Firma (COUNT + MAX) de los enemigos de una zona; cambia con altas, bajas y ediciones."""
+    datos = Enemigo.objects.filter(zona_id=zona_id).aggregate(
+        total=Count('id'), ultima=Max('fecha_actualizacion')
+    )
+    return f"{zona_id}:{datos['total']}:{datos['ultima']}"
+
+
+def enemigos_activos_zona(zona_id, firma=None):
+    """Lista cacheada con los enemigos activos de una zona, como dicts compactos.
+
+    La clave incluye la firma de la zona, asi que cualquier cambio en sus
+    enemigos invalida la cache sin necesidad de borrarla a mano.
+    """
+    if firma is None:
+        firma = firma_enemigos_zona(zona_id)
+    clave = clave_cache_catalogo('enemigos_zona', firma)
+    enemigos = cache.get(clave)
+    if enemigos is None:
+        enemigos = list(
+            Enemigo.objects.filter(zona_id=zona_id, activo=True)
+            .order_by('tipo', 'nombre')
+            .values('id', 'nombre', 'tipo')
+        )
+        cache.set(clave, enemigos, CACHE_TIMEOUT_CATALOGO)
+    return enemigos
@@ -0,0 +1,260 @@
+"""Reglas de combate compartidas por la arena y los calculos de probabilidad.
+
+El daño de un golpe es uniforme entre el 60% y el 100% del ataque, menos
+``defensa // 4`` y como minimo 1. Los turnos se alternan desde el mas
+rapido, asi que quien gana solo depende de cuantos golpes necesita cada uno:
+``estimar_victoria`` calcula esas dos distribuciones por programacion
+dinamica sobre la vida restante y las cruza, sin simular.
+"""
+import itertools
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+# Por encima de (vida x golpes) celdas se usa la aproximacion normal
+LIMITE_CELDAS_EXACTO = 2_000_000
+
+Luchador = namedtuple('Luchador', 'vida ataque defensa velocidad')
+Golpes = namedtuple('Golpes', 'minimo cdf')
+
+
+def rango_golpe(ataque):
+    """Daño base minimo y maximo antes de la defensa."""
+    return int(ataque * 0.6), ataque
+
+
+def reduccion_defensa(defensa):
+    return defensa // 4
+
+
+def stats_efectivos(personaje):
+    """Returns effective stats including bonuses from equipped inventory items."""
+    ataque = personaje.ataque
+    defensa = personaje.defensa
+    velocidad = personaje.velocidad
+    # Robust health handling
+    base_vida = personaje.vida_actual if personaje.vida_actual is not None else personaje.salud_maxima
+    vida = base_vida
+
+    arma = None
+    armadura = None
+    for inv in personaje.inventario_items.filter(equipado=True).select_related('objeto'):
+        obj = inv.objeto
+        ataque += obj.bonus_ataque
+        defensa += obj.bonus_defensa
+        velocidad += obj.bonus_velocidad
+        vida += obj.bonus_salud
+        if obj.slot == 'arma':
+            arma = obj.nombre
+        elif obj.slot == 'armadura':
+            armadura = obj.nombre
+
+    return {
+        'ataque': ataque,
+        'defensa': defensa,
+        'velocidad': velocidad,
+        'vida_actual': vida,
+        'vida_max': personaje.salud_maxima + (vida - base_vida),
+        'arma': arma,
+        'armadura': armadura
+    }
+
+
+@lru_cache(maxsize=1024)
+def distribucion_danio(ataque, defensa):
+    """(probabilidad de 1, minimo, maximo, probabilidad de cada valor en [minimo, maximo]).
+
+    Los golpes que la defensa dejaria por debajo de 1 se acumulan en 1; el
+    resto es uniforme en ``[minimo, maximo]`` (vacio si ``minimo > maximo``).
+    """
+    base_min, base_max = rango_golpe(ataque)
+    reduccion = reduccion_defensa(defensa)
+    casos = base_max - base_min + 1
+    en_uno = max(0, min(base_max, reduccion + 1) - base_min + 1)
+    return en_uno / casos, max(2, base_min - reduccion), base_max - reduccion, 1 / casos
+
+
+def _extremos_danio(ataque, defensa):
+    prob_uno, minimo, maximo, _ = distribucion_danio(ataque, defensa)
+    return (1 if prob_uno else minimo), max(1, maximo)
+
+
+def _rango_golpes(ataque, defensa, vida):
+    danio_min, danio_max = _extremos_danio(ataque, defensa)
+    return -(-vida // danio_max), -(-vida // danio_min)
+
+
+@lru_cache(maxsize=4096)
+def golpes_necesarios(ataque, defensa, vida):
+    """Distribucion del numero de golpes para quitar ``vida`` puntos.
+
+    ``cdf[i]`` es la probabilidad de lograrlo en ``minimo + i`` golpes o menos.
+    """
+    return golpes_por_vida(ataque, defensa, (vida,))[vida]
+
+
+def golpes_por_vida(ataque, defensa, vidas):
+    """``golpes_necesarios`` para varias vidas con una sola tabla, la de la mayor.
+
+    Tras k golpes, la probabilidad de haber quitado ``v`` puntos es la masa
+    que ya no esta por debajo de ``v``, asi que la tabla de la vida mayor
+    sirve para todas las demas.
+    """
+    resultado = {}
+    rangos = {}
+    for vida in set(vidas):
+        golpes_min, golpes_max = _rango_golpes(ataque, defensa, vida)
+        if golpes_min == golpes_max:
+            resultado[vida] = Golpes(golpes_min, (1.0,))
+        else:
+            rangos[vida] = golpes_min, golpes_max
+    if not rangos:
+        return resultado
+    tope = max(rangos)
+    golpes_max = rangos[tope][1]
+    if tope * golpes_max > LIMITE_CELDAS_EXACTO:
+        for vida, (golpes_min, golpes_max) in rangos.items():
+            resultado[vida] = _golpes_aproximados(ataque, defensa, vida, golpes_min, golpes_max)
+        return resultado
+
+    prob_uno, minimo, maximo, prob_valor = distribucion_danio(ataque, defensa)
+    # vivos[j]: probabilidad de llevar j de daño acumulado sin haber llegado a ``tope``
+    # (las posiciones que aun no se pueden alcanzar no se guardan).
+    # Cada golpe suma una ventana de ``vivos``, que se lee de sus sumas acumuladas
+    # rellenadas con ceros a la izquierda para no comprobar limites.
+    ancho = max(0, maximo - minimo + 1)
+    relleno = [0.0] * max(maximo, 1)
+    vivos = [1.0]
+    acumulados = [0.0, 1.0]
+    cdfs = {vida: [] for vida in rangos}
+    for golpe in range(1, golpes_max + 1):
+        # Tras ``golpe`` golpes no se puede llevar mas de golpe * maximo de daño
+        alcance = min(tope, golpe * max(maximo, 1) + 1)
+        anteriores = [0.0] + vivos[:alcance - 1] + [0.0] * (alcance - 1 - len(vivos))
+        if ancho:
+            desplazados = relleno + acumulados + [acumulados[-1]] * (alcance - len(vivos))
+            ventanas = zip(desplazados[len(relleno) - minimo + 1:], desplazados[len(relleno) - maximo:])
+            vivos = [
+                prob_uno * anterior + prob_valor * (hasta - desde)
+                for anterior, (hasta, desde) in zip(anteriores, ventanas)
+            ]
+        else:
+            vivos = [prob_uno * anterior for anterior in anteriores]
+        acumulados = list(itertools.accumulate(vivos, initial=0.0))
+        total = acumulados[-1]
+        for vida, (golpes_min, golpes_max_vida) in rangos.items():
+            if golpes_min <= golpe <= golpes_max_vida:
+                cdfs[vida].append(1.0 - (acumulados[vida] if vida < len(acumulados) else total))
+        if not total:
+            break
+
+    for vida, cdf in cdfs.items():
+        # Al cortar antes, todas las vidas ya se han alcanzado con certeza
+        cdf[-1] = 1.0
+        resultado[vida] = Golpes(rangos[vida][0], tuple(cdf))
+    return resultado
+
+
+def _golpes_aproximados(ataque, defensa, vida, golpes_min, golpes_max):
+    """Aproximacion normal de la suma de golpes para tablas demasiado grandes."""
+    prob_uno, minimo, maximo, prob_valor = distribucion_danio(ataque, defensa)
+    valores = [(1, prob_uno)] + [(danio, prob_valor) for danio in range(minimo, maximo + 1)]
+    media = sum(danio * p for danio, p in valores)
+    varianza = sum(danio * danio * p for danio, p in valores) - media * media
+    cdf = []
+    for golpes in range(golpes_min, golpes_max + 1):
+        desviacion = math.sqrt(varianza * golpes)
+        if desviacion == 0:
+            cdf.append(1.0 if media * golpes >= vida else 0.0)
+            continue
+        z = (vida - 0.5 - media * golpes) / desviacion
+        cdf.append(0.5 * math.erfc(z / math.sqrt(2)))
+    cdf[-1] = 1.0
+    return Golpes(golpes_min, tuple(cdf))
+
+
+def _cdf(golpes, k):
+    i = k - golpes.minimo
+    if i < 0:
+        return 0.0
+    if i >= len(golpes.cdf):
+        return 1.0
+    return golpes.cdf[i]
+
+
+def _resultado_seguro(personaje, enemigo, desfase):
+    k_min, k_max = _rango_golpes(personaje.ataque, enemigo.defensa, enemigo.vida)
+    m_min, m_max = _rango_golpes(enemigo.ataque, personaje.defensa, personaje.vida)
+    if k_max <= m_min - 1 + desfase:
+        return 1.0
+    if k_min > m_max - 1 + desfase:
+        return 0.0
+    return None
+
+
+def _iniciativas(personaje, enemigo):
+    if personaje.velocidad > enemigo.velocidad:
+        return (True,)
+    if personaje.velocidad < enemigo.velocidad:
+        return (False,)
+    return (True, False)
+
+
+def resultado_seguro(personaje, enemigo):
+    """1.0 o 0.0 si el rango de golpes posibles ya decide el combate; si no, None."""
+    resultados = {_resultado_seguro(personaje, enemigo, 1 if empieza else 0) for empieza in _iniciativas(personaje, enemigo)}
+    return resultados.pop() if len(resultados) == 1 else None
+
+
+def _probabilidad_con_iniciativa(personaje, enemigo, personaje_empieza, golpes):
+    # Empezando, gana si necesita K <= M golpes; si empieza el enemigo, K < M
+    desfase = 1 if personaje_empieza else 0
+    seguro = _resultado_seguro(personaje, enemigo, desfase)
+    if seguro is not None:
+        return seguro
+    k_min, k_max = _rango_golpes(personaje.ataque, enemigo.defensa, enemigo.vida)
+    m_max = _rango_golpes(enemigo.ataque, personaje.defensa, personaje.vida)[1]
+
+    golpes_personaje = golpes(personaje.ataque, enemigo.defensa, enemigo.vida)
+    golpes_enemigo = golpes(enemigo.ataque, personaje.defensa, personaje.vida)
+    total = 0.0
+    anterior = 0.0
+    for k in range(k_min, min(k_max, m_max - 1 + desfase) + 1):
+        actual = _cdf(golpes_personaje, k)
+        total += (actual - anterior) * (1.0 - _cdf(golpes_enemigo, k - desfase))
+        anterior = actual
+    return total
+
+
+def probabilidad_victoria(personaje, enemigo, golpes=golpes_necesarios):
+    """Probabilidad exacta de que ``personaje`` gane a ``enemigo`` (ambos ``Luchador``).
+
+    Supone que el personaje ataca en todos sus turnos, sin consumibles ni huida.
+    ``golpes`` permite pasar distribuciones ya calculadas con ``golpes_por_vida``.
+    """
+    if personaje.vida <= 0:
+        return 0.0
+    if enemigo.vida <= 0:
+        return 1.0
+    iniciativas = _iniciativas(personaje, enemigo)
+    return sum(
+        _probabilidad_con_iniciativa(personaje, enemigo, empieza, golpes) for empieza in iniciativas
+    ) / len(iniciativas)
+
+
+def luchador_personaje(stats):
+    return Luchador(stats['vida_actual'], stats['ataque'], stats['defensa'], stats['velocidad'])
+
+
+def luchador_enemigo(enemigo):
+    """Acepta un ``Enemigo`` o un dict con sus campos de combate."""
+    if isinstance(enemigo, dict):
+        return Luchador(enemigo['vida_maxima'], enemigo['ataque'], enemigo['defensa'], enemigo['velocidad'])
+    return Luchador(enemigo.vida_maxima, enemigo.ataque, enemigo.defensa, enemigo.velocidad)
+
+
+def estimar_victoria(personaje, enemigo, stats=None):
+    """Probabilidad de que ``personaje``, con su equipo actual, derrote a ``enemigo``."""
+    if stats is None:
+        stats = stats_efectivos(personaje)
+    return probabilidad_victoria(luchador_personaje(stats), luchador_enemigo(enemigo))
@@ -0,0 +1,96 @@
+"""Encuentros aleatorios: eleccion de enemigo ponderada por rareza en O(1).
+
+Por cada (zona, tipo) se precalcula una tabla alias de Walker con los
+enemigos activos. Las tablas viven en memoria del proceso y solo se
+reconstruyen cuando cambia ``version_catalogo``; elegir un enemigo es
+despues un ``randrange`` y un ``random``, sin tocar la BD.
+"""
+import random
+from collections import defaultdict
+
+from django.conf import settings
+
+from .catalogo import TablasPorVersion
+from .models import Enemigo
+
+# Peso relativo de cada rareza en los encuentros aleatorios
+PESOS_RAREZA = {
+    'comun': 60,
+    'raro': 25,
+    'epico': 10,
+    'legendario': 5,
+}
+
+
+def pesos_rareza():
+    return getattr(settings, 'ENCUENTROS_PESOS_RAREZA', PESOS_RAREZA)
+
+
+class TablaAlias:
+    """Muestreo ponderado en O(1) con el metodo alias (variante de Vose).
+
+    Construirla cuesta O(n); cada ``elegir`` hace un indice uniforme y una
+    moneda sesgada, sin busquedas.
+    """
+
+    __slots__ = ('valores', 'probabilidades', 'alias')
+
+    def __init__(self, valores, pesos):
+        if len(valores) != len(pesos) or not valores:
+            raise ValueError("Hacen falta tantos pesos como valores, y al menos uno.")
+        total = sum(pesos)
+        if total <= 0 or min(pesos) < 0:
+            raise ValueError("Los pesos deben ser no negativos y sumar mas de cero.")
+
+        n = len(valores)
+        escalados = [peso * n / total for peso in pesos]
+        self.valores = list(valores)
+        self.probabilidades = [1.0] * n
+        self.alias = list(range(n))
+        menores = [i for i, peso in enumerate(escalados) if peso < 1.0]
+        mayores = [i for i, peso in enumerate(escalados) if peso >= 1.0]
+        while menores and mayores:
+            menor, mayor = menores.pop(), mayores.pop()
+            self.probabilidades[menor] = escalados[menor]
+            self.alias[menor] = mayor
+            escalados[mayor] -= 1.0 - escalados[menor]
+            (menores if escalados[mayor] < 1.0 else mayores).append(mayor)
+        # Lo que quede tiene probabilidad 1 salvo errores de redondeo
+
+    def __len__(self):
+        return len(self.valores)
+
+    def elegir(self, rng=random):
+        i = rng.randrange(len(self.valores))
+        if rng.random() < self.probabilidades[i]:
+            return self.valores[i]
+        return self.valores[self.alias[i]]
+
+
+def _construir_tablas():
+    pesos = pesos_rareza()
+    grupos = defaultdict(lambda: ([], []))
+    enemigos = (
+        Enemigo.objects.filter(activo=True, zona__activa=True)
+        .order_by('id')
+        .values_list('id', 'zona_id', 'tipo', 'rareza')
+    )
+    for enemigo_id, zona_id, tipo, rareza in enemigos:
+        peso = pesos.get(rareza, 0)
+        if peso > 0:
+            ids, pesos_grupo = grupos[(zona_id, tipo)]
+            ids.append(enemigo_id)
+            pesos_grupo.append(peso)
+    return {clave: TablaAlias(ids, pesos_grupo) for clave, (ids, pesos_grupo) in grupos.items()}
+
+
+# Tablas por (zona_id, tipo)
+tablas_encuentros = TablasPorVersion(_construir_tablas)
+
+
+def elegir_enemigo(zona_id, tipo, rng=random):
+    """Id de un enemigo activo de la zona y tipo, ponderado por rareza, o None."""
+    tabla = tablas_encuentros.obtener().get((zona_id, tipo))
+    if tabla is None:
+        return None
+    return tabla.elegir(rng)
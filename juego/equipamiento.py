@@ -0,0 +1,173 @@
+"""Optimizador de equipamiento: el mejor arma/armadura/accesorio contra un enemigo.
+
+Todos los bonus suman y la probabilidad de victoria nunca baja al subir un
+stat, asi que una pieza cuyos ``bonus_*`` estan por debajo de los de otra
+del mismo slot nunca forma parte del optimo. Se poda cada slot a su frontera
+de Pareto, se combinan los slots podando de nuevo las sumas y solo las
+combinaciones que sobreviven se puntuan con ``probabilidad_victoria``.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+
+from .combate import (
+    Luchador, golpes_necesarios, golpes_por_vida, luchador_enemigo, probabilidad_victoria, reduccion_defensa,
+    resultado_seguro,
+)
+
+SLOTS = ('arma', 'armadura', 'accesorio')
+
+# bonus: (ataque, defensa, salud, velocidad)
+Pieza = namedtuple('Pieza', 'inventario_id nombre slot equipado bonus')
+Equipamiento = namedtuple('Equipamiento', 'piezas probabilidad evaluadas')
+
+SIN_BONUS = (0, 0, 0, 0)
+
+
+def _sumar(a, b):
+    return tuple(x + y for x, y in zip(a, b))
+
+
+def _domina(a, b):
+    return a[0] >= b[0] and a[1] >= b[1] and a[2] >= b[2] and a[3] >= b[3]
+
+
+def frontera_pareto(elementos, clave, prioridad=lambda elemento: 0):
+    """Elementos no dominados segun ``clave`` (un vector).
+
+    Entre elementos con la misma clave queda el de mayor ``prioridad``.
+    """
+    ordenados = sorted(elementos, key=lambda elemento: (sum(clave(elemento)), prioridad(elemento)), reverse=True)
+    frontera = []
+    for elemento in ordenados:
+        vector = clave(elemento)
+        if not any(_domina(clave(otro), vector) for otro in frontera):
+            frontera.append(elemento)
+    return frontera
+
+
+def piezas_por_slot(personaje):
+    """Equipables del inventario del personaje agrupados por slot, en una consulta."""
+    piezas = {slot: [] for slot in SLOTS}
+    filas = personaje.inventario_items.filter(objeto__tipo='equipable').values_list(
+        'id', 'objeto__nombre', 'objeto__slot', 'equipado',
+        'objeto__bonus_ataque', 'objeto__bonus_defensa', 'objeto__bonus_salud', 'objeto__bonus_velocidad',
+    )
+    for inventario_id, nombre, slot, equipado, *bonus in filas:
+        if slot in piezas:
+            piezas[slot].append(Pieza(inventario_id, nombre, slot, equipado, tuple(bonus)))
+    return piezas
+
+
+def _prioridad(combinacion):
+    _, real, elegidas = combinacion
+    return sum(pieza.equipado for pieza in elegidas), sum(real)
+
+
+def _limitador(personaje, enemigo):
+    """Recorta los bonus que ya no pueden cambiar el resultado contra ``enemigo``.
+
+    La velocidad solo importa hasta superar la del enemigo y la defensa hasta
+    que todos sus golpes se quedan en 1; recortar es monotono y compatible
+    con la suma, asi que se puede aplicar a sumas parciales.
+    """
+    tope_velocidad = max(0, enemigo.velocidad + 1 - personaje.velocidad)
+    tope_defensa = max(0, 4 * enemigo.ataque - personaje.defensa)
+
+    def limitar(bonus):
+        ataque, defensa, salud, velocidad = bonus
+        return ataque, min(defensa, tope_defensa), salud, min(velocidad, tope_velocidad)
+    return limitar
+
+
+def optimizar_equipamiento(personaje, enemigo, piezas=None, stats_base=None):
+    """Combinacion de piezas que maximiza la probabilidad de vencer a ``enemigo``.
+
+    ``piezas`` por defecto sale de ``piezas_por_slot``; ``stats_base`` es el
+    ``Luchador`` del personaje sin equipo. Entre combinaciones equivalentes se
+    prefieren las piezas ya equipadas y despues la mayor suma de bonus.
+    Devuelve un ``Equipamiento`` con la pieza elegida (o None) por slot.
+    """
+    if piezas is None:
+        piezas = piezas_por_slot(personaje)
+    if stats_base is None:
+        vida = personaje.vida_actual if personaje.vida_actual is not None else personaje.salud_maxima
+        stats_base = Luchador(vida, personaje.ataque, personaje.defensa, personaje.velocidad)
+    rival = luchador_enemigo(enemigo)
+    limitar = _limitador(stats_base, rival)
+
+    # Combinaciones parciales: (bonus recortado, bonus real, piezas elegidas)
+    combinaciones = [(SIN_BONUS, SIN_BONUS, ())]
+    for slot in SLOTS:
+        opciones = frontera_pareto(
+            piezas.get(slot, []),
+            clave=lambda pieza: limitar(pieza.bonus),
+            prioridad=lambda pieza: (pieza.equipado, sum(pieza.bonus)),
+        )
+        if not opciones:
+            continue
+        combinaciones = frontera_pareto(
+            [
+                (limitar(_sumar(recortado, pieza.bonus)), _sumar(real, pieza.bonus), elegidas + (pieza,))
+                for recortado, real, elegidas in combinaciones
+                for pieza in opciones
+            ],
+            clave=lambda combinacion: combinacion[0],
+            prioridad=_prioridad,
+        )
+
+    candidatas = []
+    for combinacion in combinaciones:
+        ataque, defensa, salud, velocidad = _sumar(
+            (stats_base.ataque, stats_base.defensa, stats_base.vida, stats_base.velocidad), combinacion[0]
+        )
+        # Las defensas con la misma reduccion dan el mismo combate
+        candidatas.append((Luchador(salud, ataque, 4 * reduccion_defensa(defensa), velocidad), combinacion))
+
+    probabilidades = {}
+    for luchador, _ in candidatas:
+        seguro = resultado_seguro(luchador, rival)
+        if seguro is not None:
+            probabilidades[luchador] = seguro
+    golpes = _golpes_rival(rival, {luchador for luchador, _ in candidatas if luchador not in probabilidades})
+
+    mejor = None
+    mejor_orden = None
+    for luchador, combinacion in candidatas:
+        if luchador not in probabilidades:
+            probabilidades[luchador] = probabilidad_victoria(luchador, rival, golpes)
+        orden = (probabilidades[luchador],) + _prioridad(combinacion)
+        if mejor_orden is None or orden > mejor_orden:
+            mejor, mejor_orden = combinacion[2], orden
+
+    por_slot = {slot: None for slot in SLOTS}
+    for pieza in mejor:
+        por_slot[pieza.slot] = pieza
+    return Equipamiento(por_slot, mejor_orden[0], len(probabilidades))
+
+
+def _golpes_rival(rival, luchadores):
+    """Distribuciones de golpes del rival contra cada candidata, una tabla por defensa."""
+    vidas = defaultdict(set)
+    for luchador in luchadores:
+        vidas[luchador.defensa].add(luchador.vida)
+    tablas = {
+        (rival.ataque, defensa, vida): golpes
+        for defensa, vidas_defensa in vidas.items()
+        for vida, golpes in golpes_por_vida(rival.ataque, defensa, vidas_defensa).items()
+    }
+
+    def golpes(ataque, defensa, vida):
+        return tablas.get((ataque, defensa, vida)) or golpes_necesarios(ataque, defensa, vida)
+    return golpes
+
+
+def equipar(personaje, equipamiento):
+    """Deja equipadas exactamente las piezas de ``equipamiento`` en una transaccion."""
+    elegidas = {pieza.inventario_id: slot for slot, pieza in equipamiento.piezas.items() if pieza is not None}
+    with transaction.atomic(using=personaje._state.db):
+        personaje.inventario_items.filter(equipado=True).exclude(id__in=elegidas).update(
+            equipado=False, posicion_slot=None
+        )
+        for inventario_id, slot in elegidas.items():
+            personaje.inventario_items.filter(id=inventario_id).update(equipado=True, posicion_slot=slot)
@@ -1,7 +1,10 @@
 from django import forms
 from django.core.exceptions import ValidationError
 
+from .catalogo import enemigos_activos_zona
+from .encuentros import elegir_enemigo
 from .models import Enemigo, Combate, Inventario, Objeto, Personaje, Zona
+from .roles import GRUPOS_ADMIN, obtener_roles
 
 
 class PersonajeForm(forms.ModelForm):
@@ -25,18 +28,14 @@ class PersonajeForm(forms.ModelForm):
         
         if not self.instance.pk:
             fields_to_keep = ['nombre']
-            if usuario and usuario.groups.filter(
-                name__in=['GAME_MASTER', 'ADMIN_CONTENIDO', 'ADMIN']
-            ).exists():
+            if usuario and obtener_roles(usuario) & GRUPOS_ADMIN:
                 fields_to_keep.append('estado')
             
             fields_to_remove = [f for f in self.fields.keys() if f not in fields_to_keep]
             for field in fields_to_remove:
                 self.fields.pop(field, None)
         else:
-            if usuario and not usuario.groups.filter(
-                name__in=['GAME_MASTER', 'ADMIN_CONTENIDO', 'ADMIN']
-            ).exists():
+            if usuario and not obtener_roles(usuario) & GRUPOS_ADMIN:
                 self.fields.pop('estado', None)
                 
             if not es_editable:
@@ -124,6 +123,14 @@ class UseConsumableForm(forms.Form):
         return inventario_item_id
 
 
+class OptimizarEquipamientoForm(forms.Form):
+    enemigo = forms.ModelChoiceField(
+        queryset=Enemigo.objects.filter(activo=True).select_related('zona'),
+        widget=forms.HiddenInput(),
+        error_messages={'invalid_choice': 'El enemigo no existe o no esta activo.'},
+    )
+
+
 class ZonaForm(forms.ModelForm):
     class Meta:
         model = Zona
@@ -252,20 +259,33 @@ class EnemigoForm(forms.ModelForm):
         return cleaned_data
 
 class EnemigoSelectWidget(forms.Select):
+    def __init__(self, *args, zona_por_enemigo=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.zona_por_enemigo = zona_por_enemigo or {}
+
     def create_option(self, name, value, label, selected, index, subindex=None, attrs=None):
         option = super().create_option(name, value, label, selected, index, subindex, attrs)
-        # En Django >= 1.11, value puede ser un objeto o el ID
+        # Con un queryset, value es un ModelChoiceIteratorValue que ya trae la instancia
+        instance = getattr(value, 'instance', None)
         val = value.value if hasattr(value, 'value') else value
-        if val:
-            try:
-                obj = self.choices.queryset.get(pk=val)
-                option['attrs']['data-zona-id'] = obj.zona_id
-            except (Enemigo.DoesNotExist, ValueError, AttributeError):
-                pass
+        zona_id = instance.zona_id if instance is not None else self.zona_por_enemigo.get(val)
+        if zona_id:
+            option['attrs']['data-zona-id'] = zona_id
         return option
 
+MAX_COMBATES_AUTOMATICOS = 50
+
+
 class CombateForm(forms.ModelForm):
     enemigo = forms.ModelChoiceField(queryset=Enemigo.objects.all(), widget=EnemigoSelectWidget(attrs={'class': 'form-control'}))
+    repeticiones = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=MAX_COMBATES_AUTOMATICOS,
+        initial=10,
+        label='Combates automáticos',
+        widget=forms.NumberInput(attrs={'class': 'form-control'}),
+    )
 
     class Meta:
         model = Combate
@@ -279,7 +299,32 @@ class CombateForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['zona'].queryset = Zona.objects.filter(activa=True).order_by('nivel', 'nombre')
         self.fields['zona'].empty_label = '— Selecciona una zona —'
-        self.fields['enemigo'].queryset = Enemigo.objects.filter(activo=True).select_related('zona').order_by('zona__nivel', 'zona__nombre', 'nombre')
+
+        # Solo se cargan los enemigos de la zona elegida; el resto llega por JSON
+        zona_id = self._zona_seleccionada()
+        if zona_id is None:
+            self.fields['enemigo'].queryset = Enemigo.objects.none()
+            return
+
+        self.fields['enemigo'].queryset = Enemigo.objects.filter(activo=True, zona_id=zona_id).select_related('zona')
+        tipos = dict(Enemigo.TIPO_CHOICES)
+        enemigos = enemigos_activos_zona(zona_id)
+        widget = self.fields['enemigo'].widget
+        widget.choices = [('', self.fields['enemigo'].empty_label)] + [
+            (e['id'], f"{e['nombre']} ({tipos.get(e['tipo'], e['tipo'])})") for e in enemigos
+        ]
+        widget.zona_por_enemigo = {e['id']: zona_id for e in enemigos}
+
+    def _zona_seleccionada(self):
+        if self.is_bound:
+            zona_id = self.data.get(self.add_prefix('zona'))
+        else:
+            zona_id = self.initial.get('zona')
+        zona_id = getattr(zona_id, 'pk', zona_id)
+        try:
+            return int(zona_id)
+        except (TypeError, ValueError):
+            return None
 
     def clean(self):
         cleaned_data = super().clean()
@@ -293,6 +338,8 @@ class CombateForm(forms.ModelForm):
 
 
 class IniciarCombateForm(forms.Form):
+    """Encuentro aleatorio: el enemigo se sortea por rareza entre los de la zona y tipo."""
+
     TIPO_CHOICES = [
         ('normal', 'Enemigo Normal'),
         ('jefe', 'Jefe de Zona'),
@@ -301,7 +348,7 @@ class IniciarCombateForm(forms.Form):
         queryset=Zona.objects.filter(activa=True).order_by('nivel', 'nombre'),
         label='Zona de combate',
         empty_label='— Selecciona una zona —',
-        widget=forms.Select(attrs={'class': 'form-control', 'id': 'id_zona'}),
+        widget=forms.Select(attrs={'class': 'form-control'}),
     )
     tipo = forms.ChoiceField(
         choices=Combate.TIPO_CHOICES,
@@ -315,11 +362,12 @@ class IniciarCombateForm(forms.Form):
         zona = cleaned_data.get('zona')
         tipo = cleaned_data.get('tipo')
         if zona and tipo:
-            disponibles = Enemigo.objects.filter(zona=zona, tipo=tipo, activo=True)
-            if not disponibles.exists():
+            enemigo_id = elegir_enemigo(zona.id, tipo)
+            if enemigo_id is None:
                 raise forms.ValidationError(
                     f'No hay enemigos de tipo "{tipo}" activos en la zona "{zona.nombre}".'
                 )
+            cleaned_data['enemigo_id'] = enemigo_id
         return cleaned_data
 
 
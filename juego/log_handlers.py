@@ -0,0 +1,186 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Atributos estandar de LogRecord que no se copian como campos extra.
+_ATRIBUTOS_RECORD = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una linea JSON.
+
+    Los campos pasados con ``extra={'evento': {...}}`` (o cualquier otro extra)
+    se incluyen tal cual, para poder filtrar los logs sin parsear texto.
+    """
+
+    def format(self, record):
+        datos = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+        }
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_RECORD and not clave.startswith('_'):
+                datos[clave] = valor
+        if record.exc_info:
+            datos['excepcion'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            datos['excepcion'] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class RotatingBatchFileHandler(RotatingFileHandler):
+    """RotatingFileHandler que agrupa las lineas y las escribe por lotes.
+
+    Se vacia al llegar a ``capacidad`` registros, cuando han pasado
+    ``intervalo`` segundos desde la ultima escritura o con registros de nivel
+    ERROR o superior.
+    """
+
+    def __init__(self, filename, capacidad=200, intervalo=1.0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.capacidad = capacidad
+        self.intervalo = intervalo
+        self._pendientes = []
+        self._ultimo_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            self._pendientes.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if (
+            len(self._pendientes) >= self.capacidad
+            or record.levelno >= logging.ERROR
+            or time.monotonic() - self._ultimo_flush >= self.intervalo
+        ):
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._pendientes:
+                lote = ''.join(self._pendientes)
+                self._pendientes = []
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes > 0 and self.stream.tell() + len(lote) >= self.maxBytes:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                self.stream.write(lote)
+            if self.stream is not None:
+                self.stream.flush()
+            self._ultimo_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class ColaArchivoJsonHandler(QueueHandler):
+    """Handler no bloqueante: encola el registro y un hilo lo escribe a disco.
+
+    El hilo de la peticion solo hace ``queue.put_nowait``; el formateo JSON,
+    el agrupado por lotes y la rotacion por tamaño ocurren en el
+    ``QueueListener``. Si la cola se llena, el registro se descarta en lugar
+    de bloquear la peticion.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 capacidad=200, intervalo=1.0, tamano_cola=100000):
+        super().__init__(queue.Queue(maxsize=tamano_cola))
+        self.destino = RotatingBatchFileHandler(
+            filename,
+            capacidad=capacidad,
+            intervalo=intervalo,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding='utf-8',
+            delay=True,
+        )
+        self.destino.setFormatter(JsonFormatter())
+        self._listener = None
+        self._listener_pid = None
+        self._arranque_lock = threading.Lock()
+        self._detener_al_salir = False
+        self.descartados = 0
+
+    def _asegurar_listener(self):
+        # Se arranca de forma perezosa y se rearranca tras un fork (gunicorn, etc.).
+        if self._listener_pid == os.getpid():
+            return
+        with self._arranque_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener = _BatchQueueListener(self.queue, self.destino)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+            # Tras un fork o un detener() se rearranca, pero basta un registro
+            if not self._detener_al_salir:
+                atexit.register(self.detener)
+                self._detener_al_salir = True
+
+    def prepare(self, record):
+        # Solo se resuelve el mensaje; el formateo se hace en el hilo del listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def emit(self, record):
+        self._asegurar_listener()
+        super().emit(record)
+
+    def detener(self):
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+        self.destino.flush()
+
+    def close(self):
+        self.detener()
+        self.destino.close()
+        super().close()
+
+
+class _BatchQueueListener(QueueListener):
+    """QueueListener que vacia el lote pendiente cuando la cola se queda vacia."""
+
+    def enqueue_sentinel(self):
+        # Al parar se espera hueco aunque la cola este llena, para no perder el cierre.
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            try:
+                record = q.get(timeout=self.handlers[0].intervalo)
+            except queue.Empty:
+                self.handlers[0].flush()
+                continue
+            if record is self._sentinel:
+                q.task_done()
+                break
+            self.handle(record)
+            q.task_done()
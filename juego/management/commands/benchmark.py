@@ -0,0 +1,113 @@
+import json
+import platform
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from juego.auditoria import buffer_auditoria
+from juego.benchmarks.datos import sembrar_datos
+from juego.benchmarks.ejecutor import comparar, diferencias_rendimiento, medir_escenario
+from juego.benchmarks.escenarios import ESCENARIOS
+
+BASELINE_POR_DEFECTO = Path(__file__).resolve().parents[2] / 'benchmarks' / 'baseline.json'
+TAMANO_PEQUENO = {'jugadores': 2, 'zonas': 1, 'enemigos_por_zona': 2, 'objetos': 4, 'combates_por_personaje': 1}
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide las vistas calientes (combate, inventario, detalle, estadisticas y listados) "
+        "sobre una BD de pruebas con datos reproducibles y compara con el baseline guardado. "
+        "Solo falla si aumentan las consultas; los tiempos y la memoria se avisan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=30)
+        parser.add_argument('--calentamiento', type=int, default=3)
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--escenario', action='append', choices=sorted(ESCENARIOS), help="Repetible; por defecto todos.")
+        parser.add_argument('--salida', help="Fichero JSON donde guardar los resultados.")
+        parser.add_argument('--baseline', default=str(BASELINE_POR_DEFECTO))
+        parser.add_argument('--guardar-baseline', action='store_true', help="Sobrescribe el baseline con estos resultados.")
+        parser.add_argument('--umbral', type=float, default=0.3, help="Empeoramiento de tiempos y memoria a partir del cual se avisa (0.3 = 30%%).")
+        parser.add_argument('--pequeno', action='store_true', help="Datos minimos, para comprobar que el comando funciona.")
+
+    def handle(self, *args, **options):
+        nombres = options['escenario'] or list(ESCENARIOS)
+
+        # Siempre sobre BDs de prueba: nunca se toca la base de datos real
+        setup_test_environment(debug=False)
+        config_bd = setup_databases(verbosity=0, interactive=False)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            resultados = self._medir(nombres, options)
+        finally:
+            buffer_auditoria.flush()
+            teardown_databases(config_bd, verbosity=0)
+            teardown_test_environment()
+
+        for nombre, datos in resultados['escenarios'].items():
+            self.stdout.write(
+                f"{nombre:<20} p50 {datos['p50_ms']:8.2f} ms  p95 {datos['p95_ms']:8.2f} ms  "
+                f"{datos['consultas']:3d} consultas  {datos['asignaciones_kb']:8.1f} KB"
+            )
+
+        if options['salida']:
+            Path(options['salida']).write_text(json.dumps(resultados, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+
+        ruta_baseline = Path(options['baseline'])
+        if options['guardar_baseline']:
+            ruta_baseline.write_text(json.dumps(resultados, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f"Baseline guardado en {ruta_baseline}"))
+            return
+
+        if not ruta_baseline.exists():
+            self.stdout.write(self.style.WARNING("No hay baseline con el que comparar."))
+            return
+
+        baseline = json.loads(ruta_baseline.read_text(encoding='utf-8'))
+        if baseline.get('entorno', {}).get('bd') != resultados['entorno']['bd']:
+            self.stdout.write(self.style.WARNING(
+                f"El baseline se midio con {baseline.get('entorno', {}).get('bd')}; los tiempos no son comparables."
+            ))
+        for diferencia in diferencias_rendimiento(resultados, baseline, options['umbral']):
+            self.stdout.write(self.style.WARNING(f"Mas lento o con mas memoria: {diferencia}"))
+        regresiones = comparar(resultados, baseline)
+        if regresiones:
+            raise CommandError("Regresiones respecto al baseline:\n  " + "\n  ".join(regresiones))
+        self.stdout.write(self.style.SUCCESS("Sin regresiones respecto al baseline."))
+
+    def _medir(self, nombres, options):
+        tamano = TAMANO_PEQUENO if options['pequeno'] else {}
+        datos = sembrar_datos(semilla=options['semilla'], **tamano)
+        cliente = Client()
+        cliente.force_login(datos['jugador'])
+        cliente_admin = Client()
+        cliente_admin.force_login(datos['admin'])
+        ctx = {**datos, 'cliente': cliente, 'cliente_admin': cliente_admin}
+
+        escenarios = {}
+        for nombre in nombres:
+            funcion, preparar = ESCENARIOS[nombre]
+            escenarios[nombre] = medir_escenario(
+                funcion, preparar, ctx,
+                iteraciones=options['iteraciones'],
+                calentamiento=options['calentamiento'],
+            )
+
+        return {
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'entorno': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'bd': connection.vendor,
+                'semilla': options['semilla'],
+            },
+            'escenarios': escenarios,
+        }
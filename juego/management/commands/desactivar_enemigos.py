@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from juego.mantenimiento import desactivar_enemigos
+from juego.models import Enemigo, Zona
+
+
+class Command(BaseCommand):
+    help = "Desactiva todos los enemigos de las zonas indicadas con un UPDATE por shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zona', type=int, action='append', dest='zonas', required=True,
+                            help="Id de la zona (se puede repetir).")
+        parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los enemigos afectados.")
+
+    def handle(self, *args, **options):
+        zonas = set(options['zonas'])
+        desconocidas = zonas - set(Zona.objects.filter(pk__in=zonas).values_list('pk', flat=True))
+        if desconocidas:
+            raise CommandError(f"No existen las zonas {sorted(desconocidas)}.")
+        filas = desactivar_enemigos(Enemigo.objects.filter(zona_id__in=zonas), simular=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"Se desactivarian {filas} enemigos.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{filas} enemigos desactivados."))
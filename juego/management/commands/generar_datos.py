@@ -0,0 +1,72 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from juego.benchmarks.generador import GeneradorDatos
+from juego.routers import alias_shards
+
+Usuario = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datos sinteticos masivos y reproducibles (usuarios, zonas, enemigos, objetos, "
+        "personajes, inventario y combates) con bulk_create por lotes o COPY en PostgreSQL. "
+        "Escribe en la BD configurada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=1000)
+        parser.add_argument('--personajes-por-usuario', type=int, default=1, help="El primero activo, el resto retirados.")
+        parser.add_argument('--zonas', type=int, default=20)
+        parser.add_argument('--enemigos-por-zona', type=int, default=25)
+        parser.add_argument('--objetos', type=int, default=200)
+        parser.add_argument('--inventario-medio', type=int, default=8, help="Objetos distintos por personaje, de media.")
+        parser.add_argument('--combates-medio', type=int, default=20, help="Combates por personaje, de media.")
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--prefijo', default='gen', help="Prefijo de usuarios, zonas, enemigos y objetos.")
+        parser.add_argument('--password', default='generado', help="Contraseña comun de los usuarios generados.")
+        parser.add_argument('--lote', type=int, default=5000)
+        parser.add_argument('--metodo', choices=['auto', 'bulk', 'copy'], default='auto',
+                            help="auto usa COPY si todos los shards son PostgreSQL.")
+
+    def handle(self, *args, **options):
+        for opcion in ('usuarios', 'zonas', 'enemigos_por_zona', 'personajes_por_usuario', 'lote'):
+            if options[opcion] < 1:
+                raise CommandError(f"--{opcion.replace('_', '-')} debe ser al menos 1.")
+        prefijo = options['prefijo']
+        if Usuario.objects.filter(username__startswith=f'{prefijo}_').exists():
+            raise CommandError(f"Ya hay usuarios con el prefijo {prefijo!r}; usa otro --prefijo.")
+
+        todo_postgres = all(connections[alias].vendor == 'postgresql' for alias in alias_shards())
+        if options['metodo'] == 'copy' and not todo_postgres:
+            raise CommandError("COPY solo esta disponible en PostgreSQL.")
+        usar_copy = options['metodo'] == 'copy' or (options['metodo'] == 'auto' and todo_postgres)
+
+        creador = Usuario.objects.filter(is_superuser=True).order_by('pk').first()
+        if creador is None:
+            creador = Usuario.objects.create_superuser(f'{prefijo}_admin', f'{prefijo}_admin@generado.local', options['password'])
+
+        generador = GeneradorDatos(
+            semilla=options['semilla'], prefijo=prefijo, lote=options['lote'],
+            usar_copy=usar_copy, password=options['password'],
+        )
+        inicio = time.perf_counter()
+        for hechos in generador.generar(
+            creador, options['usuarios'],
+            zonas=options['zonas'], enemigos_por_zona=options['enemigos_por_zona'], objetos=options['objetos'],
+            personajes_por_usuario=options['personajes_por_usuario'],
+            inventario_medio=options['inventario_medio'], combates_medio=options['combates_medio'],
+        ):
+            if hechos:
+                self.stdout.write(f"  {hechos}/{options['usuarios']} usuarios ({time.perf_counter() - inicio:.1f} s)")
+        segundos = time.perf_counter() - inicio
+
+        filas = sum(generador.totales.values())
+        for modelo, total in generador.totales.items():
+            self.stdout.write(f"{modelo:<20} {total:10d}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{filas} filas en {segundos:.1f} s ({filas / segundos:.0f} filas/s, {'COPY' if usar_copy else 'bulk_create'})."
+        ))
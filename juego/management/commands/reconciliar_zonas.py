@@ -0,0 +1,54 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Q
+
+from juego.catalogo import actualizar_resumen_zonas, invalidar_catalogo
+from juego.models import Enemigo, Zona
+
+CAMPOS = ('num_enemigos', 'num_jefes', 'exp_media', 'vida_media')
+
+
+class Command(BaseCommand):
+    help = "Compara los contadores de enemigos de cada zona con los reales y corrige los que no cuadran."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zona', type=int, action='append', dest='zonas', help="Solo esta zona (se puede repetir).")
+        parser.add_argument('--dry-run', action='store_true', help="Informa de las diferencias sin corregirlas.")
+
+    def handle(self, *args, **options):
+        zonas = Zona.objects.order_by('pk')
+        enemigos = Enemigo._base_manager.order_by()
+        if options['zonas']:
+            zonas = zonas.filter(pk__in=options['zonas'])
+            enemigos = enemigos.filter(zona_id__in=options['zonas'])
+
+        reales = {
+            fila.pop('zona'): fila
+            for fila in enemigos.values('zona').annotate(
+                num_enemigos=Count('pk'), num_jefes=Count('pk', filter=Q(tipo='jefe')),
+                exp_media=Avg('exp_otorgada'), vida_media=Avg('vida_maxima'),
+            )
+        }
+        vacio = dict.fromkeys(CAMPOS, 0)
+
+        descuadradas = []
+        for zona in zonas.values('pk', 'nombre', *CAMPOS):
+            real = reales.get(zona['pk'], vacio)
+            diferencias = [
+                f"{campo} {zona[campo]} -> {real[campo]}"
+                for campo in CAMPOS
+                if not math.isclose(zona[campo], real[campo], abs_tol=1e-6)
+            ]
+            if diferencias:
+                descuadradas.append(zona['pk'])
+                self.stdout.write(f"Zona {zona['pk']} ({zona['nombre']}): {', '.join(diferencias)}")
+
+        if not descuadradas:
+            self.stdout.write(self.style.SUCCESS("Todos los contadores cuadran."))
+        elif options['dry_run']:
+            self.stdout.write(f"{len(descuadradas)} zonas descuadradas (sin corregir, --dry-run).")
+        else:
+            corregidas = actualizar_resumen_zonas(descuadradas)
+            invalidar_catalogo()
+            self.stdout.write(self.style.SUCCESS(f"{corregidas} zonas corregidas."))
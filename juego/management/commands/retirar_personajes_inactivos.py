@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from juego.mantenimiento import dias_inactividad, retirar_personajes_inactivos
+
+
+class Command(BaseCommand):
+    help = "Retira los personajes activos sin combates en los ultimos N dias con un UPDATE por shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, help="Dias sin combatir (por defecto PERSONAJES_DIAS_INACTIVIDAD).")
+        parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los personajes afectados.")
+
+    def handle(self, *args, **options):
+        dias = options['dias'] if options['dias'] is not None else dias_inactividad()
+        if dias < 1:
+            raise CommandError("--dias debe ser al menos 1.")
+        filas = retirar_personajes_inactivos(dias=dias, simular=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"Se retirarian {filas} personajes sin combates en {dias} dias.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{filas} personajes retirados (sin combates en {dias} dias)."))
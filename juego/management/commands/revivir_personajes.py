@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from juego.mantenimiento import revivir_personajes
+
+
+class Command(BaseCommand):
+    help = "Deja la vida de todos los personajes en su salud maxima con un UPDATE por shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los personajes afectados.")
+
+    def handle(self, *args, **options):
+        filas = revivir_personajes(simular=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"Se revivirian {filas} personajes.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{filas} personajes revividos."))
@@ -0,0 +1,234 @@
+import json
+import multiprocessing
+import secrets
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from juego.benchmarks.carga import CLAVE_BLOQUEO_SQLITE, PESOS_POR_DEFECTO, simular_jugador
+from juego.benchmarks.ejecutor import percentil
+from juego.models import Enemigo, Objeto
+from juego.routers import alias_shards
+
+CONSULTA_ESPERAS_POSTGRES = (
+    "SELECT count(*) FROM pg_stat_activity "
+    "WHERE wait_event_type = 'Lock' AND datname = current_database()"
+)
+
+
+def _parsear_pesos(texto):
+    pesos = dict(PESOS_POR_DEFECTO)
+    for parte in filter(None, (p.strip() for p in texto.split(','))):
+        accion, _, valor = parte.partition('=')
+        if accion not in PESOS_POR_DEFECTO:
+            raise CommandError(f"Accion desconocida en --pesos: {accion!r} (validas: {', '.join(PESOS_POR_DEFECTO)}).")
+        try:
+            pesos[accion] = float(valor)
+        except ValueError:
+            raise CommandError(f"Peso no numerico para {accion!r}: {valor!r}.")
+    if not any(peso > 0 for peso in pesos.values()):
+        raise CommandError("Al menos una accion debe tener peso positivo.")
+    return pesos
+
+
+class MuestreadorEsperas(threading.Thread):
+    """Cuenta en segundo plano las sesiones de PostgreSQL esperando un lock."""
+
+    def __init__(self, intervalo):
+        super().__init__(daemon=True)
+        self.intervalo = intervalo
+        self.parar = threading.Event()
+        self.muestras = 0
+        self.muestras_con_espera = 0
+        self.maximo = 0
+        self.acumulado = 0
+
+    def run(self):
+        aliases = [a for a in alias_shards() if connections[a].vendor == 'postgresql']
+        try:
+            while not self.parar.wait(self.intervalo):
+                esperando = 0
+                for alias in aliases:
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute(CONSULTA_ESPERAS_POSTGRES)
+                        esperando += cursor.fetchone()[0]
+                self.muestras += 1
+                self.muestras_con_espera += bool(esperando)
+                self.maximo = max(self.maximo, esperando)
+                self.acumulado += esperando
+        finally:
+            connections.close_all()
+
+    def resumen(self):
+        return {
+            'muestras': self.muestras,
+            'muestras_con_espera': self.muestras_con_espera,
+            'max_simultaneas': self.maximo,
+            # Tiempo de backend esperando locks, estimado por muestreo
+            'segundos_estimados': round(self.acumulado * self.intervalo, 2),
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Lanza N jugadores simulados concurrentes (registro, personaje, combates, curas y equipo) "
+        "contra la app WSGI en proceso o contra un servidor con --url, y resume rendimiento, "
+        "latencias, errores y esperas de locks en la BD. Crea usuarios reales en la BD configurada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jugadores', type=int, default=10)
+        parser.add_argument('--duracion', type=float, default=30, help="Segundos de juego por jugador; se ignora con --acciones.")
+        parser.add_argument('--acciones', type=int, help="Acciones por jugador; sustituye a --duracion.")
+        parser.add_argument('--pesos', default='', help="Ej.: combate=2,atacar=6,curar=1,equipar=1")
+        parser.add_argument('--rampa', type=float, default=0, help="Segundos en los que se reparte el arranque de los jugadores.")
+        parser.add_argument('--procesos', action='store_true', help="Un proceso por jugador en lugar de un hilo (requiere fork).")
+        parser.add_argument('--url', help="Servidor en marcha, p. ej. http://127.0.0.1:8000; por defecto la app WSGI en proceso.")
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--intervalo-muestreo', type=float, default=0.2)
+        parser.add_argument('--salida', help="Fichero JSON donde guardar el informe.")
+        parser.add_argument('--limpiar', action='store_true', help="Borra al terminar los usuarios creados.")
+
+    def handle(self, *args, **options):
+        if options['jugadores'] < 1:
+            raise CommandError("--jugadores debe ser al menos 1.")
+        pesos = _parsear_pesos(options['pesos'])
+        objetivos = self._objetivos()
+        duracion = None if options['acciones'] else options['duracion']
+        if not duracion and not options['acciones']:
+            raise CommandError("Indica --duracion mayor que 0 o --acciones.")
+
+        prefijo = f"carga_{secrets.token_hex(3)}_"
+        configs = [{
+            'nombre': f"{prefijo}{i:04d}",
+            'url': options['url'],
+            'objetivos': objetivos,
+            'pesos': pesos,
+            'semilla': options['semilla'] + i,
+            'retraso': options['rampa'] * i / options['jugadores'],
+            'duracion': duracion,
+            'acciones': options['acciones'],
+        } for i in range(options['jugadores'])]
+
+        muestreador = None
+        if any(connections[a].vendor == 'postgresql' for a in alias_shards()):
+            muestreador = MuestreadorEsperas(options['intervalo_muestreo'])
+
+        # Los procesos hijos no deben heredar conexiones abiertas
+        connections.close_all()
+        if options['procesos']:
+            pool = ProcessPoolExecutor(options['jugadores'], mp_context=multiprocessing.get_context('fork'))
+        else:
+            pool = ThreadPoolExecutor(options['jugadores'])
+
+        self.stdout.write(f"{options['jugadores']} jugadores ({prefijo}*) contra {options['url'] or 'la app WSGI en proceso'}...")
+        if muestreador:
+            muestreador.start()
+        inicio = time.perf_counter()
+        try:
+            with pool:
+                resultados = list(pool.map(simular_jugador, configs))
+        finally:
+            if muestreador:
+                muestreador.parar.set()
+                muestreador.join()
+        total_segundos = time.perf_counter() - inicio
+
+        informe = self._informe(resultados, total_segundos, muestreador)
+        informe['servidor'] = options['url'] or 'wsgi'
+        self._imprimir(informe)
+
+        if options['salida']:
+            Path(options['salida']).write_text(json.dumps(informe, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+        if options['limpiar']:
+            borrados, _ = get_user_model().objects.filter(username__startswith=prefijo).delete()
+            self.stdout.write(f"Limpieza: {borrados} filas borradas.")
+
+    def _objetivos(self):
+        enemigos = list(
+            Enemigo.objects.filter(activo=True, zona__activa=True)
+            .order_by('vida_maxima', 'id')
+            .values_list('zona_id', 'id')[:50]
+        )
+        if not enemigos:
+            raise CommandError("No hay enemigos activos en zonas activas contra los que combatir.")
+        consumible = (
+            Objeto.objects.filter(tipo='consumible', curacion_vida__gt=0)
+            .order_by('-curacion_vida').values_list('id', flat=True).first()
+        )
+        equipable = Objeto.objects.filter(tipo='equipable').order_by('id').values_list('id', flat=True).first()
+        if consumible is None:
+            self.stdout.write(self.style.WARNING("No hay consumibles que curen: se omite la accion 'curar'."))
+        if equipable is None:
+            self.stdout.write(self.style.WARNING("No hay equipables: se omite la accion 'equipar'."))
+        return {'enemigos': enemigos, 'consumible': consumible, 'equipable': equipable}
+
+    def _informe(self, resultados, total_segundos, muestreador):
+        latencias = defaultdict(list)
+        errores = Counter()
+        excepciones = Counter()
+        for resultado in resultados:
+            excepciones.update(resultado['excepciones'])
+            for accion, ms, status in resultado['registros']:
+                latencias[accion].append(ms)
+                if status == 0 or status >= 400:
+                    errores[accion] += 1
+
+        acciones = {}
+        for accion, valores in sorted(latencias.items()):
+            valores.sort()
+            acciones[accion] = {
+                'peticiones': len(valores),
+                'errores': errores[accion],
+                'p50_ms': round(percentil(valores, 0.5), 2),
+                'p95_ms': round(percentil(valores, 0.95), 2),
+                'p99_ms': round(percentil(valores, 0.99), 2),
+                'max_ms': round(valores[-1], 2),
+            }
+        peticiones = sum(len(v) for v in latencias.values())
+        todas = sorted(ms for valores in latencias.values() for ms in valores)
+        return {
+            'jugadores': len(resultados),
+            'segundos': round(total_segundos, 2),
+            'peticiones': peticiones,
+            'peticiones_por_segundo': round(peticiones / total_segundos, 1) if total_segundos else 0,
+            'tasa_error': round(sum(errores.values()) / peticiones, 4) if peticiones else 0,
+            'p50_ms': round(percentil(todas, 0.5), 2),
+            'p95_ms': round(percentil(todas, 0.95), 2),
+            'p99_ms': round(percentil(todas, 0.99), 2),
+            'acciones': acciones,
+            'excepciones': dict(excepciones.most_common()),
+            'esperas_locks': muestreador.resumen() if muestreador else None,
+        }
+
+    def _imprimir(self, informe):
+        self.stdout.write(
+            f"{informe['peticiones']} peticiones en {informe['segundos']} s: "
+            f"{informe['peticiones_por_segundo']} req/s, error {informe['tasa_error']:.2%}, "
+            f"p50 {informe['p50_ms']} ms, p95 {informe['p95_ms']} ms, p99 {informe['p99_ms']} ms"
+        )
+        for accion, datos in informe['acciones'].items():
+            self.stdout.write(
+                f"  {accion:<16} {datos['peticiones']:6d}  err {datos['errores']:4d}  p50 {datos['p50_ms']:8.2f}  "
+                f"p95 {datos['p95_ms']:8.2f}  p99 {datos['p99_ms']:8.2f}  max {datos['max_ms']:8.2f} ms"
+            )
+        if informe['excepciones']:
+            self.stdout.write(self.style.WARNING("Excepciones en el servidor:"))
+            for clave, veces in informe['excepciones'].items():
+                self.stdout.write(f"  {veces:6d}  {clave}")
+        esperas = informe['esperas_locks']
+        if esperas:
+            self.stdout.write(
+                f"Esperas de locks: {esperas['muestras_con_espera']}/{esperas['muestras']} muestras, "
+                f"max {esperas['max_simultaneas']} simultaneas, ~{esperas['segundos_estimados']} s esperando"
+            )
+        elif informe['servidor'] == 'wsgi' and not informe['excepciones'].get(CLAVE_BLOQUEO_SQLITE):
+            self.stdout.write("Sin errores por BD bloqueada.")
+        elif informe['servidor'] != 'wsgi':
+            self.stdout.write("Con --url las excepciones y los bloqueos de SQLite solo se ven en el log del servidor (errores 5xx).")
@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from juego.models import Enemigo, Objeto, Zona
+from juego.shards import TAMANO_LOTE_COPIA, copiar_en_shard, shards_destino
+
+# Orden de copia: primero lo que otros modelos referencian por FK
+MODELOS_REFERENCIA = (get_user_model(), Zona, Objeto, Enemigo)
+
+
+class Command(BaseCommand):
+    help = "Migra los shards y copia en ellos los datos de referencia (usuarios, zonas, objetos y enemigos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sin-migrar', action='store_true', help="No ejecuta migrate en cada shard.")
+
+    def handle(self, *args, **options):
+        destinos = shards_destino('default')
+        if not destinos:
+            self.stdout.write("Solo hay un shard; no hay nada que sincronizar.")
+            return
+
+        for alias in destinos:
+            if not options['sin_migrar']:
+                call_command('migrate', database=alias, verbosity=0)
+
+            for modelo in MODELOS_REFERENCIA:
+                total = 0
+                pks = list(modelo._base_manager.using('default').order_by('pk').values_list('pk', flat=True))
+                for inicio in range(0, len(pks), TAMANO_LOTE_COPIA):
+                    lote = list(modelo._base_manager.using('default').filter(pk__in=pks[inicio:inicio + TAMANO_LOTE_COPIA]))
+                    copiar_en_shard(alias, lote)
+                    total += len(lote)
+
+                # Lo que ya no existe en el primario sobra en el shard
+                en_shard = set(modelo._base_manager.using(alias).values_list('pk', flat=True))
+                sobrantes = sorted(en_shard - set(pks))
+                for inicio in range(0, len(sobrantes), TAMANO_LOTE_COPIA):
+                    modelo._base_manager.using(alias).filter(pk__in=sobrantes[inicio:inicio + TAMANO_LOTE_COPIA]).delete()
+                self.stdout.write(f"{alias}: {modelo._meta.label} {total} copiados, {len(sobrantes)} borrados")
+
+        self.stdout.write(self.style.SUCCESS("Shards sincronizados."))
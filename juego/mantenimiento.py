@@ -0,0 +1,81 @@
+"""Operaciones masivas de mantenimiento como un solo UPDATE por shard.
+
+Las usan las acciones del admin y los comandos ``revivir_personajes``,
+``desactivar_enemigos`` y ``retirar_personajes_inactivos``. No pasan por
+``save()`` ni ``full_clean()``: cada UPDATE esta escrito para cumplir los
+``CheckConstraint`` del modelo por construccion, y ``fecha_actualizacion``
+se fija a mano porque ``auto_now`` solo actua en ``save()``.
+
+Con ``simular=True`` devuelven cuantas filas cambiarian sin escribir.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import Combate, Personaje
+from .shards import en_todos_los_shards, shards_destino
+
+# Dias sin combatir tras los que un personaje se considera inactivo
+DIAS_INACTIVIDAD = 90
+
+
+def dias_inactividad():
+    return getattr(settings, 'PERSONAJES_DIAS_INACTIVIDAD', DIAS_INACTIVIDAD)
+
+
+def _aplicar(consultas, simular, **cambios):
+    if simular:
+        return sum(consulta.count() for consulta in consultas)
+    return sum(consulta.update(**cambios) for consulta in consultas)
+
+
+def _por_shard(personajes):
+    # Una seleccion del admin ya viene de un shard concreto
+    if personajes is None:
+        return en_todos_los_shards(Personaje.objects.all())
+    return [personajes]
+
+
+def revivir_personajes(personajes=None, simular=False):
+    """Deja la vida de ``personajes`` (todos si None) en su ``salud_maxima``.
+
+    ``vida_actual = salud_maxima`` cumple ``vida_no_supera_maxima`` y, como
+    la fila ya cumplia ``vida_actual >= 0``, tambien ``vida_actual_no_negativa``.
+    """
+    consultas = [consulta.filter(vida_actual__lt=F('salud_maxima')) for consulta in _por_shard(personajes)]
+    return _aplicar(consultas, simular, vida_actual=F('salud_maxima'), fecha_actualizacion=timezone.now())
+
+
+def personajes_inactivos(personajes, dias=None):
+    """Personajes activos creados hace mas de ``dias`` y sin combates desde entonces."""
+    limite = timezone.now() - timedelta(days=dias if dias is not None else dias_inactividad())
+    recientes = Combate.objects.filter(personaje=OuterRef('pk'), fecha_hora__gte=limite)
+    return personajes.filter(estado='activo', fecha_creacion__lt=limite).exclude(Exists(recientes))
+
+
+def retirar_personajes_inactivos(personajes=None, dias=None, simular=False):
+    """Pasa a ``retirado`` los personajes inactivos de ``personajes`` (todos si None).
+
+    ``usuario_un_personaje`` solo limita a los activos, asi que retirar nunca la viola.
+    """
+    consultas = [personajes_inactivos(consulta, dias) for consulta in _por_shard(personajes)]
+    return _aplicar(consultas, simular, estado='retirado', fecha_actualizacion=timezone.now())
+
+
+def desactivar_enemigos(enemigos, simular=False):
+    """Desactiva ``enemigos`` en ``default`` y en la copia de cada shard.
+
+    El UPDATE de ``default`` pasa por ``EnemigoQuerySet``, que invalida el
+    catalogo; cada copia recibe el mismo filtro y la misma fecha para seguir
+    siendo identica. ``enemigos`` no debe filtrar con subconsultas atadas a
+    una base de datos concreta.
+    """
+    activos = enemigos.filter(activo=True)
+    if simular:
+        return activos.using('default').count()
+    cambios = {'activo': False, 'fecha_actualizacion': timezone.now()}
+    for alias in shards_destino('default'):
+        activos.using(alias).update(**cambios)
+    return activos.using('default').update(**cambios)
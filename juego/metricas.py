@@ -0,0 +1,273 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+CUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histograma:
+    """Histograma log-lineal al estilo HDR para valores enteros no negativos.
+
+    Cada potencia de dos se divide en 32 sub-cubetas, asi que el error
+    relativo de los percentiles es como mucho ~3% y registrar un valor es O(1)
+    con memoria acotada (unas pocas cientos de cubetas).
+    """
+
+    SUB_CUBETAS = 32
+
+    def __init__(self):
+        self.cuentas = {}
+        self.total = 0
+        self.suma = 0
+        self.maximo = 0
+
+    def _indice(self, valor):
+        desplazamiento = max(0, valor.bit_length() - self.SUB_CUBETAS.bit_length())
+        return (desplazamiento, valor >> desplazamiento)
+
+    def registrar(self, valor):
+        valor = max(0, int(valor))
+        indice = self._indice(valor)
+        self.cuentas[indice] = self.cuentas.get(indice, 0) + 1
+        self.total += 1
+        self.suma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def percentil(self, cuantil):
+        if not self.total:
+            return 0
+        objetivo = max(1, int(round(cuantil * self.total)))
+        acumulado = 0
+        for desplazamiento, base in sorted(self.cuentas):
+            acumulado += self.cuentas[(desplazamiento, base)]
+            if acumulado >= objetivo:
+                # Punto medio de la cubeta, sin pasar del maximo observado
+                medio = (base << desplazamiento) + ((1 << desplazamiento) >> 1)
+                return min(medio, self.maximo)
+        return self.maximo
+
+    def media(self):
+        return self.suma / self.total if self.total else 0
+
+
+# Contador de la peticion en curso. Al ser una ContextVar tambien llega a los
+# hilos de sync_to_async donde el ORM async ejecuta las consultas.
+_contador_actual = ContextVar('contador_consultas', default=None)
+
+
+class _ContadorConsultas:
+    """Cuenta consultas y acumula su tiempo.
+
+    Si se activa dentro de otro contador (p. ej. el de ``MetricasMiddleware``)
+    le sigue sumando al exterior, para que no pierda las consultas.
+    """
+
+    def __init__(self, padre=None):
+        self.total = 0
+        self.tiempo = 0.0
+        self.padre = padre
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._anotar(sql, context, time.perf_counter() - inicio)
+
+    def _anotar(self, sql, context, segundos):
+        self.tiempo += segundos
+        self.total += 1
+        if self.padre is not None:
+            self.padre._anotar(sql, context, segundos)
+
+
+class RegistroMetricas:
+    """Metricas por ruta del proceso actual: tiempo total, tiempo en BD y consultas.
+
+    Los tiempos se guardan en microsegundos. Cada proceso del servidor
+    mantiene su propio registro.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas = {}
+        self.desde = time.time()
+
+    def registrar(self, ruta, segundos, segundos_bd, consultas, error=False):
+        with self._lock:
+            datos = self._rutas.get(ruta)
+            if datos is None:
+                datos = self._rutas[ruta] = {
+                    'tiempo': Histograma(),
+                    'tiempo_bd': Histograma(),
+                    'consultas': Histograma(),
+                    'errores': 0,
+                }
+            datos['tiempo'].registrar(segundos * 1_000_000)
+            datos['tiempo_bd'].registrar(segundos_bd * 1_000_000)
+            datos['consultas'].registrar(consultas)
+            if error:
+                datos['errores'] += 1
+
+    def resumen(self):
+        """Lista de dicts por ruta con percentiles en milisegundos."""
+        with self._lock:
+            filas = []
+            for ruta, datos in self._rutas.items():
+                tiempo, tiempo_bd, consultas = datos['tiempo'], datos['tiempo_bd'], datos['consultas']
+                filas.append({
+                    'ruta': ruta,
+                    'peticiones': tiempo.total,
+                    'errores': datos['errores'],
+                    'p50_ms': tiempo.percentil(0.5) / 1000,
+                    'p95_ms': tiempo.percentil(0.95) / 1000,
+                    'p99_ms': tiempo.percentil(0.99) / 1000,
+                    'max_ms': tiempo.maximo / 1000,
+                    'total_s': tiempo.suma / 1_000_000,
+                    'bd_total_s': tiempo_bd.suma / 1_000_000,
+                    'bd_p95_ms': tiempo_bd.percentil(0.95) / 1000,
+                    'consultas_media': consultas.media(),
+                    'consultas_p95': consultas.percentil(0.95),
+                    'consultas_max': consultas.maximo,
+                })
+        return filas
+
+    def exportar_prometheus(self):
+        with self._lock:
+            rutas = list(self._rutas.items())
+
+        lineas = []
+        metricas = (
+            ('juego_request_duration_seconds', 'tiempo', 1_000_000, 'Tiempo total de la peticion.'),
+            ('juego_request_db_seconds', 'tiempo_bd', 1_000_000, 'Tiempo en base de datos por peticion.'),
+            ('juego_request_queries', 'consultas', 1, 'Consultas SQL por peticion.'),
+        )
+        for nombre, clave, escala, ayuda in metricas:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} summary")
+            for ruta, datos in rutas:
+                histograma = datos[clave]
+                etiqueta = ruta.replace('\\', '\\\\').replace('"', '\\"')
+                for cuantil in CUANTILES:
+                    valor = histograma.percentil(cuantil) / escala
+                    lineas.append(f'{nombre}{{ruta="{etiqueta}",quantile="{cuantil}"}} {valor}')
+                lineas.append(f'{nombre}_sum{{ruta="{etiqueta}"}} {histograma.suma / escala}')
+                lineas.append(f'{nombre}_count{{ruta="{etiqueta}"}} {histograma.total}')
+
+        lineas.append("# HELP juego_request_errors_total Respuestas 5xx por ruta.")
+        lineas.append("# TYPE juego_request_errors_total counter")
+        for ruta, datos in rutas:
+            etiqueta = ruta.replace('\\', '\\\\').replace('"', '\\"')
+            lineas.append(f'juego_request_errors_total{{ruta="{etiqueta}"}} {datos["errores"]}')
+        return '\n'.join(lineas) + '\n'
+
+    def reiniciar(self):
+        with self._lock:
+            self._rutas = {}
+            self.desde = time.time()
+
+
+registro_metricas = RegistroMetricas()
+
+
+def contar_consultas(execute, sql, params, many, context):
+    """``execute_wrapper`` global; solo mide si hay una peticion instrumentada."""
+    contador = _contador_actual.get()
+    if contador is None:
+        return execute(sql, params, many, context)
+    return contador(execute, sql, params, many, context)
+
+
+def instalar_contador_consultas(sender, connection, **kwargs):
+    if contar_consultas not in connection.execute_wrappers:
+        connection.execute_wrappers.append(contar_consultas)
+
+
+@contextmanager
+def medir_consultas():
+    """Activa un contador de consultas para el bloque, valido en WSGI y ASGI."""
+    contador = _ContadorConsultas(padre=_contador_actual.get())
+    token = _contador_actual.set(contador)
+    try:
+        yield contador
+    finally:
+        _contador_actual.reset(token)
+
+
+_DIRECTORIO_PROYECTO = str(Path(__file__).resolve().parents[1])
+_PLANTILLAS_DJANGO = os.path.join('django', 'template', 'base.py')
+
+
+def _origen_consulta(profundidad):
+    """Ultimas llamadas del codigo del proyecto que llevaron a la consulta.
+
+    Si la consulta sale de una plantilla (p. ej. un atributo perezoso) se
+    añade tambien el nombre de la plantilla mas interna.
+    """
+    origen = []
+    plantilla = None
+    marco = sys._getframe(1)
+    while marco is not None and len(origen) < profundidad:
+        fichero = marco.f_code.co_filename
+        if plantilla is None and fichero.endswith(_PLANTILLAS_DJANGO) and marco.f_code.co_name == 'render':
+            plantilla = getattr(getattr(marco.f_locals.get('self'), 'origin', None), 'template_name', None)
+        if fichero.startswith(_DIRECTORIO_PROYECTO) and 'site-packages' not in fichero and fichero != __file__:
+            origen.append(f"{os.path.relpath(fichero, _DIRECTORIO_PROYECTO)}:{marco.f_lineno} en {marco.f_code.co_name}")
+        marco = marco.f_back
+    origen.reverse()
+    if plantilla:
+        origen.append(f"plantilla {plantilla}")
+    return origen
+
+
+class CapturaConsultas(_ContadorConsultas):
+    """Como ``medir_consultas`` pero guardando SQL, alias, duracion y origen.
+
+    Usa el mismo ``execute_wrapper`` global, asi que no depende de ``DEBUG``
+    y tambien ve las consultas del ORM async en los hilos de ``sync_to_async``.
+    """
+
+    def __init__(self, profundidad_origen=3):
+        super().__init__()
+        self.profundidad_origen = profundidad_origen
+        self.consultas = []
+        self._token = None
+
+    def _anotar(self, sql, context, segundos):
+        super()._anotar(sql, context, segundos)
+        self.consultas.append({
+            'alias': context['connection'].alias,
+            'sql': sql,
+            'ms': segundos * 1000,
+            'origen': _origen_consulta(self.profundidad_origen),
+        })
+
+    def __enter__(self):
+        self.padre = _contador_actual.get()
+        self._token = _contador_actual.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _contador_actual.reset(self._token)
+
+    def __len__(self):
+        return self.total
+
+    def informe(self):
+        lineas = []
+        for numero, consulta in enumerate(self.consultas, 1):
+            lineas.append(f"{numero}. [{consulta['alias']}] {consulta['ms']:.2f} ms  {consulta['sql']}")
+            lineas.extend(f"      {origen}" for origen in consulta['origen'])
+        return '\n'.join(lineas)
+
+
+def nombre_ruta_metricas(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<sin ruta>'
+    return match.view_name or match.url_name or '<sin nombre>'
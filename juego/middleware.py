@@ -1,57 +1,410 @@
+import cProfile
 import logging
-from django.utils.deprecation import MiddlewareMixin
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .auditoria import buffer_auditoria
+from .metricas import CapturaConsultas, medir_consultas, nombre_ruta_metricas, registro_metricas
+from .perfilado import CABECERA_PERFIL, guardar_perfil, perfilado_solicitado
+from .roles import obtener_roles
+from .routers import (
+    activar_replica,
+    desactivar_replica,
+    es_vista_solo_lectura,
+    fijar_usuario_shard,
+    liberar_usuario_shard,
+    replica_configurada,
+)
 
 logger = logging.getLogger(__name__)
 
-class LogAccesosPersonajesMiddleware(MiddlewareMixin):
 
-    def process_request(self, request):
-        if not request.user.is_authenticated:
-            return None
-        
-        path = request.path
-        
-        if '/personajes/' in path:
-            try:
-                parts = path.split('/')
-                if 'personajes' in parts:
-                    idx = parts.index('personajes')
-                    if len(parts) > idx + 1 and parts[idx + 1].isdigit():
-                        personaje_id = parts[idx + 1]
-                        
-                        accion = 'ver'
-                        if 'editar' in path:
-                            accion = 'editar'
-                        elif 'inventario' in path:
-                            accion = 'inventario'
-                        elif 'eliminar' in path:
-                            accion = 'eliminar'
-                        
-                        logger.info(
-                            f"Acceso - Usuario: {request.user.username}, "
-                            f"Personaje: {personaje_id}, Acción: {accion}"
-                        )
-            except (ValueError, IndexError):
-                pass
-        
+class MiddlewareHibrido:
+    """Base para middlewares que funcionan con WSGI y con ASGI sin saltar de hilo.
+
+    Las subclases implementan ``__call__`` (sync) y ``__acall__`` (async). Si
+    definen ``aprocess_view``, se usa en lugar de ``process_view`` cuando la
+    cadena es async, para que Django no lo envuelva en ``sync_to_async``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.es_async = iscoroutinefunction(get_response)
+        if self.es_async:
+            markcoroutinefunction(self)
+            if hasattr(self, 'aprocess_view'):
+                self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class MetricasMiddleware(MiddlewareHibrido):
+    """Registra por ruta el tiempo total, el tiempo en BD y el numero de consultas."""
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        inicio = time.perf_counter()
+        with medir_consultas() as contador:
+            response = self.get_response(request)
+        self._registrar(request, response, inicio, contador)
+        return response
+
+    async def __acall__(self, request):
+        inicio = time.perf_counter()
+        with medir_consultas() as contador:
+            response = await self.get_response(request)
+        self._registrar(request, response, inicio, contador)
+        return response
+
+    def _registrar(self, request, response, inicio, contador):
+        registro_metricas.registrar(
+            nombre_ruta_metricas(request),
+            time.perf_counter() - inicio,
+            contador.tiempo,
+            contador.total,
+            error=response.status_code >= 500,
+        )
+
+
+class RolesMiddleware(MiddlewareHibrido):
+    """Expone ``request.roles`` con los grupos del usuario, resueltos una sola vez."""
+
+    def __call__(self, request):
+        request.roles = SimpleLazyObject(lambda: obtener_roles(request.user))
+        return super().__call__(request)
+
+
+class ShardMiddleware(MiddlewareHibrido):
+    """Hace que las consultas de la peticion usen el shard del usuario autenticado.
+
+    El usuario se resuelve de forma perezosa: solo cuando se consulta un
+    modelo repartido por shards.
+    """
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        token = fijar_usuario_shard(lambda: request.user.pk)
+        try:
+            return self.get_response(request)
+        finally:
+            liberar_usuario_shard(token)
+
+    async def __acall__(self, request):
+        # En async el usuario se resuelve antes, fuera de los hilos del ORM
+        request.user = await request.auser()
+        token = fijar_usuario_shard(lambda: request.user.pk)
+        try:
+            return await self.get_response(request)
+        finally:
+            liberar_usuario_shard(token)
+
+
+class PerfiladoMiddleware(MiddlewareHibrido):
+    """Perfila con ``cProfile`` las peticiones de staff que lo piden.
+
+    Ver ``juego.perfilado``. Solo se perfila una peticion a la vez por
+    proceso; si ya hay otra en curso, esta se sirve sin perfilar y la
+    respuesta lleva ``X-Perfil: ocupado``. En ASGI el perfil solo cubre el
+    hilo del bucle de eventos, no el ORM que corre en ``sync_to_async``,
+    aunque sus consultas si se capturan.
+    """
+
+    _en_curso = threading.Lock()
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        if not (perfilado_solicitado(request) and request.user.is_staff):
+            return self.get_response(request)
+        if not self._en_curso.acquire(blocking=False):
+            return self._ocupado(self.get_response(request))
+        try:
+            perfil = cProfile.Profile()
+            inicio = time.perf_counter()
+            with CapturaConsultas() as captura:
+                perfil.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    perfil.disable()
+            return self._guardar(perfil, captura, request, response, inicio)
+        finally:
+            self._en_curso.release()
+
+    async def __acall__(self, request):
+        if not (perfilado_solicitado(request) and (await request.auser()).is_staff):
+            return await self.get_response(request)
+        if not self._en_curso.acquire(blocking=False):
+            return self._ocupado(await self.get_response(request))
+        try:
+            perfil = cProfile.Profile()
+            inicio = time.perf_counter()
+            with CapturaConsultas() as captura:
+                perfil.enable()
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    perfil.disable()
+            return self._guardar(perfil, captura, request, response, inicio)
+        finally:
+            self._en_curso.release()
+
+    def _guardar(self, perfil, captura, request, response, inicio):
+        duracion = time.perf_counter() - inicio
+        try:
+            response[CABECERA_PERFIL] = guardar_perfil(perfil, captura, request, response, duracion)
+        except OSError:
+            logger.exception("No se pudo guardar el perfil de %s", request.path)
+        return response
+
+    def _ocupado(self, response):
+        response[CABECERA_PERFIL] = 'ocupado'
+        return response
+
+
+# Clave de sesion con el instante hasta el que se lee del primario tras escribir.
+CLAVE_PRIMARIO_HASTA = 'replica_primario_hasta'
+
+
+class ReplicaMiddleware(MiddlewareHibrido):
+    """Activa la replica en las vistas de solo lectura, con lectura de lo propio.
+
+    Tras un POST (o cualquier metodo no seguro) la sesion queda "pegada" al
+    primario durante ``REPLICA_PEGADO_SEGUNDOS``, para que el usuario vea sus
+    propios cambios aunque la replica vaya con retraso.
+    """
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self._desactivar(request)
+        if self._debe_pegar(request) and request.user.is_authenticated:
+            request.session[CLAVE_PRIMARIO_HASTA] = self._pegado_hasta()
+        return response
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._desactivar(request)
+        if self._debe_pegar(request) and (await request.auser()).is_authenticated:
+            await request.session.aset(CLAVE_PRIMARIO_HASTA, self._pegado_hasta())
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self._es_candidata(request, view_func) and not self._pegada(request.session.get(CLAVE_PRIMARIO_HASTA)):
+            request._token_replica = activar_replica()
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self._es_candidata(request, view_func) and not self._pegada(await request.session.aget(CLAVE_PRIMARIO_HASTA)):
+            request._token_replica = activar_replica()
         return None
-    
-    def process_response(self, request, response):
-        if response.status_code == 403 and '/personajes/' in request.path:
-            if request.user.is_authenticated:
-                logger.warning(f"Acceso denegado - Usuario: {request.user.username}")
-        
+
+    def _es_candidata(self, request, view_func):
+        return request.method in ('GET', 'HEAD') and replica_configurada() and es_vista_solo_lectura(view_func)
+
+    def _pegada(self, hasta):
+        return hasta is not None and hasta > time.time()
+
+    def _desactivar(self, request):
+        token = request.__dict__.pop('_token_replica', None)
+        if token is not None:
+            desactivar_replica(token)
+
+    def _debe_pegar(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and replica_configurada()
+
+    def _pegado_hasta(self):
+        return time.time() + getattr(settings, 'REPLICA_PEGADO_SEGUNDOS', 5)
+
+
+# Rutas con un personaje en la URL y la accion que se registra para cada una.
+RUTAS_PERSONAJE = {
+    'personaje-detalle': 'ver',
+    'personaje-editar': 'editar',
+    'personaje-eliminar': 'eliminar',
+    'inventario-ver': 'inventario',
+    'inventario-objeto-detalle': 'inventario',
+    'inventario-agregar': 'inventario',
+    'inventario-usar': 'inventario',
+    'inventario-equipamiento': 'inventario',
+    'tema-fijar': 'ver',
+    'combate-list': 'ver',
+    'combate-create': 'ver',
+    'combate-arena': 'ver',
+}
+
+RUTAS_CRITICAS = frozenset({
+    'zona-create',
+    'zona-update',
+    'zona-delete',
+    'enemigo-create',
+    'enemigo-update',
+    'enemigo-delete',
+})
+
+
+def _nombre_ruta(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None or match.namespace != 'juego':
+        return None
+    return match.url_name
+
+
+class LogAccesosPersonajesMiddleware(MiddlewareHibrido):
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        datos = self._evento_auditoria(request, response)
+        if datos:
+            buffer_auditoria.registrar(**datos)
         return response
 
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        datos = self._evento_auditoria(request, response)
+        if datos:
+            await buffer_auditoria.aregistrar(**datos)
+        return response
 
-class AuditLoggingMiddleware(MiddlewareMixin):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self._registrar_acceso(request, request.user, view_kwargs)
+        return None
 
-    def process_request(self, request):
-        rutas_criticas = ['/zonas/create/', '/zonas/', '/enemigos/create/', '/enemigos/']
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        ruta = _nombre_ruta(request)
+        if ruta in RUTAS_PERSONAJE:
+            self._registrar_acceso(request, await request.auser(), view_kwargs)
+        return None
+
+    def _registrar_acceso(self, request, user, view_kwargs):
+        ruta = _nombre_ruta(request)
+        accion = RUTAS_PERSONAJE.get(ruta)
+        if accion is None or not user.is_authenticated:
+            return
+
+        personaje_id = view_kwargs.get('personaje_id', view_kwargs.get('pk'))
+        request.auditoria_personaje = (ruta, accion, personaje_id, user.pk, user.username)
+        logger.info(
+            "Acceso - Usuario: %s, Personaje: %s, Acción: %s",
+            user.username, personaje_id, accion,
+            extra={'evento': {
+                'tipo': 'acceso_personaje',
+                'usuario': user.username,
+                'personaje_id': personaje_id,
+                'accion': accion,
+                'metodo': request.method,
+            }},
+        )
+
+    def _evento_auditoria(self, request, response):
+        auditoria = getattr(request, 'auditoria_personaje', None)
+        if auditoria is None:
+            return None
+
+        ruta, accion, personaje_id, usuario_id, username = auditoria
+        tipo = 'acceso_personaje'
+        if response.status_code == 403:
+            tipo = 'acceso_denegado'
+            logger.warning(
+                "Acceso denegado - Usuario: %s", username,
+                extra={'evento': {
+                    'tipo': tipo,
+                    'usuario': username,
+                    'ruta': request.path,
+                }},
+            )
+
+        return {
+            'tipo': tipo,
+            'usuario_id': usuario_id,
+            'ruta': ruta,
+            'path': request.path[:255],
+            'metodo': request.method,
+            'accion': accion,
+            'objeto_id': personaje_id,
+            'status_code': response.status_code,
+        }
+
+
+class AuditLoggingMiddleware(MiddlewareHibrido):
+
+    def __call__(self, request):
+        if self.es_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        datos = self._evento_auditoria(request, response)
+        if datos:
+            buffer_auditoria.registrar(**datos)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        datos = self._evento_auditoria(request, response)
+        if datos:
+            await buffer_auditoria.aregistrar(**datos)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if _nombre_ruta(request) in RUTAS_CRITICAS:
+            self._registrar_acceso(request, request.user, view_kwargs)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if _nombre_ruta(request) in RUTAS_CRITICAS:
+            self._registrar_acceso(request, await request.auser(), view_kwargs)
+        return None
+
+    def _registrar_acceso(self, request, user, view_kwargs):
+        if not user.is_authenticated:
+            return
+
+        request.auditoria_critica = (_nombre_ruta(request), view_kwargs.get('pk'), user.pk)
+        logger.warning(
+            "ACCESO CRITICO: usuario=%s, ruta=%s, metodo=%s",
+            user.username, request.path, request.method,
+            extra={'evento': {
+                'tipo': 'acceso_critico',
+                'usuario': user.username,
+                'ruta': request.path,
+                'metodo': request.method,
+            }},
+        )
+
+    def _evento_auditoria(self, request, response):
+        auditoria = getattr(request, 'auditoria_critica', None)
+        if auditoria is None:
+            return None
 
-        if any(request.path.startswith(ruta) for ruta in rutas_criticas):
-            if request.user.is_authenticated:
-                logger.warning(
-                    f"ACCESO CRITICO: usuario={request.user.username}, ruta={request.path}, metodo={request.method}"
-                )
-        return None
\ No newline at end of file
+        ruta, objeto_id, usuario_id = auditoria
+        return {
+            'tipo': 'acceso_critico',
+            'usuario_id': usuario_id,
+            'ruta': ruta,
+            'path': request.path[:255],
+            'metodo': request.method,
+            'accion': ruta.rsplit('-', 1)[-1],
+            'objeto_id': objeto_id,
+            'status_code': response.status_code,
+        }
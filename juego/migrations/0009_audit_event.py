@@ -0,0 +1,39 @@
+# Generated by Django 5.2.11 on 2026-10-19 00:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juego', '0008_objeto_curacion_vida'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('acceso_personaje', 'Acceso a personaje'), ('acceso_denegado', 'Acceso denegado'), ('acceso_critico', 'Acceso critico')], max_length=30)),
+                ('ruta', models.CharField(max_length=100)),
+                ('path', models.CharField(max_length=255)),
+                ('metodo', models.CharField(max_length=10)),
+                ('accion', models.CharField(blank=True, max_length=20)),
+                ('objeto_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='eventos_auditoria', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Evento de auditoria',
+                'verbose_name_plural': 'Eventos de auditoria',
+                'db_table': 'juego_audit_event',
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['tipo', 'fecha'], name='audit_tipo_fecha_idx'), models.Index(fields=['usuario', 'fecha'], name='audit_usuario_fecha_idx')],
+            },
+        ),
+    ]
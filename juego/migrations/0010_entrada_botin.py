@@ -0,0 +1,30 @@
+# Generated by Django 5.2.11 on 2026-10-19 01:20
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juego', '0009_audit_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntradaBotin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('peso', models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)])),
+                ('enemigo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='entradas_botin', to='juego.enemigo')),
+                ('objeto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entradas_botin', to='juego.objeto')),
+                ('zona', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='entradas_botin', to='juego.zona')),
+            ],
+            options={
+                'verbose_name': 'Entrada de botin',
+                'verbose_name_plural': 'Entradas de botin',
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('enemigo__isnull', False), ('zona__isnull', True)), models.Q(('enemigo__isnull', True), ('zona__isnull', False)), _connector='OR'), name='botin_de_enemigo_o_de_zona'), models.CheckConstraint(condition=models.Q(('peso__gte', 1)), name='botin_peso_positivo')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.11 on 2026-10-19 01:51
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def calcular_resumen(apps, schema_editor):
+    """Rellena los contadores de enemigos de todas las zonas con un solo UPDATE."""
+    Zona = apps.get_model('juego', 'Zona')
+    Enemigo = apps.get_model('juego', 'Enemigo')
+    alias = schema_editor.connection.alias
+    enemigos = Enemigo.objects.using(alias).filter(zona=OuterRef('pk')).order_by().values('zona')
+
+    def agregado(consulta, expresion, vacio):
+        return Coalesce(Subquery(consulta.annotate(valor=expresion).values('valor')), vacio)
+
+    Zona.objects.using(alias).update(
+        num_enemigos=agregado(enemigos, Count('pk'), 0),
+        num_jefes=agregado(enemigos.filter(tipo='jefe'), Count('pk'), 0),
+        exp_media=agregado(enemigos, Avg('exp_otorgada'), 0.0),
+        vida_media=agregado(enemigos, Avg('vida_maxima'), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juego', '0010_entrada_botin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zona',
+            name='exp_media',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='zona',
+            name='num_enemigos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='zona',
+            name='num_jefes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='zona',
+            name='vida_media',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.11 on 2026-10-19 01:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juego', '0011_zona_resumen_enemigos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='combate',
+            index=models.Index(fields=['fecha_hora'], name='combate_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='combate',
+            index=models.Index(fields=['resultado', 'fecha_hora'], name='combate_resultado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventario',
+            index=models.Index(fields=['equipado', 'fecha_adquisicion'], name='inventario_equipado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(fields=['tipo', 'rareza'], name='objeto_tipo_rareza_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personaje',
+            index=models.Index(fields=['fecha_creacion'], name='personaje_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personaje',
+            index=models.Index(fields=['estado', 'fecha_creacion'], name='personaje_estado_fecha_idx'),
+        ),
+    ]
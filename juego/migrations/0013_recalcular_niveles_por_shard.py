@@ -0,0 +1,28 @@
+# Generated by Django 5.2.11 on 2026-10-19 12:00
+
+from django.db import migrations
+from django.db.models import F
+from django.db.models.functions import Least
+
+
+def calcular_niveles(apps, schema_editor):
+    """Repite 0007 en la base de datos que se migra.
+
+    0007 leia a traves de los routers, asi que al migrar un shard recalculaba
+    los personajes de ``default`` y no los suyos.
+    """
+    Personaje = apps.get_model('juego', 'Personaje')
+    Personaje.objects.using(schema_editor.connection.alias).update(
+        nivel=Least(F('exp_actual') / 100 + 1, 100),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juego', '0012_indices_admin'),
+    ]
+
+    operations = [
+        migrations.RunPython(calcular_niveles, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,57 @@
+import hashlib
+import inspect
+
+from django.contrib import messages
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 
+from .roles import aobtener_roles, es_game_master
+
+
+class ObjetoMemoizadoMixin:
+    """Memoriza ``get_object()`` para que la vista consulte el objeto una sola vez."""
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_objeto_memoizado'):
+            self._objeto_memoizado = super().get_object()
+        return self._objeto_memoizado
+
+
+class OwnerRequiredMixin(ObjetoMemoizadoMixin, UserPassesTestMixin):
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+
+        campos = {field.name for field in queryset.model._meta.get_fields()}
+        if 'personaje' in campos:
+            return queryset.filter(personaje__usuario_id=user.pk).select_related('personaje')
+        if 'usuario' in campos:
+            return queryset.filter(usuario_id=user.pk)
+        if 'creada_por' in campos and not user.is_superuser:
+            return queryset.filter(creada_por_id=user.pk)
+        return queryset
 
-class OwnerRequiredMixin(UserPassesTestMixin):
-    
     def test_func(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return False
+
+        # Se comparan los ids de las FK para no cargar los usuarios relacionados
         obj = self.get_object()
-        if hasattr(obj, 'personaje'):
-            return obj.personaje.usuario == self.request.user
-        if hasattr(obj, 'usuario'):
-            return obj.usuario == self.request.user
-        if hasattr(obj, 'creada_por'):
-            return obj.creada_por == self.request.user or self.request.user.is_superuser
+        if hasattr(obj, 'personaje_id'):
+            return obj.personaje.usuario_id == user.pk
+        if hasattr(obj, 'usuario_id'):
+            return obj.usuario_id == user.pk
+        if hasattr(obj, 'creada_por_id'):
+            return obj.creada_por_id == user.pk or user.is_superuser
         return False
     
     def handle_no_permission(self):
@@ -27,15 +67,128 @@ class AdminRequiredMixin(UserPassesTestMixin):
             return False
         if user.is_superuser:
             return True
-        return user.groups.filter(name='GAME_MASTER').exists()
+        return es_game_master(user)
 
 
-class SetLastCharacterMixin:
+class SetLastCharacterMixin(ObjetoMemoizadoMixin):
     
     def get(self, request, *args, **kwargs):
         response = super().get(request, *args, **kwargs)
         obj = self.get_object()
-        personaje_id = obj.id if hasattr(obj, 'usuario') else getattr(obj, 'personaje_id', None)
+        personaje_id = obj.id if hasattr(obj, 'usuario_id') else getattr(obj, 'personaje_id', None)
         if personaje_id:
             request.session['ultimo_personaje_id'] = personaje_id
         return response
+
+
+class ConditionalGetMixin:
+    """Añade ETag/Last-Modified y responde 304 sin renderizar si nada ha cambiado.
+
+    Las vistas implementan ``get_version_recurso`` con una consulta barata que
+    devuelva ``(ultima_modificacion, firma)``, o ``None`` si no aplica.
+    """
+
+    def get_version_recurso(self):
+        return None
+
+    def _calcular_etag(self, firma):
+        # La pagina depende tambien del usuario (navegacion), del tema elegido y
+        # del secreto CSRF de sus formularios, que cambia al iniciar sesion.
+        partes = [
+            str(self.request.user.pk or ''),
+            self.request.COOKIES.get('theme', ''),
+            self.request.COOKIES.get('tema_preferido', ''),
+            self.request.META.get('CSRF_COOKIE', ''),
+            firma,
+        ]
+        return quote_etag(hashlib.md5('|'.join(partes).encode()).hexdigest())
+
+    def _respuesta_condicional(self, request, version):
+        """Devuelve (respuesta 304/412 o None, etag, last_modified) para la version dada."""
+        ultima_modificacion, firma = version
+        etag = self._calcular_etag(firma)
+        last_modified = int(ultima_modificacion.timestamp()) if ultima_modificacion else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        return response, etag, last_modified
+
+    def _anotar_respuesta(self, response, etag, last_modified):
+        if etag and (200 <= response.status_code < 300 or response.status_code == 304):
+            response.headers.setdefault('ETag', etag)
+            if last_modified:
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def get(self, request, *args, **kwargs):
+        # Con mensajes pendientes hay que renderizar para no perderlos.
+        if len(messages.get_messages(request)):
+            return super().get(request, *args, **kwargs)
+
+        version = self.get_version_recurso()
+        if version is None:
+            return super().get(request, *args, **kwargs)
+
+        response, etag, last_modified = self._respuesta_condicional(request, version)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self._anotar_respuesta(response, etag, last_modified)
+
+
+async def preparar_request_async(request):
+    """Resuelve usuario, sesion y roles con la API async de Django.
+
+    Despues se puede renderizar una plantilla desde una vista async sin que
+    ``request.user``, los mensajes o ``request.roles`` lancen consultas
+    sincronas.
+    """
+    request.user = await request.auser()
+    if hasattr(request, 'session'):
+        await request.session.aitems()
+    await aobtener_roles(request.user)
+
+
+class AsyncVistaMixin:
+    """Despacho async: prepara la peticion antes de los mixins de acceso sincronos."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        await preparar_request_async(request)
+        response = super().dispatch(request, *args, **kwargs)
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+
+class AsyncListMixin(AsyncVistaMixin, ConditionalGetMixin):
+    """ListView de solo lectura resuelta con el ORM async y renderizada sin saltar de hilo.
+
+    Las vistas pueden definir ``aget_version_recurso`` para responder 304 y
+    ``aget_context_data`` para añadir datos consultados de forma async. Solo
+    sirve para listados sin paginar: ``Paginator`` cuenta con el ORM sincrono.
+    """
+
+    async def aget_version_recurso(self):
+        return None
+
+    async def aget_context_data(self, object_list):
+        # object_list ya es una lista: el contexto de ListView no consulta nada
+        return self.get_context_data(object_list=object_list)
+
+    async def get(self, request, *args, **kwargs):
+        if self.get_paginate_by(None):
+            raise ImproperlyConfigured(
+                f"{type(self).__name__} usa AsyncListMixin, que no admite paginate_by."
+            )
+        etag = last_modified = None
+        version = None
+        if not len(messages.get_messages(request)):
+            version = await self.aget_version_recurso()
+        if version is not None:
+            response, etag, last_modified = self._respuesta_condicional(request, version)
+            if response is not None:
+                return self._anotar_respuesta(response, etag, last_modified)
+
+        self.object_list = [obj async for obj in self.get_queryset()]
+        context = await self.aget_context_data(self.object_list)
+        response = render(request, self.get_template_names()[0], context)
+        return self._anotar_respuesta(response, etag, last_modified)
@@ -1,10 +1,57 @@
+from contextvars import ContextVar
+
 from django.db import models
+from django.db.models import Avg, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+from django.dispatch import Signal
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .routers import alias_lectura, alias_shards, fijar_usuario_shard, liberar_usuario_shard, shard_para_usuario
 
 Usuario = get_user_model()
 
+# Campos de Enemigo que entran en el resumen de su zona
+CAMPOS_RESUMEN_ZONA = frozenset({'zona', 'zona_id', 'tipo', 'exp_otorgada', 'vida_maxima'})
+
+# Escrituras en bloque de enemigos, que no disparan post_save/post_delete.
+# ``zona_ids`` son las zonas afectadas (None si no se sabe cuales).
+enemigos_modificados_en_bloque = Signal()
+
+_escritura_en_bloque = ContextVar('enemigos_escritura_en_bloque', default=False)
+
+
+def en_escritura_en_bloque():
+    """True dentro de un ``delete`` o ``bulk_update`` de enemigos que avisara al terminar."""
+    return _escritura_en_bloque.get()
+
+
+class PorUsuarioManager(models.Manager):
+    """Manager con acceso directo al shard que guarda los datos de un usuario."""
+
+    # Los managers de relaciones inversas heredan de este sin argumentos
+    def __init__(self, campo_usuario=None):
+        super().__init__()
+        self.campo_usuario = campo_usuario
+
+    def del_usuario(self, usuario):
+        usuario_id = getattr(usuario, 'pk', usuario)
+        queryset = self.filter(**{self.campo_usuario: usuario_id})
+        # Con un solo shard no se fija el alias y deciden los routers
+        if len(alias_shards()) == 1:
+            return queryset
+        return queryset.using(alias_lectura(shard_para_usuario(usuario_id), self.model))
+
+    def create(self, **kwargs):
+        # Sin alias fijo se guarda con save() para que el router vea la instancia
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
 
 class Personaje(models.Model):
 
@@ -48,6 +95,8 @@ class Personaje(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
+    objects = PorUsuarioManager('usuario_id')
+
     class Meta:
         verbose_name = 'Personaje'
         verbose_name_plural = 'Personajes'
@@ -77,6 +126,11 @@ class Personaje(models.Model):
                 name='vida_no_supera_maxima'
             ),
         ]
+
+        indexes = [
+            models.Index(fields=['fecha_creacion'], name='personaje_fecha_idx'),
+            models.Index(fields=['estado', 'fecha_creacion'], name='personaje_estado_fecha_idx'),
+        ]
         
         ordering = ['-fecha_creacion']
 
@@ -119,7 +173,7 @@ class Personaje(models.Model):
     def save(self, *args, **kwargs):
         nivel_anterior = None
         if self.pk:
-            nivel_anterior = Personaje.objects.filter(pk=self.pk).values_list("nivel", flat=True).first()
+            nivel_anterior = Personaje.objects.using(self._state.db).filter(pk=self.pk).values_list("nivel", flat=True).first()
 
         nivel_nuevo = self.calcular_nivel_desde_exp(self.exp_actual)
 
@@ -232,6 +286,10 @@ class Objeto(models.Model):
             ),
         ]
 
+        indexes = [
+            models.Index(fields=['tipo', 'rareza'], name='objeto_tipo_rareza_idx'),
+        ]
+
         ordering = ['rareza', 'nombre']
 
     def __str__(self):
@@ -299,6 +357,8 @@ class Inventario(models.Model):
 
     fecha_adquisicion = models.DateTimeField(auto_now_add=True)
 
+    objects = PorUsuarioManager('personaje__usuario_id')
+
     class Meta:
         verbose_name = 'Inventario'
         verbose_name_plural = 'Inventario'
@@ -320,6 +380,10 @@ class Inventario(models.Model):
             ),
         ]
 
+        indexes = [
+            models.Index(fields=['equipado', 'fecha_adquisicion'], name='inventario_equipado_fecha_idx'),
+        ]
+
         ordering = ['-equipado', '-fecha_adquisicion']
 
     def __str__(self):
@@ -334,6 +398,17 @@ class Inventario(models.Model):
         if self.equipado and self.posicion_slot != self.objeto.slot:
             raise ValidationError(f'El slot debe coincidir con el del objeto.')
 
+    def validate_unique(self, exclude=None):
+        # El router no recibe la instancia al buscar duplicados: sin el usuario del
+        # personaje (si ya esta cargado) usaria el de la peticion, o ``default``
+        if not Inventario.personaje.is_cached(self):
+            return super().validate_unique(exclude)
+        token = fijar_usuario_shard(lambda: self.personaje.usuario_id)
+        try:
+            super().validate_unique(exclude)
+        finally:
+            liberar_usuario_shard(token)
+
     def save(self, *args, **kwargs):
         self.full_clean()
         super().save(*args, **kwargs)
@@ -344,6 +419,23 @@ class Inventario(models.Model):
         self.save()
 
 
+class ZonaQuerySet(models.QuerySet):
+    def recalcular_resumen(self):
+        """Recalcula los contadores de enemigos de estas zonas en un solo UPDATE."""
+        enemigos = Enemigo._base_manager.filter(zona=OuterRef('pk')).order_by().values('zona')
+
+        def agregado(consulta, expresion, vacio):
+            return Coalesce(Subquery(consulta.annotate(valor=expresion).values('valor')), vacio)
+
+        return self.update(
+            num_enemigos=agregado(enemigos, Count('pk'), 0),
+            num_jefes=agregado(enemigos.filter(tipo='jefe'), Count('pk'), 0),
+            exp_media=agregado(enemigos, Avg('exp_otorgada'), 0.0),
+            vida_media=agregado(enemigos, Avg('vida_maxima'), 0.0),
+            fecha_actualizacion=Now(),
+        )
+
+
 class Zona(models.Model):
     DIFICULTAD_CHOICES = (
         ('normal', 'Normal'),
@@ -374,6 +466,14 @@ class Zona(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
+    # Resumen de sus enemigos, mantenido por juego.signals (ver ``recalcular_resumen``)
+    num_enemigos = models.PositiveIntegerField(default=0, editable=False)
+    num_jefes = models.PositiveIntegerField(default=0, editable=False)
+    exp_media = models.FloatField(default=0, editable=False)
+    vida_media = models.FloatField(default=0, editable=False)
+
+    objects = ZonaQuerySet.as_manager()
+
     class Meta:
         db_table = 'zona'
         ordering = ['nivel', 'nombre']
@@ -384,6 +484,65 @@ class Zona(models.Model):
         return self.nombre
 
 
+class EnemigoQuerySet(models.QuerySet):
+    """Las escrituras en bloque avisan con ``enemigos_modificados_en_bloque``.
+
+    ``update``, ``bulk_create`` y ``bulk_update`` no emiten señales por fila;
+    ``delete`` si, pero se ignoran para recalcular cada zona una sola vez.
+    """
+
+    def _zonas(self):
+        return set(self.order_by().values_list('zona_id', flat=True).distinct())
+
+    def _en_bloque(self, funcion, *args, **kwargs):
+        token = _escritura_en_bloque.set(True)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            _escritura_en_bloque.reset(token)
+
+    def _avisar(self, zona_ids):
+        enemigos_modificados_en_bloque.send(sender=self.model, zona_ids=zona_ids, using=self.db)
+
+    def update(self, **kwargs):
+        if en_escritura_en_bloque():
+            return super().update(**kwargs)
+        zona_ids = self._zonas() if kwargs.keys() & CAMPOS_RESUMEN_ZONA else set()
+        filas = super().update(**kwargs)
+        nueva = kwargs.get('zona', kwargs.get('zona_id'))
+        if nueva is not None:
+            nueva = getattr(nueva, 'pk', nueva)
+            # Con una expresion no se sabe a que zonas van: se recalculan todas
+            zona_ids = zona_ids | {nueva} if isinstance(nueva, int) else None
+        self._avisar(zona_ids)
+        return filas
+
+    def bulk_create(self, objs, *args, **kwargs):
+        creados = super().bulk_create(objs, *args, **kwargs)
+        self._avisar({enemigo.zona_id for enemigo in creados})
+        return creados
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        zona_ids = set()
+        if set(fields) & CAMPOS_RESUMEN_ZONA:
+            zona_ids = {enemigo.zona_id for enemigo in objs}
+            if 'zona' in fields or 'zona_id' in fields:
+                zona_ids |= self.filter(pk__in=[enemigo.pk for enemigo in objs])._zonas()
+        filas = self._en_bloque(super().bulk_update, objs, fields, *args, **kwargs)
+        self._avisar(zona_ids)
+        return filas
+
+    def delete(self):
+        zona_ids = self._zonas()
+        resultado = self._en_bloque(super().delete)
+        self._avisar(zona_ids)
+        return resultado
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Enemigo(models.Model):
     TIPO_CHOICES = (
         ('normal', 'Normal'),
@@ -425,6 +584,8 @@ class Enemigo(models.Model):
     exp_otorgada = models.PositiveIntegerField(default=10)
     oro_otorgado = models.PositiveIntegerField(default=0)
 
+    objects = EnemigoQuerySet.as_manager()
+
     class Meta:
         ordering = ['zona', 'tipo', 'nombre']
         verbose_name = 'Enemigo'
@@ -433,6 +594,58 @@ class Enemigo(models.Model):
     def __str__(self):
         return f"{self.nombre} ({self.get_tipo_display()}) - {self.zona.nombre}"
 
+
+class EntradaBotin(models.Model):
+    """Objeto que puede soltar un enemigo concreto o cualquier enemigo de una zona.
+
+    Las entradas de un enemigo sustituyen a las de su zona; ``peso`` es
+    relativo al resto de entradas de la misma tabla.
+    """
+
+    objeto = models.ForeignKey(
+        Objeto,
+        on_delete=models.CASCADE,
+        related_name='entradas_botin',
+    )
+    enemigo = models.ForeignKey(
+        Enemigo,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='entradas_botin',
+    )
+    zona = models.ForeignKey(
+        Zona,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='entradas_botin',
+    )
+    peso = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+
+    class Meta:
+        verbose_name = 'Entrada de botin'
+        verbose_name_plural = 'Entradas de botin'
+
+        constraints = [
+            models.CheckConstraint(
+                condition=(
+                    models.Q(enemigo__isnull=False, zona__isnull=True) |
+                    models.Q(enemigo__isnull=True, zona__isnull=False)
+                ),
+                name='botin_de_enemigo_o_de_zona'
+            ),
+            models.CheckConstraint(
+                condition=models.Q(peso__gte=1),
+                name='botin_peso_positivo'
+            ),
+        ]
+
+    def __str__(self):
+        origen = self.enemigo or self.zona
+        return f"{self.objeto.nombre} ({self.peso}) - {origen}"
+
+
 class Combate(models.Model):
     RESULTADO_CHOICES = (
         ('victoria', 'Victoria'),
@@ -480,6 +693,8 @@ class Combate(models.Model):
     )
     fecha_hora = models.DateTimeField(auto_now_add=True)
 
+    objects = PorUsuarioManager('personaje__usuario_id')
+
     class Meta:
         db_table = 'juego_combate'
         verbose_name = 'Combate'
@@ -493,5 +708,47 @@ class Combate(models.Model):
             )
         ]
 
+        indexes = [
+            models.Index(fields=['fecha_hora'], name='combate_fecha_idx'),
+            models.Index(fields=['resultado', 'fecha_hora'], name='combate_resultado_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"{self.personaje.nombre} vs {self.enemigo.nombre} - {self.get_resultado_display()}"
+
+
+class AuditEvent(models.Model):
+    TIPO_CHOICES = (
+        ('acceso_personaje', 'Acceso a personaje'),
+        ('acceso_denegado', 'Acceso denegado'),
+        ('acceso_critico', 'Acceso critico'),
+    )
+
+    tipo = models.CharField(max_length=30, choices=TIPO_CHOICES)
+    usuario = models.ForeignKey(
+        Usuario,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='eventos_auditoria',
+    )
+    ruta = models.CharField(max_length=100)
+    path = models.CharField(max_length=255)
+    metodo = models.CharField(max_length=10)
+    accion = models.CharField(max_length=20, blank=True)
+    objeto_id = models.PositiveBigIntegerField(null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'juego_audit_event'
+        verbose_name = 'Evento de auditoria'
+        verbose_name_plural = 'Eventos de auditoria'
+        ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['tipo', 'fecha'], name='audit_tipo_fecha_idx'),
+            models.Index(fields=['usuario', 'fecha'], name='audit_usuario_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.ruta} ({self.metodo})"
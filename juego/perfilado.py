@@ -0,0 +1,165 @@
+"""Perfilado bajo demanda de peticiones sueltas para el staff.
+
+Una peticion de un usuario staff con la cabecera ``X-Perfilar: 1`` o el
+parametro ``?_perfilar=1`` se ejecuta bajo ``cProfile`` y con las consultas
+SQL capturadas. Cada perfil deja en ``PERFILES_DIRECTORIO`` dos ficheros con
+el mismo nombre: el ``.prof`` de ``pstats`` y un ``.json`` con la peticion y
+sus consultas. Solo se conservan los ``PERFILES_MAXIMO`` mas recientes.
+"""
+import itertools
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+
+CABECERA_PERFILAR = 'X-Perfilar'
+PARAMETRO_PERFILAR = '_perfilar'
+CABECERA_PERFIL = 'X-Perfil'
+
+# Consultas guardadas por perfil; el resto solo cuenta en el total
+MAXIMO_CONSULTAS_GUARDADAS = 500
+
+_NOMBRE_VALIDO = re.compile(r'^[\w-]+$')
+_secuencia = itertools.count(1)
+_lock_directorio = threading.Lock()
+
+
+def directorio_perfiles():
+    return Path(getattr(settings, 'PERFILES_DIRECTORIO', settings.BASE_DIR / 'perfiles'))
+
+
+def maximo_perfiles():
+    return max(1, int(getattr(settings, 'PERFILES_MAXIMO', 50)))
+
+
+def perfilado_solicitado(request):
+    """Si la peticion pide perfilado; el permiso de staff se comprueba aparte."""
+    return bool(request.headers.get(CABECERA_PERFILAR) or request.GET.get(PARAMETRO_PERFILAR))
+
+
+def _ruta(nombre, extension):
+    if not _NOMBRE_VALIDO.match(nombre):
+        raise FileNotFoundError(nombre)
+    return directorio_perfiles() / f'{nombre}.{extension}'
+
+
+def guardar_perfil(perfil, captura, request, response, duracion):
+    """Vuelca el perfil y sus metadatos y devuelve el nombre del artefacto."""
+    directorio = directorio_perfiles()
+    directorio.mkdir(parents=True, exist_ok=True)
+    nombre = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{next(_secuencia)}"
+    consultas = sorted(captura.consultas, key=lambda consulta: consulta['ms'], reverse=True)
+    metadatos = {
+        'nombre': nombre,
+        'fecha': time.time(),
+        'metodo': request.method,
+        'ruta': request.get_full_path(),
+        'vista': getattr(request.resolver_match, 'view_name', None),
+        'usuario': request.user.get_username(),
+        'status': response.status_code,
+        'duracion_ms': duracion * 1000,
+        'tiempo_bd_ms': captura.tiempo * 1000,
+        'total_consultas': captura.total,
+        'consultas': consultas[:MAXIMO_CONSULTAS_GUARDADAS],
+        # Se agrupan antes de recortar para no perder las repetidas baratas
+        'repetidas': [grupo for grupo in consultas_agrupadas(captura.consultas) if grupo['veces'] > 1][:50],
+    }
+    perfil.dump_stats(directorio / f'{nombre}.prof')
+    # El .json se escribe al final: un perfil solo se lista cuando esta completo
+    temporal = directorio / f'{nombre}.json.tmp'
+    temporal.write_text(json.dumps(metadatos, ensure_ascii=False), encoding='utf-8')
+    temporal.replace(directorio / f'{nombre}.json')
+    _recortar(directorio)
+    return nombre
+
+
+def _recortar(directorio):
+    """Borra los perfiles mas antiguos por encima de ``PERFILES_MAXIMO``."""
+    with _lock_directorio:
+        metadatos = sorted(directorio.glob('*.json'), key=lambda ruta: ruta.stat().st_mtime, reverse=True)
+        for ruta in metadatos[maximo_perfiles():]:
+            for sobrante in (ruta, ruta.with_suffix('.prof')):
+                try:
+                    sobrante.unlink()
+                except FileNotFoundError:
+                    pass  # Lo borro otro proceso
+
+
+def _leer_metadatos(ruta):
+    metadatos = json.loads(ruta.read_text(encoding='utf-8'))
+    metadatos['fecha'] = datetime.fromtimestamp(metadatos['fecha'], tz=timezone.utc)
+    return metadatos
+
+
+def listar_perfiles():
+    """Metadatos de los perfiles guardados, del mas reciente al mas antiguo."""
+    directorio = directorio_perfiles()
+    if not directorio.is_dir():
+        return []
+    perfiles = []
+    for ruta in directorio.glob('*.json'):
+        try:
+            metadatos = _leer_metadatos(ruta)
+        except (FileNotFoundError, ValueError):
+            continue
+        metadatos.pop('consultas', None)
+        metadatos.pop('repetidas', None)
+        perfiles.append(metadatos)
+    perfiles.sort(key=lambda perfil: perfil['fecha'], reverse=True)
+    return perfiles
+
+
+def cargar_perfil(nombre):
+    """Metadatos completos de un perfil. ``FileNotFoundError`` si no existe."""
+    return _leer_metadatos(_ruta(nombre, 'json'))
+
+
+def ruta_prof(nombre):
+    ruta = _ruta(nombre, 'prof')
+    if not ruta.is_file():
+        raise FileNotFoundError(nombre)
+    return ruta
+
+
+def _nombre_funcion(clave):
+    fichero, linea, funcion = clave
+    if fichero == '~':
+        return funcion  # Funciones internas, p. ej. <built-in method ...>
+    directorio_proyecto = str(settings.BASE_DIR)
+    if 'site-packages' in fichero:
+        fichero = fichero.split('site-packages' + os.sep, 1)[1]
+    elif fichero.startswith(directorio_proyecto):
+        fichero = os.path.relpath(fichero, directorio_proyecto)
+    return f'{fichero}:{linea} {funcion}'
+
+
+def top_funciones(nombre, limite=30, orden='cumulative'):
+    """Las ``limite`` funciones con mas tiempo segun ``orden`` (criterio de ``pstats``)."""
+    estadisticas = pstats.Stats(str(ruta_prof(nombre)))
+    estadisticas.sort_stats(orden)
+    filas = []
+    for clave in estadisticas.fcn_list[:limite]:
+        primitivas, llamadas, propio, acumulado, _ = estadisticas.stats[clave]
+        filas.append({
+            'funcion': _nombre_funcion(clave),
+            'llamadas': llamadas if llamadas == primitivas else f'{llamadas}/{primitivas}',
+            'propio_ms': propio * 1000,
+            'acumulado_ms': acumulado * 1000,
+        })
+    return filas
+
+
+def consultas_agrupadas(consultas):
+    """Agrupa las consultas por SQL para ver las repetidas (N+1)."""
+    grupos = {}
+    for consulta in consultas:
+        grupo = grupos.setdefault(consulta['sql'], {'sql': consulta['sql'], 'veces': 0, 'ms': 0.0, 'origen': consulta['origen']})
+        grupo['veces'] += 1
+        grupo['ms'] += consulta['ms']
+    return sorted(grupos.values(), key=lambda grupo: (grupo['veces'], grupo['ms']), reverse=True)
@@ -0,0 +1,67 @@
+"""Presupuestos de consultas SQL por ruta para los tests.
+
+Los maximos viven en ``presupuesto_consultas.json``. Para regenerarlos tras
+un cambio intencionado::
+
+    ACTUALIZAR_PRESUPUESTO=1 python manage.py test juego
+
+Asi se reescribe el fichero con los recuentos observados y se revisa el
+cambio en el diff.
+"""
+import json
+import os
+from pathlib import Path
+
+from .metricas import CapturaConsultas
+
+RUTA_PRESUPUESTO = Path(__file__).resolve().parent / 'presupuesto_consultas.json'
+VARIABLE_ACTUALIZAR = 'ACTUALIZAR_PRESUPUESTO'
+
+
+def cargar_presupuesto(ruta=RUTA_PRESUPUESTO):
+    if not ruta.exists():
+        return {}
+    return json.loads(ruta.read_text(encoding='utf-8'))
+
+
+def guardar_presupuesto(presupuesto, ruta=RUTA_PRESUPUESTO):
+    ruta.write_text(json.dumps(dict(sorted(presupuesto.items())), indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+
+
+class PresupuestoConsultasMixin:
+    """Mixin de ``TestCase`` con ``assertPresupuestoConsultas``."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.presupuesto = cargar_presupuesto()
+        cls.actualizar_presupuesto = bool(os.environ.get(VARIABLE_ACTUALIZAR))
+        cls.observado = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.actualizar_presupuesto and cls.observado:
+            # Se relee por si otra clase de tests ya guardo sus recuentos
+            guardar_presupuesto({**cargar_presupuesto(), **cls.observado})
+        super().tearDownClass()
+
+    def assertPresupuestoConsultas(self, clave, funcion):
+        """Ejecuta ``funcion`` y falla si hace mas consultas que ``clave`` en el presupuesto."""
+        with CapturaConsultas() as captura:
+            resultado = funcion()
+
+        if self.actualizar_presupuesto:
+            self.observado[clave] = len(captura)
+            return resultado
+
+        maximo = self.presupuesto.get(clave)
+        if maximo is None:
+            self.fail(
+                f"'{clave}' no tiene presupuesto de consultas ({len(captura)} observadas). "
+                f"Añadelo a {RUTA_PRESUPUESTO.name} o ejecuta con {VARIABLE_ACTUALIZAR}=1."
+            )
+        if len(captura) > maximo:
+            self.fail(
+                f"'{clave}' hizo {len(captura)} consultas y su presupuesto es {maximo}.\n{captura.informe()}"
+            )
+        return resultado
@@ -0,0 +1,110 @@
+"""Enemigos recomendados segun el poder del personaje.
+
+Los enemigos activos se agrupan por banda de ``Zona.nivel`` y, dentro de
+cada banda, se ordenan por un indice de dificultad. Recomendar es una
+busqueda binaria en la banda del personaje: los enemigos con un poder
+entre ``PODER_MINIMO`` y ``PODER_MAXIMO`` veces el suyo, empezando por los
+mas cercanos a ``PODER_OBJETIVO``. El indice se reconstruye al cambiar la
+version del catalogo.
+"""
+import bisect
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+
+from .catalogo import TablasPorVersion
+from .combate import Luchador, rango_golpe, reduccion_defensa
+from .models import Enemigo
+
+# Niveles de zona por banda: 1-5, 6-10, ...
+ANCHO_BANDA = 5
+
+# Poder del enemigo relativo al del personaje
+PODER_MINIMO = 0.4
+PODER_OBJETIVO = 0.75
+PODER_MAXIMO = 1.1
+
+Recomendacion = namedtuple('Recomendacion', 'id nombre tipo zona_id zona_nombre zona_nivel luchador dificultad relativa')
+
+
+def ancho_banda():
+    return getattr(settings, 'RECOMENDACIONES_ANCHO_BANDA', ANCHO_BANDA)
+
+
+def banda(nivel):
+    return (max(nivel, 1) - 1) // ancho_banda()
+
+
+def poder(luchador):
+    """Indice de dificultad: vida por puntos que gana en cada intercambio de golpes.
+
+    Cada golpe propio quita de media el punto medio de ``rango_golpe`` y la
+    defensa resta ``reduccion_defensa`` a cada golpe recibido. No depende
+    del rival, asi que sirve para ordenar enemigos una sola vez.
+    """
+    minimo, maximo = rango_golpe(luchador.ataque)
+    return luchador.vida * ((minimo + maximo) / 2 + reduccion_defensa(luchador.defensa))
+
+
+def _construir_indice():
+    por_banda = defaultdict(list)
+    enemigos = (
+        Enemigo.objects.filter(activo=True, zona__activa=True)
+        .order_by('id')
+        .values_list(
+            'id', 'nombre', 'tipo', 'zona_id', 'zona__nombre', 'zona__nivel',
+            'vida_maxima', 'ataque', 'defensa', 'velocidad',
+        )
+    )
+    for enemigo_id, nombre, tipo, zona_id, zona_nombre, zona_nivel, *stats in enemigos:
+        luchador = Luchador(*stats)
+        por_banda[banda(zona_nivel)].append(
+            Recomendacion(enemigo_id, nombre, tipo, zona_id, zona_nombre, zona_nivel, luchador, poder(luchador), None)
+        )
+
+    indice = {}
+    for clave, enemigos_banda in por_banda.items():
+        enemigos_banda.sort(key=lambda enemigo: enemigo.dificultad)
+        indice[clave] = ([enemigo.dificultad for enemigo in enemigos_banda], enemigos_banda)
+    return indice
+
+
+# {banda: (dificultades ordenadas, recomendaciones en el mismo orden)}
+indice_recomendaciones = TablasPorVersion(_construir_indice)
+
+
+def _mas_cercanos(dificultades, enemigos, poder_personaje, limite):
+    """Hasta ``limite`` enemigos en el rango admitido, del mas cercano al objetivo al mas lejano."""
+    desde = bisect.bisect_left(dificultades, poder_personaje * PODER_MINIMO)
+    hasta = bisect.bisect_right(dificultades, poder_personaje * PODER_MAXIMO)
+    objetivo = poder_personaje * PODER_OBJETIVO
+    derecha = min(max(bisect.bisect_left(dificultades, objetivo), desde), hasta)
+    izquierda = derecha - 1
+    elegidos = []
+    while len(elegidos) < limite and (izquierda >= desde or derecha < hasta):
+        if derecha >= hasta or (izquierda >= desde and objetivo - dificultades[izquierda] <= dificultades[derecha] - objetivo):
+            elegidos.append(enemigos[izquierda])
+            izquierda -= 1
+        else:
+            elegidos.append(enemigos[derecha])
+            derecha += 1
+    return elegidos
+
+
+def recomendar_enemigos(nivel, luchador, limite=5):
+    """Enemigos recomendados para un personaje de ``nivel`` con las stats de ``luchador``.
+
+    Primero los de su banda de niveles; si no llegan a ``limite``, se completa
+    con las bandas vecinas. ``relativa`` es el poder del enemigo respecto al
+    del personaje.
+    """
+    poder_personaje = poder(luchador)
+    if poder_personaje <= 0:
+        return []
+    indice = indice_recomendaciones.obtener()
+    propia = banda(nivel)
+    elegidos = []
+    for clave in (propia, propia - 1, propia + 1):
+        if clave in indice and len(elegidos) < limite:
+            elegidos.extend(_mas_cercanos(*indice[clave], poder_personaje, limite - len(elegidos)))
+    return [enemigo._replace(relativa=enemigo.dificultad / poder_personaje) for enemigo in elegidos]
@@ -0,0 +1,78 @@
+from django.core.cache import caches
+
+from .caches import es_compartida
+
+GRUPOS_ADMIN = frozenset({'GAME_MASTER', 'ADMIN_CONTENIDO', 'ADMIN'})
+
+CACHE_ROLES = 'roles'
+CACHE_TIMEOUT_ROLES = 60 * 60
+# Con una cache por proceso ``invalidar_roles`` solo limpia el worker que ve
+# el cambio; los demas conceden un rol revocado como mucho estos segundos
+CACHE_TIMEOUT_ROLES_LOCAL = 5
+
+
+def _cache():
+    return caches[CACHE_ROLES]
+
+
+def timeout_roles():
+    return CACHE_TIMEOUT_ROLES if es_compartida(_cache()) else CACHE_TIMEOUT_ROLES_LOCAL
+
+
+def _clave_cache_roles(user_id):
+    return f"roles_usuario:{user_id}"
+
+
+def obtener_roles(user):
+    """Devuelve el frozenset de nombres de grupo del usuario.
+
+    Se memoriza en el propio objeto ``user`` (una vez por peticion) y en la
+    cache ``roles`` entre peticiones; las señales de ``juego.signals`` la
+    invalidan cuando cambian los grupos.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, '_roles_juego', None)
+    if roles is not None:
+        return roles
+
+    clave = _clave_cache_roles(user.pk)
+    roles = _cache().get(clave)
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        _cache().set(clave, roles, timeout_roles())
+
+    user._roles_juego = roles
+    return roles
+
+
+async def aobtener_roles(user):
+    """Version async de ``obtener_roles`` para vistas servidas por ASGI."""
+    if not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, '_roles_juego', None)
+    if roles is not None:
+        return roles
+
+    clave = _clave_cache_roles(user.pk)
+    roles = await _cache().aget(clave)
+    if roles is None:
+        roles = frozenset([nombre async for nombre in user.groups.values_list('name', flat=True)])
+        await _cache().aset(clave, roles, timeout_roles())
+
+    user._roles_juego = roles
+    return roles
+
+
+def invalidar_roles(*user_ids):
+    _cache().delete_many([_clave_cache_roles(user_id) for user_id in user_ids])
+
+
+def es_admin_juego(user):
+    return bool(obtener_roles(user) & GRUPOS_ADMIN) or user.is_staff or user.is_superuser
+
+
+def es_game_master(user):
+    return 'GAME_MASTER' in obtener_roles(user)
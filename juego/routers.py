@@ -0,0 +1,178 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Apps cuyas lecturas pueden ir a la replica. Auth y sesiones se quedan en el
+# primario para que un cambio de grupos o un login se vea de inmediato.
+APPS_REPLICA = frozenset({'juego'})
+
+# Modelos repartidos por usuario y modelos de referencia copiados en cada shard.
+MODELOS_SHARDED = frozenset({'juego.personaje', 'juego.inventario', 'juego.combate'})
+MODELOS_REFERENCIA = frozenset({'juego.zona', 'juego.enemigo', 'juego.objeto', 'auth.user'})
+
+# Se activa solo mientras se ejecuta una vista marcada como de solo lectura.
+_leer_de_replica = ContextVar('leer_de_replica', default=False)
+
+# Funcion que devuelve el id del usuario de la peticion en curso, o None.
+_usuario_shard = ContextVar('usuario_shard', default=None)
+
+
+def solo_lectura(vista):
+    """Marca una vista (funcion o clase) para que sus lecturas vayan a la replica."""
+    vista.solo_lectura = True
+    return vista
+
+
+def es_vista_solo_lectura(view_func):
+    if getattr(view_func, 'solo_lectura', False):
+        return True
+    return getattr(getattr(view_func, 'view_class', None), 'solo_lectura', False)
+
+
+def activar_replica():
+    return _leer_de_replica.set(True)
+
+
+def desactivar_replica(token):
+    _leer_de_replica.reset(token)
+
+
+def replica_configurada():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def puede_leer_de_replica(model):
+    return bool(
+        _leer_de_replica.get()
+        and model._meta.app_label in APPS_REPLICA
+        and replica_configurada()
+        and not connections['default'].in_atomic_block
+    )
+
+
+def alias_lectura(alias, model):
+    """Alias fijo con el que leer ``model``: la replica si es ``default`` y se puede."""
+    if alias == 'default' and puede_leer_de_replica(model):
+        return REPLICA_DB_ALIAS
+    return alias
+
+
+class ReplicaRouter:
+    """Envia a la replica las lecturas de las vistas de solo lectura.
+
+    Todo lo demas (escrituras, vistas normales, transacciones abiertas y
+    migraciones) usa ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        if puede_leer_de_replica(model):
+            return REPLICA_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        bases = {'default', REPLICA_DB_ALIAS}
+        if obj1._state.db in bases and obj2._state.db in bases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La replica recibe el esquema por replicacion, no por migrate
+        if db == REPLICA_DB_ALIAS:
+            return False
+        return None
+
+
+def alias_shards():
+    return list(getattr(settings, 'SHARDS', ['default']))
+
+
+def shard_para_usuario(usuario_id):
+    """Alias del shard que guarda los personajes, inventarios y combates del usuario.
+
+    El reparto es por modulo, asi que cambiar el numero de shards obliga a
+    mover datos.
+    """
+    shards = alias_shards()
+    return shards[int(usuario_id) % len(shards)]
+
+
+def es_sharded(model):
+    return model._meta.label_lower in MODELOS_SHARDED
+
+
+def es_referencia(model):
+    return model._meta.label_lower in MODELOS_REFERENCIA
+
+
+def fijar_usuario_shard(obtener_usuario_id):
+    return _usuario_shard.set(obtener_usuario_id)
+
+
+def liberar_usuario_shard(token):
+    _usuario_shard.reset(token)
+
+
+def _shard_de_la_peticion():
+    obtener_usuario_id = _usuario_shard.get()
+    usuario_id = obtener_usuario_id() if obtener_usuario_id is not None else None
+    return shard_para_usuario(usuario_id) if usuario_id is not None else None
+
+
+class ShardRouter:
+    """Reparte ``Personaje``, ``Inventario`` y ``Combate`` por ``usuario_id``.
+
+    El shard sale, por este orden, de la instancia implicada (o del personaje
+    o usuario al que pertenece) y del usuario de la peticion en curso. Sin
+    ninguno de los dos se delega en el siguiente router, asi que el codigo
+    fuera de una peticion debe usar ``del_usuario()`` o ``using()``. Zona,
+    Enemigo, Objeto y los usuarios viven en ``default`` y se copian a cada
+    shard (ver ``juego.signals``).
+
+    Con un solo shard, o si la lectura cae en ``default`` y puede ir a la
+    replica, tambien se delega para que decida ``ReplicaRouter``.
+    """
+
+    def _shard_instancia(self, instance):
+        if instance is None:
+            return None
+        if es_sharded(instance.__class__):
+            if instance._state.db is not None:
+                return instance._state.db
+            usuario_id = getattr(instance, 'usuario_id', None)
+            if usuario_id is not None:
+                return shard_para_usuario(usuario_id)
+            if not hasattr(instance, 'personaje_id'):
+                return None
+            if instance._meta.get_field('personaje').is_cached(instance):
+                return self._shard_instancia(instance.personaje)
+            return None
+        if instance._meta.label_lower == settings.AUTH_USER_MODEL.lower() and instance.pk is not None:
+            return shard_para_usuario(instance.pk)
+        return None
+
+    def _shard(self, model, hints):
+        if not es_sharded(model) or len(alias_shards()) == 1:
+            return None
+        return self._shard_instancia(hints.get('instance')) or _shard_de_la_peticion()
+
+    def db_for_read(self, model, **hints):
+        shard = self._shard(model, hints)
+        # La replica es una copia de ``default``, no del resto de shards
+        if shard == 'default' and puede_leer_de_replica(model):
+            return None
+        return shard
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Los datos de referencia existen en todos los shards
+        if es_referencia(obj1.__class__) or es_referencia(obj2.__class__):
+            return True
+        return None
@@ -0,0 +1,171 @@
+"""Backend de sesiones con cache caliente y escrituras a BD agrupadas.
+
+Uso: ``SESSION_ENGINE = 'juego.sesiones'``.
+"""
+import copy
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+
+from .caches import es_compartida
+
+logger = logging.getLogger('django.contrib.sessions')
+
+# Claves que cambian a menudo y se pueden perder sin romper nada: solo se
+# escriben en cache y llegan a la BD en el primer guardado de la sesion tras
+# ``SESSION_INTERVALO_ESCRITURA_BD`` o junto con otro cambio. No hay vaciado
+# en segundo plano: si la sesion no vuelve a guardarse, se quedan en cache.
+# El estado de un combate no entra: perderlo permitiria repetir turnos.
+CLAVES_VOLATILES = frozenset({
+    'ultimo_personaje_id',
+    'ultima_zona_id',
+    'replica_primario_hasta',
+})
+
+
+def es_volatil(clave):
+    return clave in CLAVES_VOLATILES
+
+
+class SessionStore(CachedDBStore):
+    """Sesion en cache con escritura diferida a la BD.
+
+    Al cargar se guarda una copia de los datos y al guardar solo se comparan
+    las claves. Si no cambia nada no se escribe; si solo cambian claves
+    volatiles se actualiza la cache y la BD espera a que pasen
+    ``SESSION_INTERVALO_ESCRITURA_BD`` segundos desde la ultima escritura.
+    Cualquier otra clave (login, expiracion, mensajes...) y cualquier borrado
+    se escriben en el acto.
+
+    Solo se agrupan escrituras si la cache es compartida entre procesos
+    (Redis, memcached); con ``LocMemCache`` cada worker veria su propia
+    version de las claves volatiles, asi que todo cambio va a la BD.
+    """
+
+    cache_key_prefix = 'juego.sesiones.'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._instantanea = None
+        self._guardado_bd = 0.0
+
+    @property
+    def intervalo_escritura_bd(self):
+        return getattr(settings, 'SESSION_INTERVALO_ESCRITURA_BD', 60)
+
+    def _desde_cache(self, entrada):
+        self._guardado_bd = entrada['bd']
+        return entrada['datos']
+
+    def _desde_bd(self, sesion):
+        self._guardado_bd = time.time()
+        return self.decode(sesion.session_data)
+
+    def _recordar(self, datos):
+        self._instantanea = copy.deepcopy(datos)
+        return datos
+
+    def load(self):
+        try:
+            entrada = self._cache.get(self.cache_key)
+        except Exception:
+            entrada = None
+
+        if entrada is not None:
+            return self._recordar(self._desde_cache(entrada))
+
+        sesion = self._get_session_from_db()
+        if not sesion:
+            return self._recordar({})
+        datos = self._desde_bd(sesion)
+        self._cache.set(
+            self.cache_key,
+            {'datos': datos, 'bd': self._guardado_bd},
+            self.get_expiry_age(expiry=sesion.expire_date),
+        )
+        return self._recordar(datos)
+
+    async def aload(self):
+        try:
+            entrada = await self._cache.aget(await self.acache_key())
+        except Exception:
+            entrada = None
+
+        if entrada is not None:
+            return self._recordar(self._desde_cache(entrada))
+
+        sesion = await self._aget_session_from_db()
+        if not sesion:
+            return self._recordar({})
+        datos = self._desde_bd(sesion)
+        await self._cache.aset(
+            await self.acache_key(),
+            {'datos': datos, 'bd': self._guardado_bd},
+            await self.aget_expiry_age(expiry=sesion.expire_date),
+        )
+        return self._recordar(datos)
+
+    def claves_cambiadas(self, datos):
+        """Claves añadidas, borradas o modificadas desde la carga; None si no hay copia."""
+        if self._instantanea is None:
+            return None
+        anterior = self._instantanea
+        return {
+            clave for clave in anterior.keys() | datos.keys()
+            if clave not in anterior or clave not in datos or anterior[clave] != datos[clave]
+        }
+
+    def _hay_que_escribir_bd(self, datos, must_create):
+        """None si no hay nada que guardar; si no, True/False segun toque la BD."""
+        if must_create:
+            return True
+        cambiadas = self.claves_cambiadas(datos)
+        if cambiadas is None:
+            return True
+        if not cambiadas:
+            return None
+        if not es_compartida(self._cache):
+            return True
+        # Un borrado que solo llegase a la cache reapareceria al perderla
+        if any(not es_volatil(clave) or clave not in datos for clave in cambiadas):
+            return True
+        return time.time() - self._guardado_bd >= self.intervalo_escritura_bd
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        datos = self._get_session(no_load=must_create)
+        escribir_bd = self._hay_que_escribir_bd(datos, must_create)
+        if escribir_bd is None:
+            return
+        if escribir_bd:
+            DBStore.save(self, must_create)
+            self._guardado_bd = time.time()
+        try:
+            self._cache.set(self.cache_key, {'datos': datos, 'bd': self._guardado_bd}, self.get_expiry_age())
+        except Exception:
+            logger.exception("Error saving to cache (%s)", self._cache)
+        self._recordar(datos)
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        datos = await self._aget_session(no_load=must_create)
+        escribir_bd = self._hay_que_escribir_bd(datos, must_create)
+        if escribir_bd is None:
+            return
+        if escribir_bd:
+            await DBStore.asave(self, must_create)
+            self._guardado_bd = time.time()
+        try:
+            await self._cache.aset(
+                await self.acache_key(),
+                {'datos': datos, 'bd': self._guardado_bd},
+                await self.aget_expiry_age(),
+            )
+        except Exception:
+            logger.exception("Error saving to cache (%s)", self._cache)
+        self._recordar(datos)
@@ -0,0 +1,60 @@
+from .routers import alias_lectura, alias_shards
+
+TAMANO_LOTE_COPIA = 500
+
+
+def shards_destino(origen='default'):
+    """Shards que reciben copia de los datos de referencia escritos en ``origen``."""
+    return [alias for alias in alias_shards() if alias != origen]
+
+
+def _campos(instancia):
+    return {
+        campo.attname: getattr(instancia, campo.attname)
+        for campo in instancia._meta.concrete_fields
+    }
+
+
+def copiar_en_shard(alias, instancias):
+    """Inserta o actualiza por pk una copia exacta de las instancias en ``alias``.
+
+    Se usa ``update`` + ``bulk_create`` para no pasar por ``save()`` (ni por
+    ``auto_now``) y no volver a disparar las señales.
+    """
+    if not instancias:
+        return
+    modelo = type(instancias[0])
+    manager = modelo._base_manager.db_manager(alias)
+    existentes = set(manager.filter(pk__in=[obj.pk for obj in instancias]).values_list('pk', flat=True))
+
+    nuevas = []
+    for obj in instancias:
+        campos = _campos(obj)
+        if obj.pk in existentes:
+            campos.pop(modelo._meta.pk.attname)
+            manager.filter(pk=obj.pk).update(**campos)
+        else:
+            nuevas.append(modelo(**campos))
+    manager.bulk_create(nuevas, batch_size=TAMANO_LOTE_COPIA)
+
+
+def replicar_referencia(modelo, pks, origen='default'):
+    """Copia las filas ``pks`` de ``modelo`` desde ``origen`` a los demas shards."""
+    destinos = shards_destino(origen)
+    if not destinos or not pks:
+        return
+    instancias = list(modelo._base_manager.db_manager(origen).filter(pk__in=pks))
+    for alias in destinos:
+        copiar_en_shard(alias, instancias)
+
+
+def borrar_referencia(modelo, pks, origen='default'):
+    for alias in shards_destino(origen):
+        modelo._base_manager.db_manager(alias).filter(pk__in=pks).delete()
+
+
+def en_todos_los_shards(queryset):
+    """Un queryset por shard, para consultas globales (estadisticas de admin)."""
+    if len(alias_shards()) == 1:
+        return [queryset]
+    return [queryset.using(alias_lectura(alias, queryset.model)) for alias in alias_shards()]
@@ -0,0 +1,119 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .catalogo import actualizar_resumen_zonas, invalidar_catalogo
+from .metricas import instalar_contador_consultas
+from .models import (
+    CAMPOS_RESUMEN_ZONA, EntradaBotin, Enemigo, Objeto, Zona, en_escritura_en_bloque, enemigos_modificados_en_bloque,
+)
+from .roles import invalidar_roles
+from .shards import borrar_referencia, replicar_referencia, shards_destino
+
+Usuario = get_user_model()
+
+
+@receiver(m2m_changed, sender=Usuario.groups.through)
+def invalidar_roles_por_cambio_grupos(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # Tras el clear ya no se sabe que usuarios tenia el grupo
+        instance._usuarios_antes_clear = list(instance.user_set.values_list('id', flat=True))
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        invalidar_roles(instance.pk)
+    elif action == 'post_clear':
+        invalidar_roles(*getattr(instance, '_usuarios_antes_clear', []))
+    elif pk_set:
+        invalidar_roles(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidar_roles_por_grupo(sender, instance, **kwargs):
+    if instance.pk:
+        invalidar_roles(*instance.user_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_save, sender=Zona)
+@receiver(post_save, sender=Enemigo)
+@receiver(post_save, sender=Objeto)
+def replicar_datos_referencia(sender, instance, using, update_fields=None, **kwargs):
+    # Solo se replica lo escrito en el primario; un login no merece N escrituras
+    if using != 'default' or not shards_destino(using):
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    replicar_referencia(sender, [instance.pk], origen=using)
+
+
+@receiver(post_delete, sender=Usuario)
+@receiver(post_delete, sender=Zona)
+@receiver(post_delete, sender=Enemigo)
+@receiver(post_delete, sender=Objeto)
+def borrar_datos_referencia(sender, instance, using, **kwargs):
+    if using == 'default':
+        borrar_referencia(sender, [instance.pk], origen=using)
+
+
+@receiver(post_save, sender=Zona)
+@receiver(post_save, sender=Enemigo)
+@receiver(post_save, sender=Objeto)
+@receiver(post_save, sender=EntradaBotin)
+@receiver(post_delete, sender=Zona)
+@receiver(post_delete, sender=Enemigo)
+@receiver(post_delete, sender=Objeto)
+@receiver(post_delete, sender=EntradaBotin)
+def invalidar_version_catalogo(sender, using, **kwargs):
+    invalidar_catalogo()
+    # Otra vez al confirmar, por si alguien reconstruyo con datos sin confirmar
+    transaction.on_commit(invalidar_catalogo, using=using)
+
+
+def _afecta_resumen(update_fields):
+    return update_fields is None or bool(set(update_fields) & CAMPOS_RESUMEN_ZONA)
+
+
+@receiver(pre_save, sender=Enemigo)
+def recordar_zona_anterior(sender, instance, using, raw=False, update_fields=None, **kwargs):
+    # Si el enemigo cambia de zona, la de origen tambien pierde un enemigo
+    if raw or instance.pk is None or not _afecta_resumen(update_fields):
+        return
+    instance._zona_anterior_id = (
+        Enemigo._base_manager.using(using).filter(pk=instance.pk).values_list('zona_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Enemigo)
+def actualizar_resumen_por_guardado(sender, instance, using, raw=False, update_fields=None, **kwargs):
+    if raw or using != 'default' or not _afecta_resumen(update_fields):
+        return
+    actualizar_resumen_zonas({instance.zona_id, getattr(instance, '_zona_anterior_id', None)}, using)
+
+
+@receiver(post_delete, sender=Enemigo)
+def actualizar_resumen_por_borrado(sender, instance, using, origin=None, **kwargs):
+    # Al borrar la zona entera, o en un borrado en bloque, no hay nada que recalcular fila a fila
+    if using != 'default' or en_escritura_en_bloque() or isinstance(origin, Zona) or getattr(origin, 'model', None) is Zona:
+        return
+    actualizar_resumen_zonas({instance.zona_id}, using)
+
+
+@receiver(enemigos_modificados_en_bloque)
+def actualizar_tras_escritura_en_bloque(sender, zona_ids, using, **kwargs):
+    if using != 'default':
+        return
+    if zona_ids is None or zona_ids:
+        actualizar_resumen_zonas(zona_ids, using)
+    invalidar_catalogo()
+    transaction.on_commit(invalidar_catalogo, using=using)
+
+
+connection_created.connect(instalar_contador_consultas, dispatch_uid='juego_contador_consultas')
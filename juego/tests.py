@@ -1,3 +1,1371 @@
-from django.test import TestCase
+import importlib
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.db.models import F
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from juego import recomendaciones, urls
+from juego.auditoria import buffer_auditoria
+from juego.benchmarks.datos import sembrar_datos
+from juego.benchmarks.escenarios import ESCENARIOS
+from juego.botin import TablaBotin, conceder_botin
+from juego.catalogo import (
+    CACHE_CATALOGO, CACHE_TIMEOUT_VERSION_LOCAL, CLAVE_VERSION_CATALOGO, TablasPorVersion, invalidar_catalogo, version_catalogo,
+)
+from juego.combate import Luchador, probabilidad_victoria
+from juego.encuentros import TablaAlias
+from juego.equipamiento import SLOTS, Pieza, optimizar_equipamiento
+from juego.forms import CombateForm
+from juego.log_handlers import ColaArchivoJsonHandler, JsonFormatter, RotatingBatchFileHandler
+from juego.metricas import CapturaConsultas, Histograma, RegistroMetricas
+from juego.models import AuditEvent, Combate, Enemigo, Inventario, Objeto, Personaje, Zona
+from juego.perfilado import CABECERA_PERFIL, listar_perfiles
+from juego.presupuesto_consultas import PresupuestoConsultasMixin
+from juego.recomendaciones import poder, recomendar_enemigos
+from juego.roles import CACHE_TIMEOUT_ROLES_LOCAL, timeout_roles
+from juego.routers import REPLICA_DB_ALIAS, ReplicaRouter, fijar_usuario_shard, liberar_usuario_shard, shard_para_usuario
+from juego.sesiones import SessionStore
+from juego.views import EditarPersonajeView, ZonaListView, _combate_state_key, incrementar_nivel_zona
+
+ROLES = ('jugador', 'admin')
+
+
+def _argumentos(nombre, parametros, datos):
+    """kwargs con los que resolver cada ruta usando los datos sembrados."""
+    if 'zona' in nombre:
+        objeto_pk = datos['zona'].pk
+    elif 'enemigo' in nombre:
+        objeto_pk = datos['enemigo_entrenamiento'].pk
+    else:
+        objeto_pk = datos['personaje'].pk
+    valores = {
+        'pk': objeto_pk,
+        'personaje_id': datos['personaje'].pk,
+        'inventario_item_id': datos['consumible'].pk,
+        'nombre': 'inexistente',
+    }
+    desconocidos = set(parametros) - set(valores)
+    if desconocidos:
+        raise AssertionError(f"La ruta '{nombre}' usa parametros sin valor de prueba: {sorted(desconocidos)}")
+    return {parametro: valores[parametro] for parametro in parametros}
+
+
+class PresupuestoRutasTests(PresupuestoConsultasMixin, TestCase):
+    """Cada ruta de ``juego/urls.py`` frente a su maximo de consultas.
+
+    Los tests ``test_get_*`` se generan al importar el modulo, uno por ruta
+    y rol, asi que una ruta nueva falla hasta que se le da presupuesto.
+    """
+
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=5, zonas=3, enemigos_por_zona=5, objetos=10, combates_por_personaje=10)
+
+    def setUp(self):
+        # Sin caches calientes ni auditoria pendiente: recuentos repetibles
+        for cache in caches.all():
+            cache.clear()
+        buffer_auditoria.flush()
+        self.clientes = {}
+        for rol in ROLES:
+            self.clientes[rol] = Client()
+            self.clientes[rol].force_login(self.datos[rol])
+
+    def tearDown(self):
+        buffer_auditoria.flush()
+
+    def _post(self, nombre, datos):
+        cliente = self.clientes['jugador']
+        url = reverse(f'juego:{nombre}', args=[self.datos['personaje'].pk])
+        response = self.assertPresupuestoConsultas(f'POST {nombre} (jugador)', lambda: cliente.post(url, datos))
+        self.assertLess(response.status_code, 400)
+
+    def test_post_usar_consumible(self):
+        self._post('inventario-usar', {'inventario_item_id': self.datos['consumible'].pk})
+
+    def test_post_equipar(self):
+        self._post('inventario-equipamiento', {'inventario_item_id': self.datos['equipable'].pk, 'accion': 'equipar'})
+
+    def test_post_iniciar_combate(self):
+        self._post('combate-create', {'zona': self.datos['zona'].pk, 'enemigo': self.datos['enemigo_entrenamiento'].pk})
+
+    def test_post_encuentro_aleatorio(self):
+        cliente = self.clientes['jugador']
+        url = reverse('juego:combate-create', args=[self.datos['personaje'].pk])
+        datos = {'modo': 'aleatorio', 'aleatorio-zona': self.datos['zona'].pk, 'aleatorio-tipo': 'normal'}
+        response = self.assertPresupuestoConsultas('POST combate-create aleatorio (jugador)', lambda: cliente.post(url, datos))
+        self.assertRedirects(response, reverse('juego:combate-arena', args=[self.datos['personaje'].pk]), fetch_redirect_response=False)
+
+    def test_post_combates_automaticos(self):
+        cliente = self.clientes['jugador']
+        url = reverse('juego:combate-create', args=[self.datos['personaje'].pk])
+        jefe = Enemigo.objects.get(zona=self.datos['zona'], tipo='jefe')
+        datos = {'zona': self.datos['zona'].pk, 'enemigo': jefe.pk, 'repeticiones': 10, 'modo': 'automatico'}
+        response = self.assertPresupuestoConsultas('POST combate-create automatico (jugador)', lambda: cliente.post(url, datos))
+        self.assertRedirects(response, reverse('juego:combate-list', args=[self.datos['personaje'].pk]), fetch_redirect_response=False)
+
+    def test_post_turno_combate(self):
+        cliente = self.clientes['jugador']
+        cliente.post(
+            reverse('juego:combate-create', args=[self.datos['personaje'].pk]),
+            {'zona': self.datos['zona'].pk, 'enemigo': self.datos['enemigo_entrenamiento'].pk},
+        )
+        arena = reverse('juego:combate-arena', args=[self.datos['personaje'].pk])
+        cliente.get(arena)
+
+        def turno():
+            cliente.post(arena, {'accion': 'atacar'})
+            return cliente.get(arena)
+
+        response = self.assertPresupuestoConsultas('POST combate-arena atacar (jugador)', turno)
+        self.assertEqual(response.status_code, 200)
+
+
+class EnemigosZonaJsonTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=2, objetos=4, combates_por_personaje=0)
+
+    def test_firma_una_vez_y_revalidacion(self):
+        url = reverse('juego:zona-enemigos-json', args=[self.datos['zona'].pk])
+        with CapturaConsultas() as captura:
+            response = self.client.get(url)
+        firmas = [consulta for consulta in captura.consultas if 'MAX(' in consulta['sql'].upper()]
+        self.assertEqual(len(firmas), 1)
+        self.assertIn('max-age=600', response['Cache-Control'])
+        self.assertIn('stale-while-revalidate=60', response['Cache-Control'])
+
+        revalidada = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidada.status_code, 304)
+
+
+class TablaAliasTests(TestCase):
+    def test_frecuencias_proporcionales_a_los_pesos(self):
+        pesos = {'a': 60, 'b': 25, 'c': 10, 'd': 5, 'e': 0}
+        tabla = TablaAlias(list(pesos), list(pesos.values()))
+        rng = random.Random(7)
+        muestras = Counter(tabla.elegir(rng) for _ in range(100_000))
+        for valor, peso in pesos.items():
+            self.assertAlmostEqual(muestras[valor] / 100_000, peso / 100, delta=0.01)
+
+    def test_pesos_invalidos(self):
+        with self.assertRaises(ValueError):
+            TablaAlias([], [])
+        with self.assertRaises(ValueError):
+            TablaAlias(['a'], [0])
+
+
+def _victoria_por_fuerza_bruta(personaje, enemigo):
+    """Recorre todos los golpes posibles con la formula de ``_calcular_danio``."""
+    def golpes(ataque, defensa):
+        bases = range(int(ataque * 0.6), ataque + 1)
+        return [(max(1, base - defensa // 4), 1 / len(bases)) for base in bases]
+
+    golpes_personaje = golpes(personaje.ataque, enemigo.defensa)
+    golpes_enemigo = golpes(enemigo.ataque, personaje.defensa)
+
+    @lru_cache(maxsize=None)
+    def ganar(vida_personaje, vida_enemigo, turno_personaje):
+        if vida_enemigo <= 0:
+            return 1.0
+        if vida_personaje <= 0:
+            return 0.0
+        if turno_personaje:
+            return sum(p * ganar(vida_personaje, vida_enemigo - danio, False) for danio, p in golpes_personaje)
+        return sum(p * ganar(vida_personaje - danio, vida_enemigo, True) for danio, p in golpes_enemigo)
+
+    empieza = [personaje.velocidad >= enemigo.velocidad] if personaje.velocidad != enemigo.velocidad else [True, False]
+    return sum(ganar(personaje.vida, enemigo.vida, turno) for turno in empieza) / len(empieza)
+
+
+class EstimarVictoriaTests(TestCase):
+    def test_coincide_con_la_fuerza_bruta(self):
+        rng = random.Random(11)
+        for _ in range(60):
+            personaje = Luchador(rng.randint(1, 60), rng.randint(0, 25), rng.randint(0, 20), rng.randint(1, 6))
+            enemigo = Luchador(rng.randint(1, 60), rng.randint(0, 25), rng.randint(0, 20), rng.randint(1, 6))
+            self.assertAlmostEqual(
+                probabilidad_victoria(personaje, enemigo), _victoria_por_fuerza_bruta(personaje, enemigo),
+                places=9, msg=f'{personaje} contra {enemigo}',
+            )
+
+    def test_casos_decididos(self):
+        self.assertEqual(probabilidad_victoria(Luchador(100_000, 20, 100, 50), Luchador(1_000_000, 1, 0, 1)), 1.0)
+        self.assertEqual(probabilidad_victoria(Luchador(1, 1, 0, 1), Luchador(500, 50, 0, 10)), 0.0)
+
+
+class EquipamientoOptimoTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+
+    def test_coincide_con_la_fuerza_bruta(self):
+        rng = random.Random(8)
+        for _ in range(40):
+            piezas = {slot: [] for slot in SLOTS}
+            for i in range(rng.randint(1, 12)):
+                slot = rng.choice(SLOTS)
+                bonus = tuple(rng.choice([0, rng.randint(1, 12)]) for _ in range(4))
+                piezas[slot].append(Pieza(i, f'Pieza {i}', slot, False, bonus))
+            base = Luchador(rng.randint(10, 60), rng.randint(1, 20), rng.randint(0, 15), rng.randint(1, 8))
+            rival = {'vida_maxima': rng.randint(10, 80), 'ataque': rng.randint(1, 20), 'defensa': rng.randint(0, 15), 'velocidad': rng.randint(1, 10)}
+
+            mejor = 0.0
+            for combinacion in itertools.product(*(piezas[slot] or [None] for slot in SLOTS)):
+                ataque, defensa, salud, velocidad = (sum(valores) for valores in zip(*(p.bonus for p in combinacion if p), (0, 0, 0, 0)))
+                luchador = Luchador(base.vida + salud, base.ataque + ataque, base.defensa + defensa, base.velocidad + velocidad)
+                mejor = max(mejor, probabilidad_victoria(luchador, Luchador(*rival.values())))
+            self.assertAlmostEqual(optimizar_equipamiento(None, rival, piezas, base).probabilidad, mejor, places=12)
+
+    def test_equipa_la_mejor_combinacion(self):
+        jugador = self.datos['jugador']
+        personaje = Personaje.objects.create(
+            usuario=jugador, nombre='Optimizado', estado='retirado', ataque=10, defensa=0, velocidad=5,
+        )
+        rival = Enemigo.objects.create(
+            nombre='Rival parejo', tipo='normal', zona=self.datos['zona'], rareza='comun', creada_por=self.datos['admin'],
+            vida_maxima=60, ataque=10, defensa=0, velocidad=5, exp_otorgada=1,
+        )
+        objetos = {}
+        for nombre, slot, bonus in (
+            ('Palo', 'arma', {'bonus_ataque': 1}),
+            ('Espada', 'arma', {'bonus_ataque': 8}),
+            ('Daga', 'arma', {'bonus_ataque': 2}),
+            ('Escudo', 'armadura', {'bonus_defensa': 8}),
+            ('Anillo', 'accesorio', {'bonus_velocidad': 1}),
+        ):
+            objeto = Objeto.objects.create(nombre=nombre, tipo='equipable', rareza='comun', efecto='-', slot=slot, **bonus)
+            objetos[nombre] = Inventario.objects.create(
+                personaje=personaje, objeto=objeto, equipado=nombre == 'Palo', posicion_slot='arma' if nombre == 'Palo' else None,
+            )
+
+        self.client.force_login(jugador)
+        url = reverse('juego:inventario-equipamiento-optimo', args=[personaje.pk])
+        respuesta = self.client.get(url, {'enemigo': rival.pk})
+        self.assertTrue(respuesta.context['hay_cambios'])
+        self.assertGreater(respuesta.context['probabilidad_optima'], respuesta.context['probabilidad_actual'])
+
+        self.client.post(url, {'enemigo': rival.pk})
+        equipados = set(personaje.inventario_items.filter(equipado=True).values_list('objeto__nombre', flat=True))
+        self.assertEqual(equipados, {'Espada', 'Escudo', 'Anillo'})
+        self.assertFalse(self.client.get(url, {'enemigo': rival.pk}).context['hay_cambios'])
+
+
+class RecomendacionesTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+
+    def test_busqueda_binaria_elige_los_mas_cercanos(self):
+        rng = random.Random(4)
+        for _ in range(200):
+            dificultades = sorted(rng.uniform(0, 100) for _ in range(rng.randint(0, 30)))
+            poder_personaje, limite = rng.uniform(1, 120), rng.randint(1, 6)
+            elegidos = recomendaciones._mas_cercanos(dificultades, dificultades, poder_personaje, limite)
+            admitidos = [
+                d for d in dificultades
+                if poder_personaje * recomendaciones.PODER_MINIMO <= d <= poder_personaje * recomendaciones.PODER_MAXIMO
+            ]
+            objetivo = poder_personaje * recomendaciones.PODER_OBJETIVO
+            esperados = sorted(abs(d - objetivo) for d in admitidos)[:limite]
+            self.assertEqual(sorted(abs(d - objetivo) for d in elegidos), esperados)
+
+    def test_recomienda_la_banda_del_personaje_y_sigue_al_catalogo(self):
+        admin = self.datos['admin']
+        luchador = Luchador(100, 20, 8, 5)
+        zonas = [Zona.objects.create(nombre=f'Banda {nivel}', nivel=nivel, dificultad='normal', creada_por=admin) for nivel in (3, 13)]
+        for zona in zonas:
+            for i, vida in enumerate((10, 60, 80, 300)):
+                Enemigo.objects.create(
+                    nombre=f'{zona.nombre} {i}', tipo='normal', zona=zona, rareza='comun', creada_por=admin,
+                    vida_maxima=vida, ataque=20, defensa=8, velocidad=5, exp_otorgada=1,
+                )
+
+        recomendados = recomendar_enemigos(12, luchador)
+        self.assertEqual([r.nombre for r in recomendados], ['Banda 13 2', 'Banda 13 1'])
+        self.assertAlmostEqual(recomendados[0].relativa, 0.8)
+        self.assertEqual(recomendados[0].dificultad, poder(Luchador(80, 20, 8, 5)))
+
+        # Subir la zona de banda con update() tambien debe refrescar el indice
+        for _ in range(3):
+            incrementar_nivel_zona(zonas[0].pk)
+        self.assertEqual({r.zona_id for r in recomendar_enemigos(12, luchador)}, {zonas[0].pk, zonas[1].pk})
+
+
+class BotinTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=2, objetos=4, combates_por_personaje=0)
+
+    def test_tabla_respeta_los_pesos(self):
+        tabla = TablaBotin(['a', 'b', 'c'], [1, 3, 6])
+        rng = random.Random(3)
+        muestras = Counter(tabla.elegir(rng) for _ in range(50_000))
+        for valor, peso in (('a', 1), ('b', 3), ('c', 6)):
+            self.assertAlmostEqual(muestras[valor] / 50_000, peso / 10, delta=0.01)
+
+    def test_upsert_suma_y_crea_en_una_sola_consulta(self):
+        personaje = self.datos['personaje']
+        consumible = self.datos['consumible']
+        nuevo = Objeto.objects.exclude(en_inventario__personaje=personaje).first()
+        with CapturaConsultas() as captura:
+            conceder_botin(personaje, {consumible.objeto_id: 3, nuevo.pk: 2})
+        self.assertEqual(len(captura), 1)
+        inventario = dict(Inventario.objects.del_usuario(self.datos['jugador']).values_list('objeto_id', 'cantidad'))
+        self.assertEqual(inventario[consumible.objeto_id], consumible.cantidad + 3)
+        self.assertEqual(inventario[nuevo.pk], 2)
+
+
+class ResumenZonaTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+        cls.origen, cls.destino = [
+            Zona.objects.create(nombre=nombre, nivel=1, dificultad='normal', creada_por=cls.datos['admin'])
+            for nombre in ('Origen', 'Destino')
+        ]
+
+    def _enemigo(self, zona, vida, exp, tipo='normal'):
+        return Enemigo(
+            nombre=f'Resumen {zona.pk}-{vida}', tipo=tipo, zona=zona, rareza='comun', creada_por=self.datos['admin'],
+            vida_maxima=vida, ataque=5, defensa=1, velocidad=1, exp_otorgada=exp,
+        )
+
+    def _resumen(self, zona):
+        return Zona.objects.values_list('num_enemigos', 'num_jefes', 'exp_media', 'vida_media').get(pk=zona.pk)
+
+    def test_guardar_mover_y_borrar(self):
+        jefe = self._enemigo(self.origen, 30, 20, tipo='jefe')
+        jefe.save()
+        self._enemigo(self.origen, 10, 10).save()
+        self.assertEqual(self._resumen(self.origen), (2, 1, 15.0, 20.0))
+
+        jefe.zona = self.destino
+        jefe.save()
+        self.assertEqual(self._resumen(self.origen), (1, 0, 10.0, 10.0))
+        self.assertEqual(self._resumen(self.destino), (1, 1, 20.0, 30.0))
+        self.assertEqual(Zona.objects.using('shard1').get(pk=self.destino.pk).num_jefes, 1)
+
+        jefe.delete()
+        self.assertEqual(self._resumen(self.destino), (0, 0, 0.0, 0.0))
+
+    def test_escrituras_en_bloque(self):
+        creados = Enemigo.objects.bulk_create([self._enemigo(self.origen, vida, 4) for vida in (10, 20, 30)])
+        self.assertEqual(self._resumen(self.origen), (3, 0, 4.0, 20.0))
+
+        Enemigo.objects.filter(pk=creados[0].pk).update(zona=self.destino)
+        self.assertEqual(self._resumen(self.destino), (1, 0, 4.0, 10.0))
+
+        for enemigo in creados:
+            enemigo.tipo = 'jefe'
+        with CapturaConsultas() as captura:
+            Enemigo.objects.bulk_update(creados[1:], ['tipo'])
+        self.assertEqual(self._resumen(self.origen), (2, 2, 4.0, 25.0))
+        self.assertLess(len(captura), 10)
+
+        Enemigo.objects.filter(zona=self.origen).delete()
+        self.assertEqual(self._resumen(self.origen), (0, 0, 0.0, 0.0))
+
+    def test_reconciliar_corrige_descuadres(self):
+        self._enemigo(self.origen, 10, 10).save()
+        Zona.objects.filter(pk=self.origen.pk).update(num_enemigos=7, exp_media=1.5)
+        salida = io.StringIO()
+        call_command('reconciliar_zonas', '--dry-run', stdout=salida)
+        self.assertIn('num_enemigos 7 -> 1', salida.getvalue())
+        self.assertEqual(self._resumen(self.origen)[0], 7)
+
+        call_command('reconciliar_zonas', stdout=io.StringIO())
+        self.assertEqual(self._resumen(self.origen), (1, 0, 10.0, 10.0))
+
+
+class RolesTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+        cls.grupo = Group.objects.create(name='GAME_MASTER')
+
+    def setUp(self):
+        caches['roles'].clear()
+        self.jugador = self.datos['jugador']
+        self.jugador.groups.add(self.grupo)
+        self.client.force_login(self.jugador)
+        self.addCleanup(buffer_auditoria.flush)
+
+    def test_revocar_grupo_deniega_la_siguiente_peticion(self):
+        self.assertEqual(self.client.get(reverse('juego:zona-create')).status_code, 200)
+        self.jugador.groups.remove(self.grupo)
+        self.assertEqual(self.client.get(reverse('juego:zona-create')).status_code, 403)
+
+    def test_revocacion_en_otro_worker_caduca_en_segundos(self):
+        self.assertEqual(timeout_roles(), CACHE_TIMEOUT_ROLES_LOCAL)
+        self.assertEqual(self.client.get(reverse('juego:zona-create')).status_code, 200)
+        # Borrar la fila de la tabla intermedia no dispara m2m_changed: nadie invalida la cache
+        self.jugador.groups.through.objects.filter(user=self.jugador).delete()
+        ahora = timezone.now().timestamp() + CACHE_TIMEOUT_ROLES_LOCAL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=ahora):
+            self.assertEqual(self.client.get(reverse('juego:zona-create')).status_code, 403)
+
+
+class OwnerRequiredMixinTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=4, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+        cls.shard = shard_para_usuario(cls.datos['jugador'].pk)
+        # Otro jugador del mismo shard, para que el 404 venga del filtro por dueño
+        cls.ajeno = Personaje.objects.using(cls.shard).exclude(usuario=cls.datos['jugador']).first().usuario
+
+    def setUp(self):
+        self.url = reverse('juego:personaje-detalle', args=[self.datos['personaje'].pk])
+        self.addCleanup(buffer_auditoria.flush)
+
+    def test_objeto_se_consulta_una_sola_vez(self):
+        request = RequestFactory().get('/')
+        request.user = self.datos['jugador']
+        vista = EditarPersonajeView()
+        vista.setup(request, pk=self.datos['personaje'].pk)
+        token = fijar_usuario_shard(lambda: request.user.pk)
+        self.addCleanup(liberar_usuario_shard, token)
+        with self.assertNumQueries(1, using=self.shard):
+            self.assertTrue(vista.test_func())
+            self.assertIs(vista.get_object(), vista.get_object())
+
+    def test_dueno_ve_su_personaje(self):
+        self.client.force_login(self.datos['jugador'])
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_otro_jugador_recibe_404(self):
+        self.client.force_login(self.ajeno)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class AuditoriaTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+
+    def setUp(self):
+        buffer_auditoria.flush()
+        self.addCleanup(buffer_auditoria.flush)
+        self.client.force_login(self.datos['admin'])
+
+    def test_evento_critico_se_guarda_al_terminar_una_peticion_tras_el_intervalo(self):
+        self.client.get(reverse('juego:zona-create'))
+        self.assertFalse(AuditEvent.objects.filter(ruta='zona-create').exists())
+
+        despues = time.monotonic() + buffer_auditoria.intervalo + 1
+        with mock.patch('juego.auditoria.time.monotonic', return_value=despues):
+            self.client.get(reverse('juego:zona-list'))
+        evento = AuditEvent.objects.get(ruta='zona-create')
+        self.assertEqual((evento.tipo, evento.usuario_id, evento.status_code), ('acceso_critico', self.datos['admin'].pk, 200))
+
+
+class AsyncListMixinTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=3, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+
+    def test_contexto_de_list_view(self):
+        self.client.force_login(self.datos['jugador'])
+        response = self.client.get(reverse('juego:zona-list'))
+        self.assertFalse(response.context['is_paginated'])
+        self.assertIsNone(response.context['page_obj'])
+        self.assertEqual(len(response.context['zonas']), 3)
+
+    def test_rechaza_vistas_paginadas(self):
+        class ZonasPaginadas(ZonaListView):
+            paginate_by = 2
+
+        request = RequestFactory().get('/')
+        vista = ZonasPaginadas()
+        vista.setup(request)
+        with self.assertRaises(ImproperlyConfigured):
+            async_to_sync(vista.get)(request)
+
+
+class ReplicaTests(TransactionTestCase):
+    """Primario y replica en dos SQLite distintos; la replica no recibe lo escrito en el test."""
+
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # La replica se añade antes de que la clase reparta las conexiones permitidas
+        directorio = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directorio.cleanup)
+        ajustes = connections.configure_settings({'default': {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': f'{directorio.name}/replica.sqlite3',
+        }})['default']
+        parche = mock.patch.dict(settings.DATABASES, {REPLICA_DB_ALIAS: ajustes})
+        parche.start()
+        cls.addClassCleanup(parche.stop)
+        cls.addClassCleanup(connections.__delitem__, REPLICA_DB_ALIAS)
+        cls.addClassCleanup(lambda: connections[REPLICA_DB_ALIAS].close())
+        super().setUpClass()
+        with connections[REPLICA_DB_ALIAS].schema_editor() as editor:
+            for modelo in (Zona, Enemigo, Personaje, Combate):
+                editor.create_model(modelo)
+        # La replica solo tiene las tablas del juego, sin la de usuarios
+        with connections[REPLICA_DB_ALIAS].constraint_checks_disabled():
+            Zona.objects.using(REPLICA_DB_ALIAS).bulk_create([
+                Zona(nombre='Zona de la replica', dificultad='normal', creada_por_id=1),
+            ])
+
+    def setUp(self):
+        for alias in ('default', 'roles'):
+            self.addCleanup(caches[alias].clear)
+        self.addCleanup(buffer_auditoria.flush)
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@test.local', 'admin')
+        Zona.objects.create(nombre='Zona comun', dificultad='normal', creada_por=admin)
+        self.client.force_login(admin)
+
+    def test_lee_del_primario_durante_el_pegado_y_despues_de_la_replica(self):
+        response = self.client.post(reverse('juego:zona-create'), {'nombre': 'Zona nueva', 'nivel': 1, 'dificultad': 'normal'})
+        self.assertEqual(response.status_code, 302)
+        self.assertGreater(self.client.session['replica_primario_hasta'], time.time())
+
+        response = self.client.get(reverse('juego:zona-list'))
+        self.assertContains(response, 'Zona nueva')
+        self.assertNotContains(response, 'Zona de la replica')
+
+        despues = time.time() + settings.REPLICA_PEGADO_SEGUNDOS + 1
+        with mock.patch('juego.middleware.time.time', return_value=despues):
+            response = self.client.get(reverse('juego:zona-list'))
+        self.assertContains(response, 'Zona de la replica')
+        self.assertNotContains(response, 'Zona nueva')
+
+    def test_la_replica_solo_dura_la_peticion(self):
+        self.assertContains(self.client.get(reverse('juego:zona-list')), 'Zona de la replica')
+        self.assertIsNone(ReplicaRouter().db_for_read(Zona))
+        self.assertTrue(Zona.objects.filter(nombre='Zona comun').exists())
+
+    async def test_la_replica_solo_dura_la_peticion_async(self):
+        response = await self.async_client.get(reverse('juego:zona-list'))
+        self.assertContains(response, 'Zona de la replica')
+        self.assertIsNone(ReplicaRouter().db_for_read(Zona))
+
+    def test_estadisticas_agregan_en_la_replica(self):
+        # Un jugador cuyo shard es ``default`` tambien con dos shards
+        jugadores = [get_user_model().objects.create_user(f'jugador_{i}') for i in range(2)]
+        jugador = next(j for j in jugadores if shard_para_usuario(j.pk) == 'default')
+        Personaje.objects.create(usuario=jugador, nombre='Heroe')
+        self.client.force_login(jugador)
+
+        for shards in (['default'], ['default', 'shard1']):
+            with self.subTest(shards=shards), override_settings(SHARDS=shards):
+                with CapturaConsultas() as captura:
+                    response = self.client.get(reverse('juego:estadisticas'))
+                self.assertEqual(response.status_code, 200)
+                # El personaje solo esta en el primario, asi que no aparece
+                self.assertNotContains(response, 'Heroe')
+                alias_juego = {c['alias'] for c in captura.consultas if 'juego_' in c['sql']}
+                self.assertEqual(alias_juego, {REPLICA_DB_ALIAS})
+
+
+class ShardTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        Usuario = get_user_model()
+        cls.creador = Usuario.objects.create_user('creador')
+        cls.usuarios = [Usuario.objects.create_user(f'jugador_{i}') for i in range(2)]
+        cls.zona = Zona.objects.create(nombre='Bosque', dificultad='normal', creada_por=cls.creador)
+        cls.objeto = Objeto.objects.create(nombre='Pocion', tipo='consumible', rareza='comun', efecto='Cura', curacion_vida=10)
+
+    def test_personajes_e_inventario_van_al_shard_de_su_usuario(self):
+        self.assertEqual({shard_para_usuario(usuario.pk) for usuario in self.usuarios}, {'default', 'shard1'})
+        for usuario in self.usuarios:
+            shard = shard_para_usuario(usuario.pk)
+            otro = ({'default', 'shard1'} - {shard}).pop()
+            personaje = Personaje.objects.create(usuario=usuario, nombre=usuario.username)
+            Inventario.objects.create(personaje=personaje, objeto=self.objeto, cantidad=1)
+
+            self.assertEqual(personaje._state.db, shard)
+            self.assertTrue(Inventario.objects.using(shard).filter(personaje__usuario=usuario).exists())
+            self.assertFalse(Personaje.objects.using(otro).filter(usuario=usuario).exists())
+
+            token = fijar_usuario_shard(lambda usuario=usuario: usuario.pk)
+            try:
+                self.assertEqual(list(Personaje.objects.values_list('nombre', flat=True)), [usuario.username])
+            finally:
+                liberar_usuario_shard(token)
+
+    def test_datos_de_referencia_se_copian_a_cada_shard(self):
+        enemigo = Enemigo.objects.create(
+            nombre='Lobo', tipo='normal', zona=self.zona, rareza='comun', creada_por=self.creador,
+            vida_maxima=20, ataque=3, defensa=1, velocidad=5, exp_otorgada=10,
+        )
+        for modelo, obj in ((get_user_model(), self.creador), (Zona, self.zona), (Objeto, self.objeto), (Enemigo, enemigo)):
+            copia = modelo._base_manager.using('shard1').get(pk=obj.pk)
+            self.assertEqual(str(copia), str(obj), modelo)
+
+        self.zona.nombre = 'Bosque oscuro'
+        self.zona.save()
+        self.assertEqual(Zona.objects.using('shard1').get(pk=self.zona.pk).nombre, 'Bosque oscuro')
+
+        enemigo.delete()
+        self.assertFalse(Enemigo._base_manager.using('shard1').filter(pk=enemigo.pk).exists())
+
+    def test_vistas_de_combate_buscan_el_personaje_en_su_shard(self):
+        for usuario in self.usuarios:
+            personaje = Personaje.objects.create(usuario=usuario, nombre=f'Heroe {usuario.pk}')
+            self.client.force_login(usuario)
+            with self.subTest(shard=personaje._state.db):
+                response = self.client.get(reverse('juego:combate-create', args=[personaje.pk]))
+                self.assertContains(response, personaje.nombre)
+                response = self.client.get(reverse('juego:combate-arena', args=[personaje.pk]))
+                self.assertRedirects(response, reverse('juego:combate-create', args=[personaje.pk]))
+
+    def test_migracion_recalcula_niveles_en_el_shard_migrado(self):
+        migracion = importlib.import_module('juego.migrations.0013_recalcular_niveles_por_shard')
+        por_shard = {}
+        for usuario in self.usuarios:
+            personaje = Personaje.objects.create(usuario=usuario, nombre=usuario.username, exp_actual=250)
+            Personaje.objects.using(personaje._state.db).filter(pk=personaje.pk).update(nivel=1)
+            por_shard[personaje._state.db] = personaje
+
+        migracion.calcular_niveles(django_apps, mock.Mock(connection=connections['shard1']))
+        niveles = {alias: Personaje.objects.using(alias).get(pk=p.pk).nivel for alias, p in por_shard.items()}
+        self.assertEqual(niveles, {'shard1': 3, 'default': 1})
+
+    def test_sincronizar_shards_copia_lo_que_falta_y_borra_lo_que_sobra(self):
+        # bulk_create no dispara las señales de replicacion
+        nueva, = Zona.objects.bulk_create([Zona(nombre='Desierto', dificultad='dificil', creada_por=self.creador)])
+        Objeto.objects.using('shard1').create(pk=9999, nombre='Huerfano', tipo='consumible', rareza='comun', efecto='Nada')
+        self.assertFalse(Zona.objects.using('shard1').filter(pk=nueva.pk).exists())
+
+        salida = io.StringIO()
+        call_command('sincronizar_shards', '--sin-migrar', stdout=salida)
+
+        self.assertEqual(Zona.objects.using('shard1').get(pk=nueva.pk).nombre, 'Desierto')
+        self.assertFalse(Objeto.objects.using('shard1').filter(pk=9999).exists())
+        self.assertIn('Shards sincronizados.', salida.getvalue())
+
+
+class SesionesTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+        cls.rata = Enemigo.objects.create(
+            nombre='Rata', tipo='normal', zona=cls.datos['zona'], rareza='comun', creada_por=cls.datos['admin'],
+            vida_maxima=1, ataque=1, defensa=0, velocidad=1, exp_otorgada=1,
+        )
+
+    def setUp(self):
+        self.addCleanup(caches['sesiones'].clear)
+        self.addCleanup(buffer_auditoria.flush)
+
+    def _en_bd(self, clave_sesion):
+        return Session.objects.get(pk=clave_sesion).get_decoded()
+
+    def test_sin_cache_compartida_todo_cambio_va_a_la_bd(self):
+        sesion = SessionStore()
+        sesion.create()
+        sesion = SessionStore(sesion.session_key)
+        sesion['ultima_zona_id'] = 3
+        sesion.save()
+        self.assertEqual(self._en_bd(sesion.session_key)['ultima_zona_id'], 3)
+
+    @mock.patch('juego.sesiones.es_compartida', return_value=True)
+    def test_con_cache_compartida_solo_se_aplazan_los_cambios_volatiles(self, _):
+        sesion = SessionStore()
+        sesion['ultima_zona_id'] = 1
+        sesion.create()
+        sesion = SessionStore(sesion.session_key)
+        sesion['ultima_zona_id'] = 2
+        sesion.save()
+        self.assertEqual(self._en_bd(sesion.session_key)['ultima_zona_id'], 1)
+
+        sesion = SessionStore(sesion.session_key)
+        del sesion['ultima_zona_id']
+        sesion.save()
+        self.assertNotIn('ultima_zona_id', self._en_bd(sesion.session_key))
+
+    @mock.patch('juego.sesiones.es_compartida', return_value=True)
+    def test_combate_ganado_no_se_reanuda_al_perder_la_cache(self, _):
+        personaje = self.datos['personaje']
+        self.client.force_login(self.datos['jugador'])
+        # Sin intervalo el inicio llega a la BD; la victoria se guarda con el normal
+        with self.settings(SESSION_INTERVALO_ESCRITURA_BD=0):
+            self.client.post(
+                reverse('juego:combate-create', args=[personaje.pk]),
+                {'zona': self.datos['zona'].pk, 'enemigo': self.rata.pk},
+            )
+        arena = reverse('juego:combate-arena', args=[personaje.pk])
+        response = self.client.post(arena, {'accion': 'atacar'})
+        self.assertTrue(response.context['combate_finalizado'])
+
+        caches['sesiones'].clear()
+        response = self.client.get(arena)
+        self.assertRedirects(response, reverse('juego:combate-create', args=[personaje.pk]), fetch_redirect_response=False)
+
+
+class GetCondicionalTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=2, enemigos_por_zona=2, objetos=4, combates_por_personaje=1)
+
+    def setUp(self):
+        self.client.force_login(self.datos['jugador'])
+        self.client.cookies['csrftoken'] = get_random_string(32)
+        self.addCleanup(buffer_auditoria.flush)
+
+    def _revalidar(self, url):
+        """Comprueba que la pagina responde 304 a su propio ETag y devuelve ese ETag."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        return etag
+
+    def test_detalle_personaje(self):
+        url = reverse('juego:personaje-detalle', args=[self.datos['personaje'].pk])
+        etag = self._revalidar(url)
+        Inventario.objects.del_usuario(self.datos['jugador']).filter(pk=self.datos['consumible'].pk).update(cantidad=F('cantidad') - 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_nuevo_secreto_csrf_invalida_el_etag(self):
+        url = reverse('juego:personaje-detalle', args=[self.datos['personaje'].pk])
+        etag = self._revalidar(url)
+        # Lo que hace login(): rotar el secreto CSRF de la cookie
+        self.client.cookies['csrftoken'] = get_random_string(32)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_detalle_zona_y_enemigo(self):
+        zona = self.datos['zona']
+        enemigo = Enemigo.objects.filter(zona=zona).first()
+        for objeto, nombre in ((zona, 'zona-detail'), (enemigo, 'enemigo-detail')):
+            url = reverse(f'juego:{nombre}', args=[objeto.pk])
+            etag = self._revalidar(url)
+            objeto.save()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, nombre)
+
+    def test_listados_de_zonas_y_enemigos(self):
+        etags = {nombre: self._revalidar(reverse(f'juego:{nombre}')) for nombre in ('zona-list', 'enemigo-list')}
+        Zona.objects.create(nombre='Pantano', dificultad='normal', creada_por=self.datos['admin'])
+        for nombre, etag in etags.items():
+            self.assertEqual(self.client.get(reverse(f'juego:{nombre}'), HTTP_IF_NONE_MATCH=etag).status_code, 200, nombre)
+
+
+class EncuentroAleatorioTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=3, objetos=4, combates_por_personaje=0)
+
+    def setUp(self):
+        self.addCleanup(buffer_auditoria.flush)
+        for cache in caches.all():
+            cache.clear()
+        self.client.force_login(self.datos['jugador'])
+        self.url = reverse('juego:combate-create', args=[self.datos['personaje'].pk])
+        zona = self.datos['zona']
+        self.normales = list(Enemigo.objects.filter(zona=zona, tipo='normal', activo=True).order_by('pk'))
+        self.post = {'modo': 'aleatorio', 'aleatorio-zona': zona.pk, 'aleatorio-tipo': 'normal'}
+
+    def _desactivar_sin_avisar(self, enemigos):
+        # Como si lo hubiera desactivado otro worker: esta cache conserva la version
+        version = version_catalogo()
+        Enemigo.objects.filter(pk__in=[enemigo.pk for enemigo in enemigos]).update(activo=False)
+        caches[CACHE_CATALOGO].set(CLAVE_VERSION_CATALOGO, version, None)
+
+    def test_sortea_otra_vez_si_la_tabla_tenia_un_enemigo_inactivo(self):
+        inactivo = self.normales[0]
+        self._desactivar_sin_avisar([inactivo])
+
+        with mock.patch('juego.forms.elegir_enemigo', return_value=inactivo.pk):
+            response = self.client.post(self.url, self.post)
+
+        self.assertRedirects(response, reverse('juego:combate-arena', args=[self.datos['personaje'].pk]), fetch_redirect_response=False)
+        estado = self.client.session[_combate_state_key(self.datos['personaje'].pk)]
+        self.assertIn(estado['enemigo_id'], [enemigo.pk for enemigo in self.normales[1:]])
+
+    def test_sin_enemigos_activos_muestra_el_error(self):
+        self._desactivar_sin_avisar(self.normales)
+
+        with mock.patch('juego.forms.elegir_enemigo', return_value=self.normales[0].pk):
+            response = self.client.post(self.url, self.post)
+
+        self.assertContains(response, 'No hay enemigos de tipo &quot;normal&quot; activos')
+
+
+class VersionCatalogoTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.construcciones = 0
+        self.tablas = TablasPorVersion(self._construir)
+        caches[CACHE_CATALOGO].clear()
+        self.addCleanup(caches[CACHE_CATALOGO].clear)
+
+    def _construir(self):
+        self.construcciones += 1
+        return self.construcciones
+
+    def test_con_cache_compartida_ve_la_invalidacion_de_otro_worker(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = {**settings.CACHES, CACHE_CATALOGO: {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio.name,
+        }}
+        with override_settings(CACHES=ajustes):
+            self.assertEqual(self.tablas.obtener(), 1)
+            self.assertEqual(self.tablas.obtener(), 1)
+            # Otro worker con su propia conexion a la misma cache
+            otro_worker = caches.create_connection(CACHE_CATALOGO)
+            with mock.patch('juego.catalogo._cache_version', return_value=otro_worker):
+                invalidar_catalogo()
+            self.assertEqual(self.tablas.obtener(), 2)
+
+    def test_con_cache_local_la_version_caduca_y_se_reconstruye(self):
+        self.assertEqual(self.tablas.obtener(), 1)
+        self.assertEqual(self.tablas.obtener(), 1)
+        # Lo que invalide otro worker no llega aqui; basta con que caduque
+        despues = time.time() + CACHE_TIMEOUT_VERSION_LOCAL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=despues):
+            self.assertEqual(self.tablas.obtener(), 2)
+            self.assertEqual(self.tablas.obtener(), 2)
+
+
+class CombateFormTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=2, enemigos_por_zona=3, objetos=4, combates_por_personaje=0)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def _opciones(self):
+        form = CombateForm(initial={'zona': self.datos['zona'].pk})
+        return form['enemigo'].as_widget()
+
+    def test_opciones_de_enemigo_cacheadas_hasta_que_cambia_la_zona(self):
+        # Firma de la zona + lista de enemigos; despues basta la firma
+        with self.assertNumQueries(2):
+            self._opciones()
+        with self.assertNumQueries(1):
+            html = self._opciones()
+        self.assertNotIn('Renombrado', html)
+
+        enemigo = Enemigo.objects.filter(zona=self.datos['zona'], tipo='normal').first()
+        enemigo.nombre = 'Renombrado'
+        enemigo.save()
+        with self.assertNumQueries(2):
+            html = self._opciones()
+        self.assertIn('Renombrado', html)
+        self.assertIn(f'data-zona-id="{self.datos["zona"].pk}"', html)
+
+
+def _registro(mensaje='hola %s', nivel=logging.INFO, exc_info=None, **extra):
+    registro = logging.LogRecord('juego.prueba', nivel, __file__, 1, mensaje, ('mundo',), exc_info)
+    registro.__dict__.update(extra)
+    return registro
+
+
+class LogHandlersTests(SimpleTestCase):
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = os.path.join(directorio.name, 'accesos.log')
+
+    def _lineas(self, ruta=None):
+        with open(ruta or self.ruta, encoding='utf-8') as fichero:
+            return [json.loads(linea) for linea in fichero]
+
+    def test_formato_json_con_extra_y_excepcion(self):
+        try:
+            raise ValueError('roto')
+        except ValueError:
+            registro = _registro(exc_info=sys.exc_info(), evento={'tipo': 'acceso_personaje'})
+        datos = json.loads(JsonFormatter().format(registro))
+        self.assertEqual(
+            {clave: datos[clave] for clave in ('nivel', 'logger', 'mensaje', 'evento')},
+            {'nivel': 'INFO', 'logger': 'juego.prueba', 'mensaje': 'hola mundo', 'evento': {'tipo': 'acceso_personaje'}},
+        )
+        self.assertIn('ValueError: roto', datos['excepcion'])
+        self.assertRegex(datos['ts'], r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$')
+
+    def test_escribe_por_lotes(self):
+        handler = RotatingBatchFileHandler(self.ruta, capacidad=3, intervalo=3600, delay=True)
+        self.addCleanup(handler.close)
+        handler.setFormatter(JsonFormatter())
+        handler.emit(_registro())
+        handler.emit(_registro())
+        self.assertFalse(os.path.exists(self.ruta))
+        handler.emit(_registro())
+        self.assertEqual(len(self._lineas()), 3)
+        # Un error no espera a completar el lote
+        handler.emit(_registro(nivel=logging.ERROR))
+        self.assertEqual(len(self._lineas()), 4)
+
+    def test_rota_al_llegar_a_max_bytes(self):
+        handler = RotatingBatchFileHandler(self.ruta, capacidad=1, intervalo=3600, maxBytes=300, backupCount=2, delay=True)
+        self.addCleanup(handler.close)
+        handler.setFormatter(JsonFormatter())
+        for _ in range(10):
+            handler.emit(_registro())
+        self.assertTrue(os.path.exists(f'{self.ruta}.1'))
+        self.assertFalse(os.path.exists(f'{self.ruta}.3'))
+        for ruta in (self.ruta, f'{self.ruta}.1', f'{self.ruta}.2'):
+            self.assertLessEqual(os.path.getsize(ruta), 300)
+            self.assertTrue(self._lineas(ruta))
+
+    def test_detener_vacia_la_cola(self):
+        handler = ColaArchivoJsonHandler(self.ruta, capacidad=1000, intervalo=3600)
+        self.addCleanup(handler.close)
+        with mock.patch('juego.log_handlers.atexit.register') as registrar:
+            for _ in range(5):
+                handler.emit(_registro())
+            try:
+                raise KeyError('falta')
+            except KeyError:
+                handler.emit(_registro(exc_info=sys.exc_info()))
+            handler.detener()
+            lineas = self._lineas()
+            self.assertEqual(len(lineas), 6)
+            self.assertIn("KeyError: 'falta'", lineas[-1]['excepcion'])
+
+            # Rearrancar tras detener() no vuelve a registrar el atexit
+            handler.emit(_registro())
+            handler.detener()
+        self.assertEqual(len(self._lineas()), 7)
+        registrar.assert_called_once_with(handler.detener)
+
+
+class LogAccesosTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+
+    def test_acceso_a_personaje_llega_al_fichero_json(self):
+        # settings_test usa un NullHandler; aqui se monta el handler real
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ruta = os.path.join(directorio.name, 'accesos.log')
+        handler = ColaArchivoJsonHandler(ruta)
+        self.addCleanup(handler.close)
+        logger = logging.getLogger('juego.middleware')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(buffer_auditoria.flush)
+
+        self.client.force_login(self.datos['jugador'])
+        self.client.get(reverse('juego:personaje-detalle', args=[self.datos['personaje'].pk]))
+        handler.detener()
+
+        with open(ruta, encoding='utf-8') as fichero:
+            eventos = [json.loads(linea)['evento'] for linea in fichero]
+        self.assertIn(
+            {'tipo': 'acceso_personaje', 'usuario': 'bench_jugador', 'personaje_id': self.datos['personaje'].pk,
+             'accion': 'ver', 'metodo': 'GET'},
+            eventos,
+        )
+
+
+class HistogramaTests(SimpleTestCase):
+
+    def test_percentiles_dentro_del_error_de_cubeta(self):
+        muestras = list(range(1, 100_001))
+        random.Random(7).shuffle(muestras)
+        histograma = Histograma()
+        for valor in muestras:
+            histograma.registrar(valor)
+        for cuantil, esperado in ((0.5, 50_000), (0.95, 95_000), (0.99, 99_000)):
+            self.assertAlmostEqual(histograma.percentil(cuantil), esperado, delta=esperado / Histograma.SUB_CUBETAS)
+        self.assertEqual(histograma.maximo, 100_000)
+        self.assertEqual(histograma.media(), 50_000.5)
+
+    def test_valores_pequenos_son_exactos(self):
+        histograma = Histograma()
+        self.assertEqual(histograma.percentil(0.5), 0)
+        for valor in (3, 3, 3, 7, 20):
+            histograma.registrar(valor)
+        self.assertEqual([histograma.percentil(q) for q in (0.5, 0.8, 1.0)], [3, 7, 20])
+
+    def test_formato_prometheus(self):
+        registro = RegistroMetricas()
+        registro.registrar('zona-list', 0.010, 0.002, 3)
+        registro.registrar('zona-list', 0.010, 0.002, 3, error=True)
+        registro.registrar('ruta "rara"', 0.001, 0, 1)
+        texto = registro.exportar_prometheus()
+
+        self.assertTrue(texto.endswith('\n'))
+        muestra = re.compile(r'^[a-z_]+\{ruta="(?:[^"\\]|\\.)*"(?:,quantile="[0-9.]+")?\} [0-9.e-]+$')
+        for linea in texto.splitlines():
+            if not linea.startswith('# '):
+                self.assertRegex(linea, muestra)
+        self.assertIn('# TYPE juego_request_duration_seconds summary', texto)
+        self.assertIn('juego_request_duration_seconds{ruta="zona-list",quantile="0.5"} 0.01\n', texto)
+        self.assertIn('juego_request_duration_seconds_count{ruta="zona-list"} 2\n', texto)
+        self.assertIn('juego_request_queries_sum{ruta="zona-list"} 6.0\n', texto)
+        self.assertIn('juego_request_errors_total{ruta="zona-list"} 1\n', texto)
+        self.assertIn('ruta="ruta \\"rara\\""', texto)
+
+
+class MetricasVistasTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=2, zonas=1, enemigos_por_zona=1, objetos=4, combates_por_personaje=0)
+
+    def setUp(self):
+        self.addCleanup(buffer_auditoria.flush)
+
+    def test_solo_staff_ve_el_panel(self):
+        url = reverse('juego:metricas')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.datos['jugador'])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.datos['admin'])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(METRICAS_TOKEN='secreto')
+    def test_prometheus_con_token_o_staff(self):
+        url = reverse('juego:metricas-prometheus')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+        self.client.force_login(self.datos['jugador'])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.datos['admin'])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(METRICAS_TOKEN=None)
+    def test_sin_token_configurado_no_vale_cabecera_vacia(self):
+        url = reverse('juego:metricas-prometheus')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer None').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+@mock.patch.multiple(
+    'juego.management.commands.benchmark',
+    setup_databases=mock.DEFAULT, teardown_databases=mock.DEFAULT,
+    setup_test_environment=mock.DEFAULT, teardown_test_environment=mock.DEFAULT,
+)
+class BenchmarkComandoTests(TestCase):
+    """Ejecuta el comando sobre la BD del test con datos minimos."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.addCleanup(buffer_auditoria.flush)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta_baseline = os.path.join(directorio.name, 'baseline.json')
+
+    def _benchmark(self, *argumentos):
+        salida = io.StringIO()
+        call_command(
+            'benchmark', '--pequeno', '--iteraciones', '1', '--calentamiento', '0',
+            '--baseline', self.ruta_baseline, *argumentos, stdout=salida,
+        )
+        return salida.getvalue()
+
+    def _baseline(self, consultas, p50_ms):
+        escenario = {'iteraciones': 1, 'p50_ms': p50_ms, 'p95_ms': p50_ms, 'media_ms': p50_ms,
+                     'consultas': consultas, 'asignaciones_kb': 0.0}
+        with open(self.ruta_baseline, 'w', encoding='utf-8') as fichero:
+            json.dump({'entorno': {'bd': 'sqlite'}, 'escenarios': {'estadisticas': escenario}}, fichero)
+
+    def test_guarda_el_baseline_con_todos_los_escenarios(self, **mocks):
+        salida = self._benchmark('--guardar-baseline')
+
+        self.assertIn('Baseline guardado', salida)
+        with open(self.ruta_baseline, encoding='utf-8') as fichero:
+            baseline = json.load(fichero)
+        self.assertEqual(set(baseline['escenarios']), set(ESCENARIOS))
+        for datos in baseline['escenarios'].values():
+            self.assertEqual(datos['iteraciones'], 1)
+            self.assertGreater(datos['consultas'], 0)
+        mocks['teardown_databases'].assert_called_once()
+
+    def test_los_tiempos_solo_avisan(self, **mocks):
+        self._baseline(consultas=1000, p50_ms=0.0)
+        salida = self._benchmark('--escenario', 'estadisticas')
+        self.assertIn('Mas lento o con mas memoria: estadisticas: p50_ms', salida)
+        self.assertIn('Sin regresiones', salida)
+
+    def test_falla_si_aumentan_las_consultas(self, **mocks):
+        self._baseline(consultas=1, p50_ms=10_000.0)
+        with self.assertRaisesMessage(CommandError, 'estadisticas: consultas 1 ->'):
+            self._benchmark('--escenario', 'estadisticas')
+
+
+class GenerarDatosComandoTests(TestCase):
+    databases = '__all__'
+
+    def test_genera_los_datos_en_su_shard_con_los_contadores_al_dia(self):
+        salida = io.StringIO()
+        call_command(
+            'generar_datos', '--usuarios', '4', '--personajes-por-usuario', '2', '--zonas', '2',
+            '--enemigos-por-zona', '3', '--objetos', '5', '--inventario-medio', '2', '--combates-medio', '2',
+            '--lote', '3', '--prefijo', 'smoke', stdout=salida,
+        )
+
+        self.assertIn('bulk_create', salida.getvalue())
+        Usuario = get_user_model()
+        self.assertEqual(Usuario.objects.filter(username__startswith='smoke_', is_superuser=False).count(), 4)
+        for alias in settings.SHARDS:
+            # Catalogo copiado en cada shard
+            self.assertEqual(Zona.objects.using(alias).count(), 2)
+            self.assertEqual(Enemigo.objects.using(alias).count(), 6)
+            self.assertEqual(Objeto.objects.using(alias).count(), 5)
+
+        personajes = {
+            alias: list(Personaje.objects.using(alias).values_list('usuario_id', flat=True))
+            for alias in settings.SHARDS
+        }
+        self.assertEqual(sum(len(ids) for ids in personajes.values()), 8)
+        for alias, usuario_ids in personajes.items():
+            self.assertTrue(all(shard_para_usuario(pk) == alias for pk in usuario_ids))
+            for modelo in (Inventario, Combate):
+                usuario_ids = modelo.objects.using(alias).values_list('personaje__usuario_id', flat=True)
+                self.assertTrue(all(shard_para_usuario(pk) == alias for pk in usuario_ids))
+        for modelo in (Inventario, Combate):
+            filas = sum(modelo.objects.using(alias).count() for alias in settings.SHARDS)
+            self.assertRegex(salida.getvalue(), rf'{modelo.__name__}\s+{filas}\n')
+
+        reconciliar = io.StringIO()
+        call_command('reconciliar_zonas', '--dry-run', stdout=reconciliar)
+        self.assertIn('Todos los contadores cuadran.', reconciliar.getvalue())
+
+    def test_rechaza_un_prefijo_ya_usado(self):
+        get_user_model().objects.create_user('smoke_0000')
+        with self.assertRaisesMessage(CommandError, "Ya hay usuarios con el prefijo 'smoke'"):
+            call_command('generar_datos', '--usuarios', '1', '--prefijo', 'smoke', stdout=io.StringIO())
+
+
+class SimularCargaComandoTests(TransactionTestCase):
+    """Los jugadores usan sus propias conexiones, asi que los datos deben estar confirmados."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.addCleanup(buffer_auditoria.flush)
+        sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=2, objetos=4, combates_por_personaje=0)
+
+    def test_resume_las_peticiones_de_los_jugadores(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ruta = os.path.join(directorio.name, 'informe.json')
+        salida = io.StringIO()
+
+        # Un solo jugador: con varios, la BD SQLite de los tests da bloqueos esporadicos
+        call_command('simular_carga', '--jugadores', '1', '--acciones', '8', '--salida', ruta, '--limpiar', stdout=salida)
+
+        lineas = salida.getvalue().splitlines()
+        self.assertRegex(lineas[0], r'^1 jugadores \(carga_[0-9a-f]{6}_\*\) contra la app WSGI en proceso\.\.\.$')
+        self.assertRegex(
+            lineas[1],
+            r'^\d+ peticiones en [\d.]+ s: [\d.]+ req/s, error \d+\.\d{2}%, p50 [\d.]+ ms, p95 [\d.]+ ms, p99 [\d.]+ ms$',
+        )
+        with open(ruta, encoding='utf-8') as fichero:
+            informe = json.load(fichero)
+        self.assertEqual(informe['jugadores'], 1)
+        self.assertEqual(informe['servidor'], 'wsgi')
+        self.assertEqual((informe['tasa_error'], informe['excepciones']), (0, {}))
+        self.assertEqual(informe['peticiones'], sum(datos['peticiones'] for datos in informe['acciones'].values()))
+        self.assertEqual(informe['acciones']['registro']['peticiones'], 1)
+        for accion, datos in informe['acciones'].items():
+            self.assertIn(f'  {accion:<16} {datos["peticiones"]:6d}  err', salida.getvalue())
+            self.assertLessEqual(datos['p50_ms'], datos['p95_ms'])
+        self.assertFalse(get_user_model().objects.filter(username__startswith='carga_').exists())
+
+
+class AdminTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=4, zonas=2, enemigos_por_zona=3, objetos=12, combates_por_personaje=5)
+
+    def setUp(self):
+        self.client.force_login(self.datos['admin'])
+        self.addCleanup(buffer_auditoria.flush)
+
+    def test_listados_sin_consultas_por_fila(self):
+        for modelo, shard in itertools.product(('personaje', 'inventario', 'combate'), ('default', 'shard1')):
+            url = reverse(f'admin:juego_{modelo}_changelist')
+            with CapturaConsultas() as captura:
+                response = self.client.get(url, {'shard': shard})
+            self.assertEqual(response.status_code, 200)
+            self.assertGreater(response.context['cl'].result_count, 0, (modelo, shard))
+            self.assertLessEqual(len(captura), 3, (modelo, shard))
+
+    def test_edita_objetos_de_cualquier_shard(self):
+        for shard in ('default', 'shard1'):
+            personaje = Personaje.objects.using(shard).first()
+            url = reverse('admin:juego_personaje_change', args=[personaje.pk])
+            response = self.client.get(url, {'_changelist_filters': f'shard={shard}'})
+            self.assertContains(response, f'value="{personaje.nombre}"')
+
+    def test_formulario_de_inventario_sin_selects_completos(self):
+        response = self.client.get(reverse('admin:juego_inventario_add'))
+        self.assertContains(response, 'class="admin-autocomplete"', count=2)
+        self.assertNotContains(response, self.datos['equipable'].objeto.nombre)
+
+
+class MantenimientoTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=4, zonas=2, enemigos_por_zona=3, objetos=12, combates_por_personaje=2)
+
+    def test_revivir_todos_los_shards(self):
+        Personaje.objects.using('shard1').update(vida_actual=0)
+        salida = io.StringIO()
+        call_command('revivir_personajes', stdout=salida)
+        for shard in ('default', 'shard1'):
+            self.assertFalse(Personaje.objects.using(shard).filter(vida_actual__lt=F('salud_maxima')).exists())
+        self.assertIn('personajes revividos', salida.getvalue())
+
+    def test_retirar_inactivos_desde_el_admin(self):
+        hace_un_anio = timezone.now() - timedelta(days=365)
+        Personaje.objects.using('shard1').update(fecha_creacion=hace_un_anio)
+        dormido, activo = Personaje.objects.using('shard1').order_by('pk')
+        Combate.objects.using('shard1').filter(personaje=dormido).update(fecha_hora=hace_un_anio)
+
+        self.client.force_login(self.datos['admin'])
+        url = reverse('admin:juego_personaje_changelist') + '?shard=shard1'
+        datos = {'action': 'retirar_inactivos', '_selected_action': [dormido.pk, activo.pk]}
+        with CapturaConsultas() as captura:
+            self.client.post(url, datos)
+        buffer_auditoria.flush()
+        self.assertEqual(
+            dict(Personaje.objects.using('shard1').values_list('pk', 'estado')),
+            {dormido.pk: 'retirado', activo.pk: 'activo'},
+        )
+        self.assertEqual(sum(consulta['sql'].startswith('UPDATE') for consulta in captura.consultas), 1)
+
+    def test_desactivar_enemigos_de_una_zona(self):
+        zona = self.datos['zona']
+        version = version_catalogo()
+        call_command('desactivar_enemigos', '--zona', str(zona.pk), stdout=io.StringIO())
+        for shard in ('default', 'shard1'):
+            self.assertFalse(Enemigo.objects.using(shard).filter(zona=zona, activo=True).exists())
+        self.assertTrue(Enemigo.objects.exclude(zona=zona).filter(activo=True).exists())
+        self.assertNotEqual(version_catalogo(), version)
+
+
+class PerfiladoTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(jugadores=1, zonas=1, enemigos_por_zona=2, objetos=4, combates_por_personaje=2)
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(PERFILES_DIRECTORIO=directorio.name, PERFILES_MAXIMO=2)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(buffer_auditoria.flush)
+        self.client.force_login(self.datos['admin'])
+
+    def test_perfila_solo_a_staff_que_lo_pide(self):
+        url = reverse('juego:personaje-lista')
+        self.assertNotIn(CABECERA_PERFIL, self.client.get(url))
+
+        jugador = Client()
+        jugador.force_login(self.datos['jugador'])
+        self.assertNotIn(CABECERA_PERFIL, jugador.get(url, {'_perfilar': 1}))
+
+        response = self.client.get(url, HTTP_X_PERFILAR='1')
+        nombre = response[CABECERA_PERFIL]
+        detalle = self.client.get(reverse('juego:perfil-detalle', args=[nombre]))
+        self.assertEqual(detalle.status_code, 200)
+        self.assertGreater(detalle.context['perfil']['total_consultas'], 0)
+        self.assertTrue(detalle.context['funciones'])
+
+    def test_conserva_solo_los_mas_recientes(self):
+        url = reverse('juego:zona-list')
+        nombres = [self.client.get(url, {'_perfilar': 1})[CABECERA_PERFIL] for _ in range(3)]
+        self.assertCountEqual([perfil['nombre'] for perfil in listar_perfiles()], nombres[1:])
+
+    def test_nombre_invalido(self):
+        response = self.client.get(reverse('juego:perfil-descargar', args=['..']))
+        self.assertEqual(response.status_code, 404)
+
+
+def _crear_test_ruta(patron, rol):
+    def test(self):
+        kwargs = _argumentos(patron.name, patron.pattern.converters, self.datos)
+        url = reverse(f'juego:{patron.name}', kwargs=kwargs)
+        cliente = self.clientes[rol]
+        response = self.assertPresupuestoConsultas(f'GET {patron.name} ({rol})', lambda: cliente.get(url))
+        self.assertLess(response.status_code, 500)
+    return test
+
+
+for _patron in urls.urlpatterns:
+    for _rol in ROLES:
+        setattr(
+            PresupuestoRutasTests,
+            f"test_get_{_patron.name.replace('-', '_')}_{_rol}",
+            _crear_test_ruta(_patron, _rol),
+        )
@@ -19,12 +19,14 @@ urlpatterns = [
     path("personajes/<int:personaje_id>/inventario/agregar/", views.agregar_objeto_inventario, name="inventario-agregar"),
     path("personajes/<int:personaje_id>/inventario/usar/", views.usar_consumible, name="inventario-usar"),
     path("personajes/<int:personaje_id>/inventario/equipamiento/", views.toggle_equipamiento_inventario, name="inventario-equipamiento"),
+    path("personajes/<int:personaje_id>/inventario/equipamiento/optimo/", views.equipamiento_optimo_view, name="inventario-equipamiento-optimo"),
     path("personajes/<int:personaje_id>/tema/", views.fijar_tema, name="tema-fijar"),
     path('zonas/', views.ZonaListView.as_view(), name='zona-list'),
     path('zonas/<int:pk>/', views.ZonaDetailView.as_view(), name='zona-detail'),
     path('zonas/create/', views.ZonaCreateView.as_view(), name='zona-create'),
     path('zonas/<int:pk>/update/', views.ZonaUpdateView.as_view(), name='zona-update'),
     path('zonas/<int:pk>/delete/', views.ZonaDeleteView.as_view(), name='zona-delete'),
+    path('zonas/<int:pk>/enemigos.json', views.enemigos_zona_json, name='zona-enemigos-json'),
     path('zonas/<int:pk>/guardar-sesion/', views.guardar_zona_sesion_view, name='guardar-zona-sesion'),
     path('enemigos/', views.EnemigoListView.as_view(), name='enemigo-list'),
     path('enemigos/<int:pk>/', views.EnemigoDetailView.as_view(), name='enemigo-detail'),
@@ -32,8 +34,14 @@ urlpatterns = [
     path('enemigos/<int:pk>/update/', views.EnemigoUpdateView.as_view(), name='enemigo-update'),
     path('enemigos/<int:pk>/delete/', views.EnemigoDeleteView.as_view(), name='enemigo-delete'),
     path('estadisticas/', views.estadisticas_view, name='estadisticas'),
+    path('metricas/', views.metricas_view, name='metricas'),
+    path('metricas/prometheus/', views.metricas_prometheus_view, name='metricas-prometheus'),
+    path('perfiles/', views.perfiles_view, name='perfiles'),
+    path('perfiles/<str:nombre>/', views.perfil_detalle_view, name='perfil-detalle'),
+    path('perfiles/<str:nombre>/descargar/', views.perfil_descargar_view, name='perfil-descargar'),
     path('cambiar-tema/', views.cambiar_tema_view, name='cambiar-tema'),
     path('personajes/<int:personaje_id>/combates/', views.CombateListView.as_view(), name='combate-list'),
     path('personajes/<int:personaje_id>/combates/crear/', views.CombateCreateView.as_view(), name='combate-create'),
     path('personajes/<int:personaje_id>/combates/arena/', views.CombateArenaView.as_view(), name='combate-arena'),
+    path('personajes/<int:personaje_id>/combates/probabilidades/', views.probabilidades_victoria_json, name='combate-probabilidades'),
 ]
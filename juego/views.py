@@ -1,28 +1,46 @@
+import hashlib
+import hmac
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth import authenticate, login, logout
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Avg, Count, F, Q, Sum
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, redirect, render
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Q, Sum
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
 from django.urls import reverse
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
 from django.views.generic import CreateView, DeleteView, ListView, UpdateView, DetailView, View
 
-from .forms import AddInventoryItemForm, CombateForm, EnemigoForm, IniciarCombateForm, PersonajeForm, SeleccionarEnemigoForm, UseConsumableForm, ZonaForm
-from .mixins import AdminRequiredMixin, OwnerRequiredMixin, SetLastCharacterMixin
+from .forms import AddInventoryItemForm, CombateForm, EnemigoForm, IniciarCombateForm, OptimizarEquipamientoForm, PersonajeForm, SeleccionarEnemigoForm, UseConsumableForm, ZonaForm
+from .botin import conceder_botin, tirar_botin
+from .combate import estimar_victoria, luchador_personaje, probabilidad_victoria, rango_golpe, reduccion_defensa, stats_efectivos
+from .equipamiento import SLOTS, equipar, optimizar_equipamiento
+from .catalogo import afirma_catalogo, enemigos_activos_zona, firma_enemigos_zona, invalidar_catalogo
+from .encuentros import elegir_enemigo
+from .metricas import registro_metricas
+from .recomendaciones import recomendar_enemigos
+from .perfilado import CABECERA_PERFILAR, PARAMETRO_PERFILAR, cargar_perfil, listar_perfiles, maximo_perfiles, ruta_prof, top_funciones
+from .mixins import AdminRequiredMixin, AsyncListMixin, ConditionalGetMixin, OwnerRequiredMixin, SetLastCharacterMixin, preparar_request_async
 from .models import Enemigo, Inventario, Objeto, Personaje, Zona, Combate
+from .roles import es_admin_juego
+from .routers import solo_lectura
+from .shards import en_todos_los_shards, replicar_referencia
 
 
 def _es_usuario_admin(user):
-    return user.groups.filter(
-        name__in=['GAME_MASTER', 'ADMIN_CONTENIDO', 'ADMIN']
-    ).exists() or user.is_staff or user.is_superuser
+    return es_admin_juego(user)
 
 def _obtener_personaje_usuario(request, personaje_id):
-    return get_object_or_404(Personaje, id=personaje_id, usuario=request.user)
+    return get_object_or_404(Personaje.objects.del_usuario(request.user), id=personaje_id)
 
 def inicio_redirect_view(request):
     if request.user.is_authenticated:
@@ -81,15 +99,31 @@ class CrearPersonajeView(LoginRequiredMixin, CreateView):
         self.request.session["ultimo_personaje_id"] = self.object.id
         return response
 
-class DetallePersonajeView(LoginRequiredMixin, OwnerRequiredMixin, SetLastCharacterMixin, DetailView):
+class DetallePersonajeView(LoginRequiredMixin, OwnerRequiredMixin, SetLastCharacterMixin, ConditionalGetMixin, DetailView):
     model = Personaje
     template_name = "personajes/personaje_detail.html"
     context_object_name = "personaje"
 
     def get_queryset(self):
-        return Personaje.objects.filter(usuario=self.request.user).prefetch_related(
-            "inventario_items__objeto"
+        return Personaje.objects.filter(usuario=self.request.user)
+
+    def get_version_recurso(self):
+        datos = Personaje.objects.filter(pk=self.kwargs['pk'], usuario=self.request.user).aggregate(
+            ultima=Max('fecha_actualizacion'),
+            items=Count('inventario_item'),
+            cantidad=Sum('inventario_item__cantidad'),
+            ultima_adquisicion=Max('inventario_item__fecha_adquisicion'),
+            equipados=Sum('inventario_item__id', filter=Q(inventario_item__equipado=True)),
+            bonus=Sum(
+                F('inventario_item__objeto__bonus_ataque') + F('inventario_item__objeto__bonus_defensa')
+                + F('inventario_item__objeto__bonus_salud') + F('inventario_item__objeto__bonus_velocidad'),
+                filter=Q(inventario_item__equipado=True),
+            ),
         )
+        if datos['ultima'] is None:
+            return None
+        firma = ':'.join(str(valor) for valor in datos.values())
+        return datos['ultima'], firma
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -300,6 +334,53 @@ def toggle_equipamiento_inventario(request, personaje_id):
 
     return redirect("juego:inventario-ver", personaje_id=personaje.id)
 
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def equipamiento_optimo_view(request, personaje_id):
+    """Mejor combinacion de equipo del inventario contra un enemigo; por POST la equipa."""
+    personaje = _obtener_personaje_usuario(request, personaje_id)
+    form = OptimizarEquipamientoForm(request.POST if request.method == "POST" else request.GET or None)
+    if not form.is_valid():
+        if request.method == "POST":
+            messages.error(request, "No se pudo equipar: el enemigo no es valido.")
+            return redirect("juego:inventario-ver", personaje_id=personaje.id)
+        return render(request, "inventario/equipamiento_optimo.html", {"personaje": personaje, "form": form})
+
+    enemigo = form.cleaned_data["enemigo"]
+    equipamiento = optimizar_equipamiento(personaje, enemigo)
+    if request.method == "POST":
+        equipar(personaje, equipamiento)
+        messages.success(
+            request,
+            f"Equipo optimizado contra {enemigo.nombre}: {equipamiento.probabilidad * 100:.1f}% de victoria.",
+        )
+        return redirect("juego:inventario-ver", personaje_id=personaje.id)
+
+    actuales = {slot: [] for slot in SLOTS}
+    for item in personaje.inventario_items.filter(equipado=True).select_related("objeto"):
+        actuales.setdefault(item.posicion_slot, []).append(item)
+    slots = dict(Objeto.SLOTS_CHOICES)
+    filas = []
+    for slot in SLOTS:
+        recomendada = equipamiento.piezas[slot]
+        filas.append({
+            "slot": slots[slot],
+            "actuales": actuales[slot],
+            "recomendada": recomendada,
+            "cambia": {item.id for item in actuales[slot]} != ({recomendada.inventario_id} if recomendada else set()),
+        })
+    return render(request, "inventario/equipamiento_optimo.html", {
+        "personaje": personaje,
+        "form": form,
+        "enemigo": enemigo,
+        "filas": filas,
+        "hay_cambios": any(fila["cambia"] for fila in filas),
+        "probabilidad_actual": estimar_victoria(personaje, enemigo) * 100,
+        "probabilidad_optima": equipamiento.probabilidad * 100,
+        "evaluadas": equipamiento.evaluadas,
+    })
+
 @login_required
 @require_http_methods(["POST"])
 def fijar_tema(request, personaje_id):
@@ -356,28 +437,33 @@ def logout_view(request):
     return redirect('juego:inicio-sesion')
 
 
-class ZonaListView(ListView):
+class ZonaListView(AsyncListMixin, ListView):
     model = Zona
     template_name = 'juego/zona_list.html'
     context_object_name = 'zonas'
+    solo_lectura = True
 
     def get_queryset(self):
-        return Zona.objects.annotate(
-            num_enemigos=Count('enemigo'),
-        ).order_by('nivel', 'nombre')
+        return Zona.objects.order_by('nivel', 'nombre')
+
+    async def aget_version_recurso(self):
+        return await afirma_catalogo()
 
 
-class ZonaDetailView(DetailView):
+class ZonaDetailView(ConditionalGetMixin, DetailView):
     model = Zona
     template_name = 'juego/zona_detail.html'
     context_object_name = 'zona'
+    solo_lectura = True
 
     def get_queryset(self):
-        return Zona.objects.select_related(
-            'creada_por', 'actualizado_por'
-        ).prefetch_related(
-            'enemigos'
-        )
+        return Zona.objects.all()
+
+    def get_version_recurso(self):
+        ultima = Zona.objects.filter(pk=self.kwargs['pk']).values_list('fecha_actualizacion', flat=True).first()
+        if ultima is None:
+            return None
+        return ultima, str(ultima)
 
 
 class ZonaCreateView(AdminRequiredMixin, CreateView):
@@ -415,27 +501,66 @@ class ZonaDeleteView(OwnerRequiredMixin, AdminRequiredMixin, DeleteView):
         return reverse('juego:zona-list')
 
 
-class EnemigoListView(ListView):
+class EnemigoListView(AsyncListMixin, ListView):
     model = Enemigo
     template_name = 'juego/enemigo_list.html'
     context_object_name = 'enemigos'
+    solo_lectura = True
 
     def get_queryset(self):
         return Enemigo.objects.select_related(
             'zona', 'creada_por'
         ).order_by('zona', 'tipo', 'nombre')
 
+    async def aget_version_recurso(self):
+        return await afirma_catalogo()
 
-class EnemigoDetailView(DetailView):
+
+class EnemigoDetailView(ConditionalGetMixin, DetailView):
     model = Enemigo
     template_name = 'juego/enemigo_detail.html'
     context_object_name = 'enemigo'
+    solo_lectura = True
 
     def get_queryset(self):
         return Enemigo.objects.select_related(
             'zona', 'creada_por'
         )
 
+    def get_version_recurso(self):
+        fechas = Enemigo.objects.filter(pk=self.kwargs['pk']).values_list(
+            'fecha_actualizacion', 'zona__fecha_actualizacion'
+        ).first()
+        if fechas is None:
+            return None
+        # La probabilidad de victoria cambia con la vida y el equipo del personaje
+        personaje, stats = self._estimacion()
+        estado = (personaje.pk, stats['vida_actual'], stats['ataque'], stats['defensa'], stats['velocidad']) if personaje else ''
+        return max(fechas), f"{fechas[0]}:{fechas[1]}:{estado}"
+
+    def _estimacion(self):
+        """Personaje con el que se estima la victoria (el ultimo usado o el activo) y sus stats."""
+        if not hasattr(self, '_personaje_estimacion'):
+            personaje = None
+            user = self.request.user
+            if user.is_authenticated:
+                personajes = Personaje.objects.del_usuario(user)
+                ultimo_id = self.request.session.get('ultimo_personaje_id')
+                if ultimo_id:
+                    personaje = personajes.filter(pk=ultimo_id).first()
+                if personaje is None:
+                    personaje = personajes.filter(estado='activo').first()
+            self._personaje_estimacion = personaje, stats_efectivos(personaje) if personaje else None
+        return self._personaje_estimacion
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        personaje, stats = self._estimacion()
+        if personaje is not None:
+            context['personaje_estimacion'] = personaje
+            context['probabilidad_victoria'] = estimar_victoria(personaje, self.object, stats) * 100
+        return context
+
 
 class EnemigoCreateView(AdminRequiredMixin, CreateView):
     model = Enemigo
@@ -467,35 +592,46 @@ class EnemigoDeleteView(OwnerRequiredMixin, AdminRequiredMixin, DeleteView):
         return reverse('juego:enemigo-list')
 
 
+@solo_lectura
 @login_required
-def estadisticas_view(request):
-    es_admin = request.user.groups.filter(
-        name__in=['GAME_MASTER', 'ADMIN_CONTENIDO', 'ADMIN']
-    ).exists() or request.user.is_staff or request.user.is_superuser
-
-    personajes_qs = Personaje.objects.all() if es_admin else Personaje.objects.filter(usuario=request.user)
-    combates_qs = Combate.objects.all() if es_admin else Combate.objects.filter(personaje__usuario=request.user)
+async def estadisticas_view(request):
+    await preparar_request_async(request)
+    es_admin = _es_usuario_admin(request.user)
+
+    # En modo admin se consulta cada shard y se combinan los resultados
+    if es_admin:
+        personajes_qs = en_todos_los_shards(Personaje.objects.all())
+        combates_qs = en_todos_los_shards(Combate.objects.all())
+    else:
+        personajes_qs = [Personaje.objects.del_usuario(request.user)]
+        combates_qs = [Combate.objects.del_usuario(request.user)]
 
-    total_zonas = Zona.objects.count()
-    total_enemigos = Enemigo.objects.count()
-    total_jefes = Enemigo.objects.filter(tipo='jefe').count()
+    total_zonas = await Zona.objects.acount()
+    total_enemigos = await Enemigo.objects.acount()
+    total_jefes = await Enemigo.objects.filter(tipo='jefe').acount()
 
-    stats = Enemigo.objects.aggregate(
+    stats = await Enemigo.objects.aaggregate(
         promedio_exp=Avg('exp_otorgada'),
         promedio_vida=Avg('vida_maxima')
     )
     
     # Stats reales basadas en Combate
-    stats_combates = combates_qs.aggregate(
-        total=Count('id'),
-        promedio_exp_ganada=Avg('exp_ganada'),
-    )
+    total_combates = 0
+    exp_ganada = 0
+    for qs in combates_qs:
+        parcial = await qs.aaggregate(total=Count('id'), exp_ganada=Sum('exp_ganada'))
+        total_combates += parcial['total']
+        exp_ganada += parcial['exp_ganada'] or 0
     
     # Mejores personajes (Win Rate)
-    personajes_stats = personajes_qs.annotate(
-        total_combates=Count('combate'),
-        victorias=Count('combate', filter=Q(combate__resultado='victoria')),
-    ).order_by('-victorias', '-nivel', 'nombre')
+    personajes_stats = []
+    for qs in personajes_qs:
+        personajes_stats += [pj async for pj in qs.annotate(
+            total_combates=Count('combate'),
+            victorias=Count('combate', filter=Q(combate__resultado='victoria')),
+        ).order_by('-victorias', '-nivel', 'nombre')]
+    if len(personajes_qs) > 1:
+        personajes_stats.sort(key=lambda pj: (-pj.victorias, -pj.nivel, pj.nombre))
 
     context = {
         'total_zonas': total_zonas,
@@ -503,8 +639,8 @@ def estadisticas_view(request):
         'total_jefes': total_jefes,
         'promedio_exp': stats['promedio_exp'] or 0,
         'promedio_vida': stats['promedio_vida'] or 0,
-        'total_combates': stats_combates['total'] or 0,
-        'promedio_exp_ganada': stats_combates['promedio_exp_ganada'] or 0,
+        'total_combates': total_combates,
+        'promedio_exp_ganada': exp_ganada / total_combates if total_combates else 0,
         'personajes_stats': personajes_stats,
         'es_admin': es_admin,
     }
@@ -512,10 +648,83 @@ def estadisticas_view(request):
     return render(request, 'juego/estadisticas.html', context)
 
 
+@staff_member_required
+def metricas_view(request):
+    filas = registro_metricas.resumen()
+    return render(request, 'juego/metricas.html', {
+        'por_tiempo': sorted(filas, key=lambda fila: fila['p95_ms'], reverse=True)[:25],
+        'por_consultas': sorted(filas, key=lambda fila: fila['consultas_media'], reverse=True)[:10],
+        'desde': datetime.fromtimestamp(registro_metricas.desde, tz=dt_timezone.utc),
+    })
+
+
+def metricas_prometheus_view(request):
+    """Exporta las metricas en formato de texto de Prometheus.
+
+    Accesible para staff o con ``Authorization: Bearer <METRICAS_TOKEN>``.
+    """
+    token = getattr(settings, 'METRICAS_TOKEN', None)
+    cabecera = request.headers.get('Authorization', '')
+    autorizado_por_token = bool(token) and hmac.compare_digest(cabecera, f'Bearer {token}')
+    if not autorizado_por_token and not (request.user.is_authenticated and request.user.is_staff):
+        raise PermissionDenied("No tienes permiso para ver las métricas.")
+
+    return HttpResponse(
+        registro_metricas.exportar_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@staff_member_required
+def perfiles_view(request):
+    return render(request, 'juego/perfiles.html', {
+        'perfiles': listar_perfiles(),
+        'maximo': maximo_perfiles(),
+        'cabecera': CABECERA_PERFILAR,
+        'parametro': PARAMETRO_PERFILAR,
+    })
+
+
+ORDENES_PERFIL = {'cumulative': 'Acumulado', 'tottime': 'Tiempo propio', 'ncalls': 'Llamadas'}
+
+
+@staff_member_required
+def perfil_detalle_view(request, nombre):
+    orden = request.GET.get('orden', 'cumulative')
+    if orden not in ORDENES_PERFIL:
+        orden = 'cumulative'
+    try:
+        perfil = cargar_perfil(nombre)
+        funciones = top_funciones(nombre, limite=40, orden=orden)
+    except FileNotFoundError:
+        raise Http404("El perfil no existe o ya se ha descartado.")
+    return render(request, 'juego/perfil_detalle.html', {
+        'perfil': perfil,
+        'funciones': funciones,
+        'orden': orden,
+        'ordenes': ORDENES_PERFIL,
+        'consultas_lentas': perfil['consultas'][:20],
+        'consultas_repetidas': perfil['repetidas'][:20],
+    })
+
+
+@staff_member_required
+def perfil_descargar_view(request, nombre):
+    """Descarga el ``.prof`` para abrirlo con snakeviz, pstats, etc."""
+    try:
+        ruta = ruta_prof(nombre)
+    except FileNotFoundError:
+        raise Http404("El perfil no existe o ya se ha descartado.")
+    return FileResponse(ruta.open('rb'), as_attachment=True, filename=ruta.name)
+
+
 def incrementar_nivel_zona(zona_id):
     Zona.objects.filter(pk=zona_id).update(
         nivel=F('nivel') + 1
     )
+    replicar_referencia(Zona, [zona_id])
+    # update() no dispara las señales que rotan la version del catalogo
+    invalidar_catalogo()
 
 
 def cambiar_tema_view(request):
@@ -528,31 +737,83 @@ def cambiar_tema_view(request):
     return response
 
 
+def _firma_enemigos_zona(request, pk):
+    """Firma de los enemigos de la zona activa ``pk`` (None si no existe), una vez por peticion."""
+    if not hasattr(request, '_firma_enemigos_zona'):
+        activa = Zona.objects.filter(pk=pk, activa=True).exists()
+        request._firma_enemigos_zona = firma_enemigos_zona(pk) if activa else None
+    return request._firma_enemigos_zona
+
+
+def _etag_enemigos_zona(request, pk):
+    firma = _firma_enemigos_zona(request, pk)
+    return hashlib.md5(firma.encode()).hexdigest() if firma is not None else None
+
+
+@solo_lectura
+@require_http_methods(["GET"])
+# El ETag revalida barato, asi que la respuesta puede vivir mas en el navegador
+@cache_control(public=True, max_age=600, stale_while_revalidate=60)
+@condition(etag_func=_etag_enemigos_zona)
+def enemigos_zona_json(request, pk):
+    """Enemigos activos de una zona para el selector dependiente del formulario de combate."""
+    firma = _firma_enemigos_zona(request, pk)
+    if firma is None:
+        raise Http404("Zona no encontrada")
+    enemigos = enemigos_activos_zona(pk, firma)
+
+    tipo = request.GET.get('tipo')
+    if tipo:
+        enemigos = [e for e in enemigos if e['tipo'] == tipo]
+
+    return JsonResponse({'zona': pk, 'enemigos': enemigos})
+
+
+@login_required
+@require_http_methods(["GET"])
+def probabilidades_victoria_json(request, personaje_id):
+    """Probabilidad de victoria del personaje contra cada enemigo activo de ``?zona=``."""
+    personaje = _obtener_personaje_usuario(request, personaje_id)
+    try:
+        zona_id = int(request.GET.get('zona', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Indica la zona con ?zona=<id>.'}, status=400)
+
+    stats = stats_efectivos(personaje)
+    enemigos = Enemigo.objects.filter(zona_id=zona_id, activo=True).values(
+        'id', 'vida_maxima', 'ataque', 'defensa', 'velocidad'
+    )
+    return JsonResponse({
+        'zona': zona_id,
+        'probabilidades': {enemigo['id']: round(estimar_victoria(personaje, enemigo, stats), 4) for enemigo in enemigos},
+    })
+
+
 def guardar_zona_sesion_view(request, pk):
     request.session['ultima_zona_id'] = pk
     request.session.set_expiry(24 * 60 * 60)
     return redirect('juego:zona-detail', pk=pk)
 
-class CombateListView(LoginRequiredMixin, ListView):
+class CombateListView(AsyncListMixin, LoginRequiredMixin, ListView):
     model = Combate
     template_name = 'juego/combate_list.html'
     context_object_name = 'combates'
+    solo_lectura = True
 
     def test_func(self):
         personaje_id = self.kwargs.get('personaje_id')
-        return Personaje.objects.filter(id=personaje_id, usuario=self.request.user).exists()
+        return Personaje.objects.del_usuario(self.request.user).filter(id=personaje_id).exists()
 
     def get_queryset(self):
         personaje_id = self.kwargs.get('personaje_id')
-        return Combate.objects.filter(
+        return Combate.objects.del_usuario(self.request.user).filter(
             personaje_id=personaje_id,
-            personaje__usuario=self.request.user
         ).select_related('enemigo', 'botin', 'zona')
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    async def aget_context_data(self, object_list):
+        context = await super().aget_context_data(object_list)
         personaje_id = self.kwargs.get('personaje_id')
-        context['personaje'] = get_object_or_404(Personaje, id=personaje_id, usuario=self.request.user)
+        context['personaje'] = await aget_object_or_404(Personaje.objects.del_usuario(self.request.user), id=personaje_id)
         return context
 
 import random as _random
@@ -560,53 +821,40 @@ import random as _random
 
 def _calcular_danio(ataque, defensa):
     """Refined damage formula: (60-100% of atk) - (def//4), min 1."""
-    base_dmg = _random.randint(int(ataque * 0.6), ataque)
-    reduction = defensa // 4
+    base_dmg = _random.randint(*rango_golpe(ataque))
+    reduction = reduccion_defensa(defensa)
     return max(1, base_dmg - reduction)
 
 
-def _combate_state_key(personaje_id):
-    return f'combate_turnos_{personaje_id}'
+def _simular_combate(stats, vida, enemigo):
+    """Resuelve un combate entero con las reglas de la arena, atacando siempre.
 
+    Devuelve (victoria, vida_restante).
+    """
+    vida_enemigo = enemigo.vida_maxima
+    turno_personaje = stats['velocidad'] >= enemigo.velocidad
+    if stats['velocidad'] == enemigo.velocidad:
+        turno_personaje = _random.choice([True, False])
+    while vida > 0 and vida_enemigo > 0:
+        if turno_personaje:
+            vida_enemigo -= _calcular_danio(stats['ataque'], enemigo.defensa)
+        else:
+            vida -= _calcular_danio(enemigo.ataque, stats['defensa'])
+        turno_personaje = not turno_personaje
+    return vida_enemigo <= 0, max(0, vida)
 
-def _stats_efectivos(personaje):
-    """Returns effective stats including bonuses from equipped inventory items."""
-    ataque = personaje.ataque
-    defensa = personaje.defensa
-    velocidad = personaje.velocidad
-    # Robust health handling
-    base_vida = personaje.vida_actual if personaje.vida_actual is not None else personaje.salud_maxima
-    vida = base_vida
-    
-    arma = None
-    armadura = None
-    for inv in personaje.inventario_items.filter(equipado=True).select_related('objeto'):
-        obj = inv.objeto
-        ataque += obj.bonus_ataque
-        defensa += obj.bonus_defensa
-        velocidad += obj.bonus_velocidad
-        vida += obj.bonus_salud
-        if obj.slot == 'arma':
-            arma = obj.nombre
-        elif obj.slot == 'armadura':
-            armadura = obj.nombre
-            
-    return {
-        'ataque': ataque, 
-        'defensa': defensa, 
-        'velocidad': velocidad,
-        'vida_actual': vida, 
-        'vida_max': personaje.salud_maxima + (vida - base_vida),
-        'arma': arma, 
-        'armadura': armadura
-    }
+
+def _combate_state_key(personaje_id):
+    return f'combate_turnos_{personaje_id}'
 
 
 class CombateCreateView(LoginRequiredMixin, View):
-    """Prepara un combate por turnos seleccionando zona y enemigo."""
+    """Prepara un combate por turnos seleccionando zona y enemigo, o con un encuentro aleatorio."""
+
+    PREFIJO_ALEATORIO = 'aleatorio'
 
     def get(self, request, personaje_id):
-        personaje = get_object_or_404(Personaje, id=personaje_id, usuario=request.user)
+        personaje = _obtener_personaje_usuario(request, personaje_id)
         
         # Vida actual para comprobación (si es None, usamos salud_maxima por seguridad)
         vida = personaje.vida_actual if personaje.vida_actual is not None else personaje.salud_maxima
@@ -615,13 +863,10 @@ class CombateCreateView(LoginRequiredMixin, View):
             messages.error(request, f"¡{personaje.nombre} no tiene vida suficiente para combatir!")
             return redirect('juego:personaje-detalle', pk=personaje.id)
             
-        form = CombateForm()
-        return render(request, 'juego/combate_form.html', {
-            'form': form, 'personaje': personaje,
-        })
+        return self._render(request, personaje, CombateForm(), IniciarCombateForm(prefix=self.PREFIJO_ALEATORIO))
 
     def post(self, request, personaje_id):
-        personaje = get_object_or_404(Personaje, id=personaje_id, usuario=request.user)
+        personaje = _obtener_personaje_usuario(request, personaje_id)
 
         vida = personaje.vida_actual if personaje.vida_actual is not None else personaje.salud_maxima
         
@@ -629,45 +874,139 @@ class CombateCreateView(LoginRequiredMixin, View):
             messages.error(request, "Tu personaje no puede luchar sin vida.")
             return redirect('juego:personaje-detalle', pk=personaje.id)
 
-        form = CombateForm(request.POST)
-        if form.is_valid():
-            enemigo = form.cleaned_data['enemigo']
-            stats = _stats_efectivos(personaje)
-            personaje_inicia = stats['velocidad'] >= enemigo.velocidad
-            if stats['velocidad'] == enemigo.velocidad:
-                personaje_inicia = _random.choice([True, False])
-
-            state = {
-                'personaje_id': personaje.id,
-                'enemigo_id': enemigo.id,
-                'personaje_nombre': personaje.nombre,
-                'enemigo_nombre': enemigo.nombre,
-                'zona_nombre': enemigo.zona.nombre,
-                'es_jefe': enemigo.tipo == 'jefe',
-                'personaje_vida': stats['vida_actual'],
-                'personaje_vida_max': stats['vida_max'],
-                'personaje_ataque': stats['ataque'],
-                'personaje_defensa': stats['defensa'],
-                'enemigo_vida': enemigo.vida_maxima,
-                'enemigo_vida_max': enemigo.vida_maxima,
-                'enemigo_ataque': enemigo.ataque,
-                'enemigo_defensa': enemigo.defensa,
-                'enemigo_exp': enemigo.exp_otorgada,
-                'turno': 'personaje' if personaje_inicia else 'enemigo',
-                'log': [
-                    f"Comienza el combate contra {enemigo.nombre}.",
-                    f"Turno inicial: {'Personaje' if personaje_inicia else 'Enemigo'}."
-                ],
-            }
-
-            request.session[_combate_state_key(personaje.id)] = state
-            request.session.modified = True
-            return redirect('juego:combate-arena', personaje_id=personaje.id)
+        if request.POST.get('modo') == self.PREFIJO_ALEATORIO:
+            form = CombateForm()
+            form_aleatorio = IniciarCombateForm(request.POST, prefix=self.PREFIJO_ALEATORIO)
+            if form_aleatorio.is_valid():
+                enemigo = self._enemigo_aleatorio(form_aleatorio)
+                if enemigo is not None:
+                    return self._iniciar(request, personaje, enemigo)
+        else:
+            form = CombateForm(request.POST)
+            form_aleatorio = IniciarCombateForm(prefix=self.PREFIJO_ALEATORIO)
+            if form.is_valid():
+                if request.POST.get('modo') == 'automatico':
+                    return self._automatico(request, personaje, form.cleaned_data['enemigo'], form.cleaned_data['repeticiones'] or 1)
+                return self._iniciar(request, personaje, form.cleaned_data['enemigo'])
+
+        return self._render(request, personaje, form, form_aleatorio)
+
+    def _enemigo_aleatorio(self, form_aleatorio):
+        """Enemigo sorteado por el formulario, o None con el error añadido.
+
+        Si la tabla de encuentros estaba desfasada (p. ej. otro worker desactivo
+        el enemigo) se reconstruye y se sortea otra vez.
+        """
+        datos = form_aleatorio.cleaned_data
+        activos = Enemigo.objects.select_related('zona').filter(activo=True, zona__activa=True)
+        enemigo = activos.filter(pk=datos['enemigo_id']).first()
+        if enemigo is None:
+            invalidar_catalogo()
+            enemigo_id = elegir_enemigo(datos['zona'].id, datos['tipo'])
+            enemigo = activos.filter(pk=enemigo_id).first() if enemigo_id is not None else None
+        if enemigo is None:
+            form_aleatorio.add_error(
+                None, f'No hay enemigos de tipo "{datos["tipo"]}" activos en la zona "{datos["zona"].nombre}".'
+            )
+        return enemigo
 
+    def _render(self, request, personaje, form, form_aleatorio):
         return render(request, 'juego/combate_form.html', {
-            'form': form, 'personaje': personaje,
+            'form': form, 'form_aleatorio': form_aleatorio, 'personaje': personaje,
+            'recomendados': self._recomendados(personaje),
         })
 
+    def _recomendados(self, personaje):
+        """Enemigos de su nivel con la probabilidad de ganarles con la vida y el equipo actuales."""
+        stats = stats_efectivos(personaje)
+        actual = luchador_personaje(stats)
+        recomendados = recomendar_enemigos(personaje.nivel, actual._replace(vida=stats['vida_max']))
+        return [
+            {'enemigo': enemigo, 'probabilidad': probabilidad_victoria(actual, enemigo.luchador) * 100}
+            for enemigo in recomendados
+        ]
+
+    def _automatico(self, request, personaje, enemigo, repeticiones):
+        """Encadena combates contra ``enemigo`` hasta ``repeticiones`` o la primera derrota.
+
+        Todo se guarda en una transaccion: el personaje una vez, los combates
+        con ``bulk_create`` y el botin acumulado con un solo upsert.
+        """
+        stats = stats_efectivos(personaje)
+        vida = stats['vida_actual']
+        combates = []
+        botin = Counter()
+        for _ in range(repeticiones):
+            victoria, vida = _simular_combate(stats, vida, enemigo)
+            botin_id = tirar_botin(enemigo) if victoria else None
+            if botin_id is not None:
+                botin[botin_id] += 1
+            combates.append(Combate(
+                personaje=personaje,
+                enemigo=enemigo,
+                zona_id=enemigo.zona_id,
+                tipo=enemigo.tipo,
+                resultado='victoria' if victoria else 'derrota',
+                exp_ganada=enemigo.exp_otorgada if victoria else 0,
+                botin_id=botin_id,
+            ))
+            if not victoria:
+                break
+
+        victorias = sum(1 for combate in combates if combate.resultado == 'victoria')
+        bonus_salud = max(0, stats['vida_max'] - personaje.salud_maxima)
+        personaje.vida_actual = min(personaje.salud_maxima, max(0, vida - bonus_salud))
+        personaje.exp_actual += sum(combate.exp_ganada for combate in combates)
+
+        alias = personaje._state.db
+        with transaction.atomic(using=alias):
+            personaje.save()
+            Combate.objects.using(alias).bulk_create(combates)
+            conceder_botin(personaje, botin)
+
+        mensaje = (
+            f"{len(combates)} combates automáticos contra {enemigo.nombre}: {victorias} victorias, "
+            f"+{sum(combate.exp_ganada for combate in combates)} EXP y {sum(botin.values())} objetos de botín."
+        )
+        if victorias < len(combates):
+            messages.warning(request, f"{mensaje} {personaje.nombre} cayó en el último.")
+        else:
+            messages.success(request, mensaje)
+        return redirect('juego:combate-list', personaje_id=personaje.id)
+
+    def _iniciar(self, request, personaje, enemigo):
+        stats = stats_efectivos(personaje)
+        personaje_inicia = stats['velocidad'] >= enemigo.velocidad
+        if stats['velocidad'] == enemigo.velocidad:
+            personaje_inicia = _random.choice([True, False])
+
+        state = {
+            'personaje_id': personaje.id,
+            'enemigo_id': enemigo.id,
+            'personaje_nombre': personaje.nombre,
+            'enemigo_nombre': enemigo.nombre,
+            'zona_nombre': enemigo.zona.nombre,
+            'es_jefe': enemigo.tipo == 'jefe',
+            'personaje_vida': stats['vida_actual'],
+            'personaje_vida_max': stats['vida_max'],
+            'personaje_ataque': stats['ataque'],
+            'personaje_defensa': stats['defensa'],
+            'enemigo_vida': enemigo.vida_maxima,
+            'enemigo_vida_max': enemigo.vida_maxima,
+            'enemigo_ataque': enemigo.ataque,
+            'enemigo_defensa': enemigo.defensa,
+            'enemigo_exp': enemigo.exp_otorgada,
+            'turno': 'personaje' if personaje_inicia else 'enemigo',
+            'log': [
+                f"Comienza el combate contra {enemigo.nombre}.",
+                f"Turno inicial: {'Personaje' if personaje_inicia else 'Enemigo'}."
+            ],
+        }
+
+        request.session[_combate_state_key(personaje.id)] = state
+        request.session.modified = True
+        return redirect('juego:combate-arena', personaje_id=personaje.id)
+
 
 class CombateArenaView(LoginRequiredMixin, View):
     def _get_consumibles_curacion(self, personaje):
@@ -698,29 +1037,34 @@ class CombateArenaView(LoginRequiredMixin, View):
 
     def _finalizar_combate(self, request, personaje, state, resultado, exp_ganada=0):
         enemigo = get_object_or_404(Enemigo, id=state['enemigo_id'])
+        botin_id = tirar_botin(enemigo) if resultado == 'victoria' else None
 
         bonus_salud = max(0, state['personaje_vida_max'] - personaje.salud_maxima)
         vida_base_final = max(0, state['personaje_vida'] - bonus_salud)
         personaje.vida_actual = min(personaje.salud_maxima, vida_base_final)
         if exp_ganada > 0:
             personaje.exp_actual += exp_ganada
-        personaje.save()
 
-        combate = Combate.objects.create(
-            personaje=personaje,
-            enemigo=enemigo,
-            zona=enemigo.zona,
-            tipo=enemigo.tipo,
-            resultado=resultado,
-            exp_ganada=exp_ganada,
-            botin=None,
-        )
+        # Resultado, experiencia y botin se confirman juntos
+        with transaction.atomic(using=personaje._state.db):
+            personaje.save()
+            combate = Combate.objects.create(
+                personaje=personaje,
+                enemigo=enemigo,
+                zona_id=enemigo.zona_id,
+                tipo=enemigo.tipo,
+                resultado=resultado,
+                exp_ganada=exp_ganada,
+                botin_id=botin_id,
+            )
+            if botin_id is not None:
+                conceder_botin(personaje, {botin_id: 1})
 
         self._clear_state(request, personaje)
         return combate
 
     def get(self, request, personaje_id):
-        personaje = get_object_or_404(Personaje, id=personaje_id, usuario=request.user)
+        personaje = _obtener_personaje_usuario(request, personaje_id)
         state = self._get_state(request, personaje)
         if not state:
             messages.info(request, 'Primero debes iniciar un combate.')
@@ -752,7 +1096,7 @@ class CombateArenaView(LoginRequiredMixin, View):
         })
 
     def post(self, request, personaje_id):
-        personaje = get_object_or_404(Personaje, id=personaje_id, usuario=request.user)
+        personaje = _obtener_personaje_usuario(request, personaje_id)
         state = self._get_state(request, personaje)
         if not state:
             messages.info(request, 'No hay combate activo. Inicia uno nuevo.')